@@ -1,22 +1,202 @@
-from flask import Flask, request, jsonify
+from flask import (
+    Blueprint, Flask, Response, current_app, g, has_request_context, request, jsonify,
+    make_response, stream_with_context
+)
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.local import LocalProxy
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
+import atexit
+import base64
+import csv
 import datetime
+import gzip
+import heapq
+import itertools
+import json
+import math
+import os
+import queue
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict, deque, namedtuple
 from functools import wraps
+from export import CONTENT_TYPES, EXPORTERS, chunked
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.types import LargeBinary, TypeDecorator
 import uuid
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'sua-chave-secreta-aqui-mude-em-producao'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///animal_counter.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+try:
+    import orjson  # Opcional: serializa as listas de contagens bem mais rápido
+except ImportError:
+    orjson = None
 
-CORS(app)
-db = SQLAlchemy(app)
+db = SQLAlchemy()
+api = Blueprint('api', __name__)
+
+# Estado em memória (filas, caches, threads em segundo plano) é de cada app: create_app
+# cria os componentes em app.extensions e os nomes do módulo (broker, ingest_writer...)
+# apontam para os do app atual. Dois apps no mesmo processo não dividem banco nem caches.
+APP_COMPONENTS = {}
+running_apps = weakref.WeakSet()
+
+def app_component(name, factory):
+    APP_COMPONENTS[name] = factory
+    return LocalProxy(lambda: current_app.extensions['animal_counter'][name])
+
+# ========== CONFIGURAÇÃO ==========
+
+DEFAULT_CONFIG = {
+    'SECRET_KEY': 'sua-chave-secreta-aqui-mude-em-producao',
+    'SQLALCHEMY_DATABASE_URI': 'sqlite:///animal_counter.db',
+    'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+    'AUTH_CACHE_TTL': 60,  # Segundos que uma identidade autenticada fica em cache
+    'AUTH_CACHE_MAX_ENTRIES': 1024,
+    'AUTH_TRUST_TOKEN_CLAIMS': False,  # True: confia no user_id assinado no token sem consultar o banco
+    'SQLITE_BUSY_TIMEOUT': 5000,  # ms que uma conexão espera por um lock antes de falhar
+    'ARCHIVE_DIR': None,  # Contagens antigas em CSV comprimido (padrão: instance/archive)
+    'WORKER_SYNC_INTERVAL': 0,  # Segundos entre sincronizações com outros workers (0 = processo único)
+    'SLOW_REQUEST_THRESHOLD': 0.5,  # Segundos a partir dos quais a requisição e seu SQL vão para o log
+    'METRICS_TOKEN': None,  # Se definido, /api/metrics exige "Authorization: Bearer <token>"
+    # Limites das rotas públicas de ingestão (requisições/s e rajada; taxa 0 desliga)
+    'RATE_LIMIT_DEVICE_RATE': 5,
+    'RATE_LIMIT_DEVICE_BURST': 30,
+    'RATE_LIMIT_IP_RATE': 50,
+    'RATE_LIMIT_IP_BURST': 200,
+    'INGEST_BACKPRESSURE_ROWS': 10000,  # Linhas na fila do escritor a partir das quais a ingestão responde 503
+}
+
+def env_flag(value):
+    return value.strip().lower() in ('1', 'true', 'yes', 'sim', 'on')
+
+# Variável de ambiente -> (chave de configuração, conversão)
+ENV_CONFIG = {
+    'SECRET_KEY': ('SECRET_KEY', str),
+    'DATABASE_URL': ('SQLALCHEMY_DATABASE_URI', str),
+    'AUTH_CACHE_TTL': ('AUTH_CACHE_TTL', int),
+    'AUTH_CACHE_MAX_ENTRIES': ('AUTH_CACHE_MAX_ENTRIES', int),
+    'AUTH_TRUST_TOKEN_CLAIMS': ('AUTH_TRUST_TOKEN_CLAIMS', env_flag),
+    'SQLITE_BUSY_TIMEOUT': ('SQLITE_BUSY_TIMEOUT', int),
+    'ARCHIVE_DIR': ('ARCHIVE_DIR', str),
+    'WORKER_SYNC_INTERVAL': ('WORKER_SYNC_INTERVAL', float),
+    'SLOW_REQUEST_THRESHOLD': ('SLOW_REQUEST_THRESHOLD', float),
+    'METRICS_TOKEN': ('METRICS_TOKEN', str),
+    'RATE_LIMIT_DEVICE_RATE': ('RATE_LIMIT_DEVICE_RATE', float),
+    'RATE_LIMIT_DEVICE_BURST': ('RATE_LIMIT_DEVICE_BURST', float),
+    'RATE_LIMIT_IP_RATE': ('RATE_LIMIT_IP_RATE', float),
+    'RATE_LIMIT_IP_BURST': ('RATE_LIMIT_IP_BURST', float),
+    'INGEST_BACKPRESSURE_ROWS': ('INGEST_BACKPRESSURE_ROWS', int),
+}
+
+# Variável de ambiente -> opção do pool de conexões do SQLAlchemy
+ENV_POOL_OPTIONS = {
+    'DB_POOL_SIZE': 'pool_size',
+    'DB_MAX_OVERFLOW': 'max_overflow',
+    'DB_POOL_TIMEOUT': 'pool_timeout',
+    'DB_POOL_RECYCLE': 'pool_recycle',
+}
+
+def config_from_env(environ=os.environ):
+    config = {}
+    for name, (key, convert) in ENV_CONFIG.items():
+        if environ.get(name):
+            config[key] = convert(environ[name])
+    
+    engine_options = {
+        option: int(environ[name])
+        for name, option in ENV_POOL_OPTIONS.items()
+        if environ.get(name)
+    }
+    if engine_options:
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+    return config
+
+def configure_engine(engine, busy_timeout):
+    if engine.dialect.name != 'sqlite':
+        return
+    
+    @event.listens_for(engine, 'connect')
+    def configure_sqlite(dbapi_connection, connection_record):
+        # WAL deixa leituras rodarem junto com a escrita; com synchronous=NORMAL o commit
+        # não espera o fsync do WAL, que só acontece no checkpoint
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout)}')
+        cursor.close()
+
+def create_app(config=None):
+    # Configuração: padrões < variáveis de ambiente < dicionário passado aqui
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config_from_env())
+    if config:
+        app.config.update(config)
+    if not app.config['ARCHIVE_DIR']:
+        app.config['ARCHIVE_DIR'] = os.path.join(app.instance_path, 'archive')
+    
+    CORS(app)
+    db.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine, app.config['SQLITE_BUSY_TIMEOUT'])
+        instrument_engine(db.engine)
+    app.register_blueprint(api)
+    
+    # Os componentes em segundo plano guardam o app para abrir contextos nas suas threads;
+    # as threads só começam na primeira requisição, já dentro do processo do worker
+    components = {name: factory() for name, factory in APP_COMPONENTS.items()}
+    app.extensions['animal_counter'] = components
+    for component in components.values():
+        if hasattr(component, 'init_app'):
+            component.init_app(app)
+    running_apps.add(app)
+    
+    return app
 
 # ========== MODELOS DO BANCO DE DADOS ==========
 
+def uuid7(timestamp=None):
+    # UUIDv7 (RFC 9562): 48 bits de milissegundos Unix seguidos de bits aleatórios,
+    # então IDs novos sempre entram no fim do índice da chave primária
+    millis = int((time.time() if timestamp is None else timestamp) * 1000) & 0xFFFFFFFFFFFF
+    rand = int.from_bytes(os.urandom(10), 'big')
+    value = (
+        millis << 80
+        | 0x7 << 76
+        | (rand >> 68) << 64
+        | 0b10 << 62
+        | rand & 0x3FFFFFFFFFFFFFFF
+    )
+    return uuid.UUID(int=value)
+
+def uuid7_floor(millis):
+    # Menor UUIDv7 possível no instante millis: IDs criados a partir dele são maiores
+    return uuid.UUID(int=max(int(millis), 0) << 80)
+
+def uuid7_millis(value):
+    return uuid.UUID(str(value)).int >> 80
+
+class CompactUUID(TypeDecorator):
+    # Guarda o UUID em 16 bytes; a aplicação e a API continuam usando a string de 36 caracteres
+    impl = LargeBinary(16)
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, uuid.UUID):
+            value = uuid.UUID(value)
+        return value.bytes
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return str(uuid.UUID(bytes=bytes(value)))
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -31,11 +211,20 @@ class User(db.Model):
         }
 
 class Count(db.Model):
-    id = db.Column(db.String(36), primary_key=True)
+    __table_args__ = (
+        db.Index('ix_count_timestamp', 'timestamp'),
+        db.Index('ix_count_device_timestamp', 'device_id', 'timestamp'),
+        db.Index('ix_count_type_timestamp', 'animal_type', 'timestamp'),
+        db.Index('ux_count_event_id', 'event_id', unique=True),
+    )
+    
+    id = db.Column(CompactUUID, primary_key=True, default=lambda: str(uuid7()))
     device_id = db.Column(db.String(36), nullable=False)
     count = db.Column(db.Integer, nullable=False)
     animal_type = db.Column(db.String(50), default='desconhecido')
     timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    # ID gerado no dispositivo no momento da detecção; reenviar o mesmo evento não duplica a contagem
+    event_id = db.Column(db.String(64), nullable=True)
     
     def to_dict(self):
         return {
@@ -46,6 +235,11 @@ class Count(db.Model):
             'timestamp': self.timestamp.isoformat()
         }
 
+# Colunas das rotas de listagem, na ordem de Count.to_dict(). Selecionar só elas devolve
+# tuplas, sem montar um objeto Count (e seu estado no ORM) para cada linha
+COUNT_COLUMNS = (Count.id, Count.device_id, Count.count, Count.animal_type, Count.timestamp)
+COUNT_FIELDS = tuple(column.key for column in COUNT_COLUMNS)
+
 class Device(db.Model):
     id = db.Column(db.String(36), primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -54,51 +248,1254 @@ class Device(db.Model):
     registered_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     last_seen = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     
+    def current_status(self):
+        # A coluna status não é mantida; o estado sai do último heartbeat gravado
+        return device_status(self.last_seen, datetime.datetime.utcnow())
+    
     def to_dict(self):
         return {
             'id': self.id,
             'name': self.name,
             'location': self.location,
-            'status': self.status,
+            'status': self.current_status(),
             'registered_at': self.registered_at.isoformat(),
             'last_seen': self.last_seen.isoformat()
         }
 
+class HourlyCount(db.Model):
+    __tablename__ = 'count_hourly'
+    
+    bucket = db.Column(db.DateTime, primary_key=True)
+    device_id = db.Column(db.String(36), primary_key=True)
+    animal_type = db.Column(db.String(50), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    records = db.Column(db.Integer, nullable=False, default=0)
+
+class DailyCount(db.Model):
+    __tablename__ = 'count_daily'
+    
+    bucket = db.Column(db.DateTime, primary_key=True)
+    device_id = db.Column(db.String(36), primary_key=True)
+    animal_type = db.Column(db.String(50), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    records = db.Column(db.Integer, nullable=False, default=0)
+
+class ArchiveMonth(db.Model):
+    __tablename__ = 'archive_month'
+    
+    month = db.Column(db.String(7), primary_key=True)  # AAAA-MM
+    archived_until = db.Column(db.DateTime, nullable=False)  # Linhas do mês anteriores a isto estão no arquivo
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+class ArchivedTotal(db.Model):
+    __tablename__ = 'archive_total'
+    
+    device_id = db.Column(db.String(36), primary_key=True)
+    animal_type = db.Column(db.String(50), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    records = db.Column(db.Integer, nullable=False, default=0)
+
+# ========== AGREGADOS POR HORA E POR DIA ==========
+
+ROLLUPS = {
+    'hour': (HourlyCount, lambda ts: ts.replace(minute=0, second=0, microsecond=0)),
+    'day': (DailyCount, lambda ts: ts.replace(hour=0, minute=0, second=0, microsecond=0)),
+}
+
+def upsert_insert(model):
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+def update_rollups(rows):
+    # Deve ser chamada na mesma transação que insere as linhas em Count
+    for model, truncate in ROLLUPS.values():
+        buckets = {}
+        for row in rows:
+            key = (truncate(row['timestamp']), row['device_id'], row['animal_type'])
+            total, records = buckets.get(key, (0, 0))
+            buckets[key] = (total + row['count'], records + 1)
+        
+        values = [
+            {'bucket': bucket, 'device_id': device_id, 'animal_type': animal_type,
+             'total': total, 'records': records}
+            for (bucket, device_id, animal_type), (total, records) in buckets.items()
+        ]
+        
+        stmt = upsert_insert(model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['bucket', 'device_id', 'animal_type'],
+            set_={
+                'total': model.total + stmt.excluded.total,
+                'records': model.records + stmt.excluded.records,
+            }
+        )
+        db.session.execute(stmt, values)
+
+# ========== ARQUIVO DE CONTAGENS ANTIGAS ==========
+
+ARCHIVE_COLUMNS = list(COUNT_FIELDS)
+ARCHIVE_CACHE_MONTHS = 3  # Meses arquivados mantidos em memória depois de lidos
+
+def archive_path(month):
+    return os.path.join(current_app.config['ARCHIVE_DIR'], f'counts-{month}.csv.gz')
+
+def month_bounds(month):
+    year, number = map(int, month.split('-'))
+    start = datetime.datetime(year, number, 1)
+    end = datetime.datetime(year + number // 12, number % 12 + 1, 1)
+    return start, end
+
+def read_archive_file(path):
+    # Linhas em ordem crescente de (timestamp, id), como foram gravadas pelo manage_db.py archive
+    rows = []
+    with gzip.open(path, 'rt', newline='') as f:
+        for record in csv.DictReader(f):
+            rows.append({
+                'id': record['id'],
+                'device_id': record['device_id'],
+                'count': int(record['count']),
+                'animal_type': record['animal_type'],
+                'timestamp': datetime.datetime.fromisoformat(record['timestamp'])
+            })
+    return rows
+
+class ArchiveReader:
+    def __init__(self):
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def month_rows(self, month):
+        path = archive_path(month)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return []
+        
+        with self.lock:
+            cached = self.cache.get(month)
+            if cached and cached[0] == mtime:
+                self.cache.move_to_end(month)
+                return cached[1]
+        
+        rows = read_archive_file(path)
+        with self.lock:
+            self.cache[month] = (mtime, rows)
+            self.cache.move_to_end(month)
+            while len(self.cache) > ARCHIVE_CACHE_MONTHS:
+                self.cache.popitem(last=False)
+        return rows
+    
+    def counts(self, months, start=None, end=None, device_id=None, before=None, descending=True):
+        # Contagens arquivadas ordenadas por (timestamp, id), como a consulta ao banco;
+        # months vem do mais recente para o mais antigo
+        for month in (months if descending else reversed(months)):
+            month_start, month_end = month_bounds(month)
+            if (start and month_end <= start) or (end and month_start > end):
+                continue
+            if before and month_start > before[0]:
+                continue
+            
+            rows = self.month_rows(month)
+            for row in (reversed(rows) if descending else rows):
+                timestamp = row['timestamp']
+                if before and (timestamp, row['id']) >= before:
+                    continue
+                if descending:
+                    if end and timestamp > end:
+                        continue
+                    if start and timestamp < start:
+                        break
+                else:
+                    if start and timestamp < start:
+                        continue
+                    if end and timestamp > end:
+                        break
+                if device_id and row['device_id'] != device_id:
+                    continue
+                yield CountRow(**row)
+
+CountRow = namedtuple('CountRow', COUNT_FIELDS)
+
+archive_reader = app_component('archive_reader', ArchiveReader)
+
+def archived_months():
+    return db.session.execute(
+        db.select(ArchiveMonth.month).order_by(ArchiveMonth.month.desc())
+    ).scalars().all()
+
+def merge_counts(*sources, descending=True):
+    # Junta fontes já ordenadas; uma linha presente no banco e no arquivo
+    # (arquivamento interrompido no meio) aparece só uma vez
+    last_id = None
+    for count in heapq.merge(*sources, key=lambda c: (c.timestamp, c.id), reverse=descending):
+        if count.id != last_id:
+            last_id = count.id
+            yield count
+
+# ========== EVENTOS EM TEMPO REAL (SSE) ==========
+
+SSE_KEEPALIVE_SECONDS = 15
+SSE_QUEUE_SIZE = 256
+STATS_PUSH_INTERVAL = 1
+
+class EventBroker:
+    def __init__(self):
+        self.app = None
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.stats_dirty = threading.Event()
+        self.stats_thread = None
+    
+    def init_app(self, app):
+        self.app = app
+    
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            if self.stats_thread is None:
+                self.stats_thread = threading.Thread(target=self.push_stats_loop, daemon=True)
+                self.stats_thread.start()
+        return subscriber
+    
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+    
+    def is_subscribed(self, subscriber):
+        with self.lock:
+            return subscriber in self.subscribers
+    
+    def has_subscribers(self):
+        return bool(self.subscribers)
+    
+    def publish(self, event, data):
+        if not self.subscribers:
+            return
+        
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        with self.lock:
+            subscribers = list(self.subscribers)
+        
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # Cliente lento: é desconectado e recarrega tudo ao reconectar
+                self.unsubscribe(subscriber)
+    
+    def mark_stats_dirty(self):
+        self.stats_dirty.set()
+    
+    def push_stats_loop(self):
+        # Recalcula os totais no máximo uma vez por intervalo, independente
+        # do número de escritas e de navegadores conectados. Cada worker faz isso ao
+        # ver escritas dos outros, então compute_stats lê só os agregados, nunca varre count
+        while True:
+            self.stats_dirty.wait()
+            time.sleep(STATS_PUSH_INTERVAL)
+            self.stats_dirty.clear()
+            
+            if not self.has_subscribers():
+                continue
+            
+            try:
+                with self.app.app_context():
+                    self.publish('stats', compute_stats())
+            except Exception as e:
+                print(f"Erro ao publicar estatísticas: {e}")
+
+broker = app_component('broker', EventBroker)
+
+def publish_counts(rows):
+    worker_sync.remember(row['id'] for row in rows)
+    broker.mark_stats_dirty()
+    if broker.has_subscribers():
+        broker.publish('count', [{
+            'id': row['id'],
+            'device_id': row['device_id'],
+            'count': row['count'],
+            'animal_type': row['animal_type'],
+            'timestamp': row['timestamp'].isoformat()
+        } for row in rows])
+
+# ========== CACHE DE RESPOSTAS (ETAG) ==========
+
+RESPONSE_CACHE_MAX_ENTRIES = 256
+RESPONSE_CACHE_MAX_AGE = 60  # Janelas como "esta semana" mudam com o tempo mesmo sem escritas
+
+def new_boot_id():
+    # Prefixo das ETags: as versões são contadores locais do processo, então o mesmo
+    # número em dois processos não significa os mesmos dados
+    global BOOT_ID
+    BOOT_ID = uuid.uuid4().hex[:8]
+
+new_boot_id()
+# Com preload_app os workers do gunicorn nascem de um fork do master já importado;
+# cada um precisa do seu próprio prefixo
+os.register_at_fork(after_in_child=new_boot_id)
+
+class DataVersion:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+    
+    def bump(self):
+        with self.lock:
+            self.value += 1
+
+class ResponseCache:
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+    
+    def get(self, key, tag):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and entry[0] == tag:
+            return entry[1]
+        return None
+    
+    def put(self, key, tag, body):
+        with self.lock:
+            if len(self.entries) >= RESPONSE_CACHE_MAX_ENTRIES:
+                self.entries.clear()
+            self.entries[key] = (tag, body)
+
+# Versões separadas: heartbeats mudam os dispositivos a todo momento e não devem
+# invalidar as respostas que só leem contagens
+count_version = app_component('count_version', DataVersion)
+device_version = app_component('device_version', DataVersion)
+response_cache = app_component('response_cache', ResponseCache)
+
+def cached_response(version):
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            slot = int(time.time() // RESPONSE_CACHE_MAX_AGE)
+            key = (request.endpoint, request.query_string)
+            tag = f'{BOOT_ID}-{version.value}-{slot}-{zlib.crc32(request.query_string):08x}'
+            
+            body = response_cache.get(key, tag)
+            if body is None:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                response_cache.put(key, tag, body)
+            
+            response = Response(body, mimetype='application/json')
+            response.set_etag(tag)
+            response.headers['Cache-Control'] = 'no-cache'
+            # Responde 304 Not Modified quando o If-None-Match confere
+            return response.make_conditional(request)
+        
+        return decorated
+    
+    return decorator
+
+# ========== LIVENESS DOS DISPOSITIVOS ==========
+
+HEARTBEAT_FLUSH_INTERVAL = 10  # Segundos entre gravações em lote de last_seen
+DEVICE_OFFLINE_AFTER = datetime.timedelta(minutes=5)
+
+def device_status(last_seen, now):
+    return 'ativo' if last_seen and now - last_seen < DEVICE_OFFLINE_AFTER else 'offline'
+
+class DeviceRegistry:
+    def __init__(self):
+        self.app = None
+        self.devices = {}
+        self.dirty = {}
+        self.online = set()
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.flush_thread = None
+    
+    def init_app(self, app):
+        self.app = app
+    
+    def ensure_loaded(self):
+        if self.loaded:
+            return
+        devices = Device.query.order_by(Device.registered_at).all()
+        with self.lock:
+            if not self.loaded:
+                for device in devices:
+                    if device.id not in self.devices:
+                        self.insert(device)
+                self.loaded = True
+        self.start_flusher()
+    
+    def start_flusher(self):
+        with self.lock:
+            if self.flush_thread is None:
+                self.flush_thread = threading.Thread(target=self.flush_loop, daemon=True)
+                self.flush_thread.start()
+    
+    def entry(self, device):
+        return {
+            'id': device.id,
+            'name': device.name,
+            'location': device.location,
+            'registered_at': device.registered_at.isoformat(),
+            'last_seen': device.last_seen
+        }
+    
+    def view(self, entry, now):
+        return {
+            **entry,
+            'status': device_status(entry['last_seen'], now),
+            'last_seen': entry['last_seen'].isoformat()
+        }
+    
+    def insert(self, device):
+        entry = self.entry(device)
+        self.devices[device.id] = entry
+        if datetime.datetime.utcnow() - entry['last_seen'] < DEVICE_OFFLINE_AFTER:
+            self.online.add(device.id)
+    
+    def add(self, device):
+        with self.lock:
+            self.insert(device)
+    
+    def remove(self, device_id):
+        with self.lock:
+            self.devices.pop(device_id, None)
+            self.dirty.pop(device_id, None)
+            self.online.discard(device_id)
+    
+    def heartbeat(self, device_id):
+        self.ensure_loaded()
+        now = datetime.datetime.utcnow()
+        
+        with self.lock:
+            entry = self.devices.get(device_id)
+        
+        if entry is None:
+            # Pode ter sido registrado por outro processo
+            device = db.session.get(Device, device_id)
+            if not device:
+                return None
+            self.add(device)
+        
+        with self.lock:
+            entry = self.devices.get(device_id)
+            if entry is None:
+                return None
+            entry['last_seen'] = now
+            self.dirty[device_id] = now
+            self.online.add(device_id)
+            return self.view(entry, now)
+    
+    def reload(self):
+        # Aplica o que outros workers gravaram no banco: dispositivos novos ou removidos
+        # e last_seen mais recente; devolve o que mudou para ser publicado no SSE
+        devices = Device.query.all()
+        now = datetime.datetime.utcnow()
+        changed = []
+        
+        with self.lock:
+            current = set()
+            for device in devices:
+                current.add(device.id)
+                entry = self.devices.get(device.id)
+                if entry is None:
+                    self.insert(device)
+                    changed.append(self.view(self.devices[device.id], now))
+                elif device.last_seen and device.last_seen > entry['last_seen']:
+                    entry['last_seen'] = device.last_seen
+                    if now - device.last_seen < DEVICE_OFFLINE_AFTER:
+                        self.online.add(device.id)
+                    changed.append(self.view(entry, now))
+            
+            removed = [device_id for device_id in self.devices if device_id not in current]
+            for device_id in removed:
+                self.devices.pop(device_id, None)
+                self.dirty.pop(device_id, None)
+                self.online.discard(device_id)
+            self.loaded = True
+        
+        return changed, removed
+    
+    def snapshot(self):
+        self.ensure_loaded()
+        now = datetime.datetime.utcnow()
+        with self.lock:
+            return [self.view(entry, now) for entry in self.devices.values()]
+    
+    def expire(self):
+        # Dispositivos que passaram do limite de silêncio desde a última verificação
+        now = datetime.datetime.utcnow()
+        with self.lock:
+            expired = [
+                device_id for device_id in self.online
+                if now - self.devices[device_id]['last_seen'] >= DEVICE_OFFLINE_AFTER
+            ]
+            self.online.difference_update(expired)
+            return [self.view(self.devices[device_id], now) for device_id in expired]
+    
+    def flush(self):
+        with self.lock:
+            pending, self.dirty = self.dirty, {}
+        
+        if not pending:
+            return 0
+        
+        try:
+            db.session.execute(
+                db.update(Device.__table__)
+                .where(Device.__table__.c.id == db.bindparam('device_id'))
+                .values(last_seen=db.bindparam('seen_at')),
+                [{'device_id': device_id, 'seen_at': seen_at} for device_id, seen_at in pending.items()]
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self.lock:
+                for device_id, seen_at in pending.items():
+                    if device_id in self.devices:
+                        self.dirty.setdefault(device_id, seen_at)
+            raise
+        
+        return len(pending)
+    
+    def flush_loop(self):
+        while True:
+            time.sleep(HEARTBEAT_FLUSH_INTERVAL)
+            with self.app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Erro ao gravar heartbeats: {e}")
+                
+                expired = self.expire()
+                if expired:
+                    device_version.bump()
+                    for device in expired:
+                        broker.publish('device', device)
+
+device_registry = app_component('device_registry', DeviceRegistry)
+
+@atexit.register
+def flush_heartbeats_on_exit():
+    for app in list(running_apps):
+        with app.app_context():
+            device_registry.flush()
+
+# ========== ESCRITA AGRUPADA DE CONTAGENS ==========
+
+INGEST_FLUSH_INTERVAL = 0.005  # Segundos que o escritor espera para juntar mais eventos no mesmo commit
+INGEST_MAX_GROUP = 2000        # Máximo de linhas por transação
+INGEST_QUEUE_SIZE = 20000      # Linhas aguardando gravação antes de recusar com 503
+INGEST_COMMIT_TIMEOUT = 10     # Segundos que uma requisição espera pela gravação
+RECENT_EVENT_IDS = 50000       # event_ids já gravados lembrados em memória
+
+class IngestFull(Exception):
+    pass
+
+class RecentEvents:
+    # event_id -> id da contagem, para responder reenvios recentes sem passar pelo banco.
+    # O índice único em Count.event_id continua sendo a garantia; isto é só um atalho.
+    def __init__(self, max_entries=RECENT_EVENT_IDS):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.hits = 0
+    
+    def get(self, event_id):
+        with self.lock:
+            count_id = self.entries.get(event_id)
+            if count_id is not None:
+                self.entries.move_to_end(event_id)
+                self.hits += 1
+            return count_id
+    
+    def add(self, pairs):
+        with self.lock:
+            for event_id, count_id in pairs:
+                self.entries[event_id] = count_id
+                self.entries.move_to_end(event_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+recent_events = app_component('recent_events', RecentEvents)
+
+class PendingWrite:
+    def __init__(self, rows):
+        self.rows = rows
+        self.done = threading.Event()
+        self.error = None
+        self.duplicates = {}  # id provisório da linha -> id da contagem gravada antes com o mesmo event_id
+    
+    def finish(self, error=None):
+        self.error = error
+        self.done.set()
+
+class IngestWriter:
+    # As rotas enfileiram as linhas já validadas e uma única thread grava tudo o que
+    # chegou em poucos milissegundos numa só transação (group commit). Cada requisição
+    # responde quando a transação com as suas linhas foi confirmada.
+    def __init__(self):
+        self.app = None
+        self.queue = queue.Queue()
+        self.queued_rows = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.commits = 0
+        self.rows_written = 0
+    
+    def init_app(self, app):
+        self.app = app
+    
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+    
+    def submit(self, rows):
+        self.start()
+        with self.lock:
+            if self.queued_rows + len(rows) > INGEST_QUEUE_SIZE:
+                raise IngestFull()
+            self.queued_rows += len(rows)
+        pending = PendingWrite(rows)
+        self.queue.put(pending)
+        return pending
+    
+    def write(self, rows):
+        if not rows:
+            return {}
+        pending = self.submit(rows)
+        if not pending.done.wait(INGEST_COMMIT_TIMEOUT):
+            raise TimeoutError('Tempo esgotado aguardando a gravação')
+        if pending.error is not None:
+            raise pending.error
+        return pending.duplicates
+    
+    def collect(self, first):
+        group = [first]
+        size = len(first.rows)
+        deadline = time.monotonic() + INGEST_FLUSH_INTERVAL
+        while size < INGEST_MAX_GROUP:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if pending is None:
+                self.queue.put(None)
+                break
+            group.append(pending)
+            size += len(pending.rows)
+        return group
+    
+    def commit(self, rows):
+        # Devolve as linhas realmente inseridas: as que repetem um event_id já gravado
+        # são ignoradas pelo ON CONFLICT DO NOTHING e ficam fora dos agregados
+        try:
+            if any(row['event_id'] for row in rows):
+                stmt = upsert_insert(Count).on_conflict_do_nothing(index_elements=['event_id'])
+                inserted = set(db.session.execute(stmt.returning(Count.id), rows).scalars())
+                rows = [row for row in rows if row['id'] in inserted]
+            else:
+                db.session.execute(db.insert(Count), rows)
+            if rows:
+                update_rollups(rows)
+            db.session.commit()
+            return rows
+        except Exception:
+            db.session.rollback()
+            raise
+    
+    def resolve_duplicates(self, written, inserted):
+        inserted_ids = {row['id'] for row in inserted}
+        duplicates = [row for pending in written for row in pending.rows if row['id'] not in inserted_ids]
+        if not duplicates:
+            return
+        
+        existing = dict(db.session.execute(
+            db.select(Count.event_id, Count.id).where(
+                Count.event_id.in_({row['event_id'] for row in duplicates})
+            )
+        ).all())
+        for pending in written:
+            pending.duplicates = {
+                row['id']: existing.get(row['event_id'])
+                for row in pending.rows if row['id'] not in inserted_ids
+            }
+        recent_events.add(existing.items())
+    
+    def flush(self, group):
+        rows = [row for pending in group for row in pending.rows]
+        written = []
+        inserted = []
+        
+        with self.app.app_context():
+            try:
+                inserted = self.commit(rows)
+                written = group
+            except Exception:
+                # Grava cada requisição separadamente para que um erro não derrube as outras
+                for pending in group:
+                    try:
+                        inserted.extend(self.commit(pending.rows))
+                        written.append(pending)
+                    except Exception as e:
+                        pending.finish(e)
+            
+            if len(inserted) < sum(len(pending.rows) for pending in written):
+                self.resolve_duplicates(written, inserted)
+            
+            with self.lock:
+                self.queued_rows -= len(rows)
+                if written:
+                    self.commits += 1 if len(written) == len(group) else len(written)
+                    self.rows_written += len(inserted)
+            
+            if inserted:
+                count_version.bump()
+                recent_events.add((row['event_id'], row['id']) for row in inserted if row['event_id'])
+            for pending in written:
+                pending.finish()
+            if inserted:
+                metrics.observe_ingest(inserted)
+                publish_counts(inserted)
+    
+    def run(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            group = self.collect(first)
+            try:
+                self.flush(group)
+            except Exception as e:
+                print(f"Erro no escritor de contagens: {e}")
+                for pending in group:
+                    if not pending.done.is_set():
+                        pending.finish(e)
+    
+    def stop(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=INGEST_COMMIT_TIMEOUT)
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'queued_rows': self.queued_rows,
+                'commits': self.commits,
+                'rows_written': self.rows_written
+            }
+
+ingest_writer = app_component('ingest_writer', IngestWriter)
+
+@atexit.register
+def stop_ingest_writers():
+    for app in list(running_apps):
+        with app.app_context():
+            ingest_writer.stop()
+
+# ========== SINCRONIZAÇÃO ENTRE WORKERS ==========
+
+SYNC_OVERLAP_MS = 2000     # Uma contagem pode ser confirmada um pouco depois de ganhar o ID
+SYNC_SEEN_IDS = 20000      # IDs de contagens já publicadas lembrados para não repetir eventos
+
+class WorkerSync:
+    # Com vários processos (gunicorn), cada worker tem seu próprio cache de respostas,
+    # registro de dispositivos e clientes SSE. Esta thread consulta o banco a cada
+    # WORKER_SYNC_INTERVAL e aplica neste processo o que os outros workers gravaram.
+    def __init__(self):
+        self.app = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.seen = OrderedDict()
+        self.last_count_id = None
+        self.last_poll = None
+        self.device_signature = None
+    
+    def init_app(self, app):
+        self.app = app
+    
+    def start(self):
+        if self.thread is not None or not self.app or not self.app.config['WORKER_SYNC_INTERVAL']:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+    
+    def remember(self, ids):
+        with self.lock:
+            for count_id in ids:
+                self.seen[count_id] = None
+            while len(self.seen) > SYNC_SEEN_IDS:
+                self.seen.popitem(last=False)
+    
+    def unseen_counts(self, since_ms):
+        # IDs UUIDv7 começam pelo instante em que a linha foi criada; tudo o que outro
+        # worker confirmou desde a última consulta tem ID a partir de since_ms
+        floor = uuid7_floor(since_ms)
+        counts = db.session.execute(
+            db.select(Count).where(Count.id > str(floor)).order_by(Count.id)
+        ).scalars().all()
+        
+        with self.lock:
+            fresh = [count for count in counts if count.id not in self.seen]
+        self.remember(count.id for count in fresh)
+        return fresh
+    
+    def poll(self):
+        polled_at = time.time() * 1000
+        latest_id = db.session.execute(db.select(db.func.max(Count.id))).scalar()
+        signature = tuple(db.session.execute(
+            db.select(db.func.count(Device.id), db.func.max(Device.last_seen), db.func.max(Device.registered_at))
+        ).one())
+        
+        if latest_id != self.last_count_id:
+            if self.last_poll is None:
+                # Primeira consulta: só marca o que já existe como visto
+                self.unseen_counts(polled_at - SYNC_OVERLAP_MS)
+            else:
+                fresh = self.unseen_counts(self.last_poll - SYNC_OVERLAP_MS)
+                if fresh:
+                    broker.publish('count', [count.to_dict() for count in fresh])
+                    broker.mark_stats_dirty()
+            self.last_count_id = latest_id
+            count_version.bump()
+        
+        if signature != self.device_signature:
+            if self.device_signature is None:
+                device_registry.ensure_loaded()
+            else:
+                devices, removed = device_registry.reload()
+                for device in devices:
+                    broker.publish('device', device)
+                for device_id in removed:
+                    broker.publish('device_removed', {'id': device_id})
+            self.device_signature = signature
+            device_version.bump()
+        
+        self.last_poll = polled_at
+    
+    def run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self.poll()
+            except Exception as e:
+                print(f"Erro ao sincronizar com outros workers: {e}")
+            time.sleep(self.app.config['WORKER_SYNC_INTERVAL'])
+
+worker_sync = app_component('worker_sync', WorkerSync)
+
+@api.before_app_request
+def start_worker_sync():
+    worker_sync.start()
+
 # ========== INICIALIZAR BANCO DE DADOS ==========
 
-def init_db():
+def init_db(app):
+    # Só para desenvolvimento; em produção o esquema é mantido pelo manage_db.py migrate
     with app.app_context():
         db.create_all()
         print("Banco de dados inicializado!")
 
+# ========== CACHE DE AUTENTICAÇÃO ==========
+
+AuthenticatedUser = namedtuple('AuthenticatedUser', ['id', 'username'])
+
+class AuthCache:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, token):
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry and entry[0] > time.time():
+                self.entries.move_to_end(token)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self.entries[token]
+            self.misses += 1
+            return None
+    
+    def put(self, token, user, expires_at):
+        with self.lock:
+            self.entries[token] = (expires_at, user)
+            self.entries.move_to_end(token)
+            while len(self.entries) > current_app.config['AUTH_CACHE_MAX_ENTRIES']:
+                self.entries.popitem(last=False)
+    
+    def invalidate_user(self, username):
+        with self.lock:
+            for token, (_, user) in list(self.entries.items()):
+                if user.username == username:
+                    del self.entries[token]
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'size': len(self.entries),
+                'max_entries': current_app.config['AUTH_CACHE_MAX_ENTRIES'],
+                'ttl': current_app.config['AUTH_CACHE_TTL']
+            }
+
+auth_cache = app_component('auth_cache', AuthCache)
+
 # ========== DECORADOR DE AUTENTICAÇÃO ==========
 
+def authenticate(token):
+    if not token:
+        return None, (jsonify({'message': 'Token não fornecido'}), 401)
+    
+    current_user = auth_cache.get(token)
+    if current_user:
+        return current_user, None
+    
+    try:
+        data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+        
+        # Tickets do /api/stream só servem para abrir o stream
+        if 'purpose' in data:
+            return None, (jsonify({'message': 'Token inválido'}), 401)
+        
+        if current_app.config['AUTH_TRUST_TOKEN_CLAIMS'] and 'user_id' in data:
+            current_user = AuthenticatedUser(data['user_id'], data['username'])
+        else:
+            user = User.query.filter_by(username=data['username']).first()
+            
+            if not user:
+                return None, (jsonify({'message': 'Usuário não encontrado'}), 401)
+            
+            current_user = AuthenticatedUser(user.id, user.username)
+            
+    except Exception as e:
+        return None, (jsonify({'message': 'Token inválido', 'error': str(e)}), 401)
+    
+    # Nunca mantém em cache além da expiração do próprio token
+    expires_at = min(time.time() + current_app.config['AUTH_CACHE_TTL'], data.get('exp', float('inf')))
+    auth_cache.put(token, current_user, expires_at)
+    
+    return current_user, None
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         token = request.headers.get('Authorization')
         
-        if not token:
-            return jsonify({'message': 'Token não fornecido'}), 401
+        if token:
+            token = token.split(' ')[-1]
         
-        try:
-            token = token.split(' ')[1]
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            current_user = User.query.filter_by(username=data['username']).first()
-            
-            if not current_user:
-                return jsonify({'message': 'Usuário não encontrado'}), 401
-                
-        except Exception as e:
-            return jsonify({'message': 'Token inválido', 'error': str(e)}), 401
+        current_user, error = authenticate(token)
+        if error:
+            return error
         
         return f(current_user, *args, **kwargs)
     
     return decorated
 
+# ========== LIMITE DE REQUISIÇÕES ==========
+
+RATE_LIMIT_MAX_KEYS = 10000  # Buckets em memória; os usados há mais tempo são descartados
+INGEST_RETRY_AFTER = 1       # Segundos sugeridos ao cliente quando a fila do escritor está cheia
+
+class RateLimiter:
+    # Token bucket por chave: cada uma ganha `rate` fichas por segundo, até `burst`, e cada
+    # requisição gasta uma. Os buckets ficam num OrderedDict limitado (LRU), então memória
+    # e custo por requisição não crescem com a quantidade de dispositivos.
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_keys = max_keys
+        self.limited = 0
+    
+    def take(self, key, rate, burst):
+        # Devolve 0 se a requisição pode passar ou os segundos até a próxima ficha
+        if not rate:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+                self.limited += 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
+rate_limiter = app_component('rate_limiter', RateLimiter)
+
+def rate_limit(device_ids):
+    # Devolve a resposta 429 se o IP ou algum dos dispositivos passou do limite
+    config = current_app.config
+    wait = rate_limiter.take(('ip', request.remote_addr), config['RATE_LIMIT_IP_RATE'], config['RATE_LIMIT_IP_BURST'])
+    for device_id in ([] if wait else device_ids):
+        wait = rate_limiter.take(
+            ('device', device_id), config['RATE_LIMIT_DEVICE_RATE'], config['RATE_LIMIT_DEVICE_BURST']
+        )
+        if wait:
+            break
+    
+    if not wait:
+        return None
+    retry_after = math.ceil(wait)
+    return jsonify({
+        'message': 'Limite de requisições excedido, tente novamente mais tarde',
+        'retry_after': retry_after
+    }), 429, {'Retry-After': str(retry_after)}
+
+def overloaded():
+    return jsonify({'message': 'Servidor sobrecarregado, tente novamente'}), 503, {
+        'Retry-After': str(INGEST_RETRY_AFTER)
+    }
+
+def ingest_backpressure():
+    # Recusa cedo, antes de validar o corpo, quando o escritor já está atrasado
+    if ingest_writer.queued_rows >= current_app.config['INGEST_BACKPRESSURE_ROWS']:
+        return overloaded()
+    return None
+
+# ========== MÉTRICAS ==========
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_REQUEST_LOG_SIZE = 50       # Requisições lentas mantidas para /api/metrics/slow
+SLOW_REQUEST_MAX_STATEMENTS = 100
+BACKGROUND_ROUTE = '(background)'  # Consultas feitas fora de requisições (escritor, flush, SSE)
+# animal_type vem de rotas públicas; tipos além deste limite são somados em OTHER_ANIMAL_TYPE
+# para que a memória e as séries do Prometheus não cresçam sem limite
+INGEST_METRIC_MAX_TYPES = 50
+OTHER_ANIMAL_TYPE = '(outros)'
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        # Os buckets do Prometheus são cumulativos: cada um conta tudo que é <= limite
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+        self.sum += value
+        self.count += 1
+
+def prometheus_labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.db_queries = {}
+        self.db_seconds = {}
+        self.ingested = {}
+        self.slow_requests = deque(maxlen=SLOW_REQUEST_LOG_SIZE)
+    
+    def observe_query(self, statement, elapsed):
+        if has_request_context() and 'db_queries' in g:
+            g.db_queries += 1
+            g.db_seconds += elapsed
+            if len(g.statements) < SLOW_REQUEST_MAX_STATEMENTS:
+                g.statements.append((elapsed, statement))
+            return
+        
+        with self.lock:
+            self.db_queries[BACKGROUND_ROUTE] = self.db_queries.get(BACKGROUND_ROUTE, 0) + 1
+            self.db_seconds[BACKGROUND_ROUTE] = self.db_seconds.get(BACKGROUND_ROUTE, 0.0) + elapsed
+    
+    def observe_request(self, method, route, status, elapsed, queries, db_seconds):
+        with self.lock:
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault((method, route), Histogram()).observe(elapsed)
+            self.db_queries[route] = self.db_queries.get(route, 0) + queries
+            self.db_seconds[route] = self.db_seconds.get(route, 0.0) + db_seconds
+    
+    def observe_ingest(self, rows):
+        with self.lock:
+            for row in rows:
+                key = row['animal_type']
+                if key not in self.ingested and len(self.ingested) >= INGEST_METRIC_MAX_TYPES:
+                    key = OTHER_ANIMAL_TYPE
+                records, animals = self.ingested.get(key, (0, 0))
+                self.ingested[key] = (records + 1, animals + row['count'])
+    
+    def log_slow(self, entry):
+        with self.lock:
+            self.slow_requests.append(entry)
+    
+    def slow(self):
+        with self.lock:
+            return list(reversed(self.slow_requests))
+    
+    def process_metrics(self):
+        ingest = ingest_writer.stats()
+        auth = auth_cache.stats()
+        with device_registry.lock:
+            devices = len(device_registry.devices)
+            online = len(device_registry.online)
+        return [
+            ('app_ingest_queue_rows', 'gauge', 'Linhas aguardando o escritor de contagens', ingest['queued_rows']),
+            ('app_ingest_commits_total', 'counter', 'Transações confirmadas pelo escritor de contagens', ingest['commits']),
+            ('app_ingest_rows_written_total', 'counter', 'Linhas gravadas pelo escritor de contagens', ingest['rows_written']),
+            ('app_response_cache_entries', 'gauge', 'Respostas no cache de ETag', len(response_cache.entries)),
+            ('app_count_version', 'gauge', 'Versão local das contagens (muda a cada escrita)', count_version.value),
+            ('app_device_version', 'gauge', 'Versão local dos dispositivos (muda a cada heartbeat)', device_version.value),
+            ('app_auth_cache_entries', 'gauge', 'Identidades no cache de autenticação', auth['size']),
+            ('app_auth_cache_hits_total', 'counter', 'Acertos do cache de autenticação', auth['hits']),
+            ('app_auth_cache_misses_total', 'counter', 'Erros do cache de autenticação', auth['misses']),
+            ('app_sse_subscribers', 'gauge', 'Clientes conectados ao /api/stream', len(broker.subscribers)),
+            ('app_devices', 'gauge', 'Dispositivos no registro em memória', devices),
+            ('app_devices_online', 'gauge', 'Dispositivos com heartbeat recente', online),
+            ('app_archive_cached_months', 'gauge', 'Meses arquivados em memória', len(archive_reader.cache)),
+            ('app_rate_limit_buckets', 'gauge', 'Buckets do limitador de requisições', len(rate_limiter.buckets)),
+            ('app_rate_limited_total', 'counter', 'Requisições recusadas com 429', rate_limiter.limited),
+            ('app_recent_event_ids', 'gauge', 'event_ids lembrados para deduplicação', len(recent_events.entries)),
+            ('app_duplicate_events_cached_total', 'counter', 'Reenvios respondidos pelo cache de event_ids', recent_events.hits),
+        ]
+    
+    def render(self):
+        # Formato de texto do Prometheus; o rótulo worker separa os processos do gunicorn
+        worker = os.getpid()
+        lines = []
+        
+        def header(name, help_text, kind):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+        
+        with self.lock:
+            requests = dict(self.requests)
+            latency = {key: (list(h.buckets), h.sum, h.count) for key, h in self.latency.items()}
+            db_queries = dict(self.db_queries)
+            db_seconds = dict(self.db_seconds)
+            ingested = dict(self.ingested)
+        
+        header('http_requests_total', 'Requisições atendidas', 'counter')
+        for (method, route, status), value in sorted(requests.items()):
+            lines.append(f'http_requests_total{prometheus_labels(method=method, route=route, status=status, worker=worker)} {value}')
+        
+        header('http_request_duration_seconds', 'Tempo de resposta por rota', 'histogram')
+        for (method, route), (buckets, total, count) in sorted(latency.items()):
+            for bound, value in zip(LATENCY_BUCKETS, buckets):
+                labels = prometheus_labels(method=method, route=route, le=bound, worker=worker)
+                lines.append(f'http_request_duration_seconds_bucket{labels} {value}')
+            labels = prometheus_labels(method=method, route=route, le='+Inf', worker=worker)
+            lines.append(f'http_request_duration_seconds_bucket{labels} {count}')
+            labels = prometheus_labels(method=method, route=route, worker=worker)
+            lines.append(f'http_request_duration_seconds_sum{labels} {total:.6f}')
+            lines.append(f'http_request_duration_seconds_count{labels} {count}')
+        
+        header('db_queries_total', 'Consultas SQL executadas, por rota', 'counter')
+        for route, value in sorted(db_queries.items()):
+            lines.append(f'db_queries_total{prometheus_labels(route=route, worker=worker)} {value}')
+        
+        header('db_query_seconds_total', 'Tempo acumulado em consultas SQL, por rota', 'counter')
+        for route, value in sorted(db_seconds.items()):
+            lines.append(f'db_query_seconds_total{prometheus_labels(route=route, worker=worker)} {value:.6f}')
+        
+        header('counts_ingested_total', 'Registros de contagem gravados', 'counter')
+        for animal_type, (records, _) in sorted(ingested.items()):
+            labels = prometheus_labels(animal_type=animal_type, worker=worker)
+            lines.append(f'counts_ingested_total{labels} {records}')
+        
+        header('animals_counted_total', 'Animais contados (soma do campo count)', 'counter')
+        for animal_type, (_, animals) in sorted(ingested.items()):
+            labels = prometheus_labels(animal_type=animal_type, worker=worker)
+            lines.append(f'animals_counted_total{labels} {animals}')
+        
+        for name, kind, help_text, value in self.process_metrics():
+            header(name, help_text, kind)
+            lines.append(f'{name}{prometheus_labels(worker=worker)} {value}')
+        
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+def instrument_engine(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+    
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        metrics.observe_query(statement, elapsed)
+    
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        # Comando que falhou não passa por after_cursor_execute; sem isto o início ficaria na conexão
+        started = context.connection.info.get('query_started') if context.connection is not None else None
+        if started:
+            metrics.observe_query(context.statement, time.perf_counter() - started.pop())
+
+@api.before_app_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.db_queries = 0
+    g.db_seconds = 0.0
+    g.statements = []
+
+@api.after_app_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else '(sem rota)'
+    metrics.observe_request(request.method, route, response.status_code, elapsed, g.db_queries, g.db_seconds)
+    
+    threshold = current_app.config['SLOW_REQUEST_THRESHOLD']
+    if threshold and elapsed >= threshold:
+        entry = {
+            'method': request.method,
+            'route': route,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+            'duration': round(elapsed, 4),
+            'db_queries': g.db_queries,
+            'db_seconds': round(g.db_seconds, 4),
+            'at': datetime.datetime.utcnow().isoformat(),
+            'statements': [
+                {'duration': round(duration, 4), 'sql': statement}
+                for duration, statement in g.statements
+            ]
+        }
+        metrics.log_slow(entry)
+        current_app.logger.warning(
+            'Requisição lenta: %s %s %.3fs (%d consultas, %.3fs no banco)\n%s',
+            request.method, entry['path'], elapsed, g.db_queries, g.db_seconds,
+            '\n'.join(f'  [{duration * 1000:.1f}ms] {statement}' for duration, statement in g.statements)
+        )
+    return response
+
 # ========== ROTAS DE AUTENTICAÇÃO ==========
 
-@app.route('/api/register', methods=['POST'])
+@api.route('/api/register', methods=['POST'])
 def register():
     data = request.get_json()
     
@@ -117,12 +1514,13 @@ def register():
     try:
         db.session.add(new_user)
         db.session.commit()
+        auth_cache.invalidate_user(username)
         return jsonify({'message': 'Usuário cadastrado com sucesso'}), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': 'Erro ao cadastrar usuário', 'error': str(e)}), 500
 
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def login():
     data = request.get_json()
     
@@ -138,9 +1536,10 @@ def login():
         return jsonify({'message': 'Credenciais inválidas'}), 401
     
     token = jwt.encode({
+        'user_id': user.id,
         'username': username,
         'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
-    }, app.config['SECRET_KEY'], algorithm='HS256')
+    }, current_app.config['SECRET_KEY'], algorithm='HS256')
     
     return jsonify({
         'message': 'Login realizado com sucesso',
@@ -148,7 +1547,7 @@ def login():
         'username': username
     }), 200
 
-@app.route('/api/verify', methods=['GET'])
+@api.route('/api/verify', methods=['GET'])
 @token_required
 def verify(current_user):
     return jsonify({
@@ -156,105 +1555,598 @@ def verify(current_user):
         'username': current_user.username
     }), 200
 
+@api.route('/api/auth/cache-stats', methods=['GET'])
+@token_required
+def auth_cache_stats(current_user):
+    return jsonify(auth_cache.stats()), 200
+
+# ========== SERIALIZAÇÃO DAS LISTAS ==========
+
+COUNT_FORMATS = ('objects', 'columns')
+
+def json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} não é serializável em JSON')
+
+def dumps(value):
+    # JSON compacto em bytes; o orjson escreve datetimes sem fuso no mesmo formato do isoformat()
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':'), default=json_default).encode()
+
+def json_response(payload, status=200):
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+def count_format_arg():
+    value = request.args.get('format', 'objects')
+    if value not in COUNT_FORMATS:
+        raise ValueError(value)
+    return value
+
+def serialize_counts(rows, count_format='objects'):
+    # rows são tuplas na ordem de COUNT_FIELDS (banco ou arquivo).
+    # "columns" devolve um array por campo, sem repetir os nomes a cada linha
+    if count_format == 'columns':
+        values = list(zip(*rows)) or [()] * len(COUNT_FIELDS)
+        return {field: list(column) for field, column in zip(COUNT_FIELDS, values)}
+    return [dict(zip(COUNT_FIELDS, row)) for row in rows]
+
+def ndjson_lines(rows):
+    # Uma linha JSON por contagem, enviadas em blocos de STREAM_CHUNK_SIZE
+    for chunk in chunked(rows, STREAM_CHUNK_SIZE):
+        yield b''.join(dumps(dict(zip(COUNT_FIELDS, row))) + b'\n' for row in chunk)
+
 # ========== ROTAS DE CONTAGEM DE ANIMAIS ==========
 
-@app.route('/api/counts', methods=['GET'])
+def parse_datetime_arg(name, default=None):
+    value = request.args.get(name)
+    if not value:
+        return default
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 1000
+
+def encode_cursor(count):
+    raw = json.dumps([count.timestamp.isoformat(), count.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    timestamp, count_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(timestamp, str) or not isinstance(count_id, str):
+        raise ValueError('cursor inválido')
+    return datetime.datetime.fromisoformat(timestamp), str(uuid.UUID(count_id))
+
+def counts_filters():
+    return {
+        'start': parse_datetime_arg('from'),
+        'end': parse_datetime_arg('to'),
+        'device_id': request.args.get('device')
+    }
+
+def filtered_counts_query(start=None, end=None, device_id=None, descending=True):
+    query = db.select(*COUNT_COLUMNS)
+    if start:
+        query = query.where(Count.timestamp >= start)
+    if end:
+        query = query.where(Count.timestamp <= end)
+    if device_id:
+        query = query.where(Count.device_id == device_id)
+    
+    if descending:
+        return query.order_by(Count.timestamp.desc(), Count.id.desc())
+    return query.order_by(Count.timestamp, Count.id)
+
+def counts_source(query, months, filters, before=None, descending=True):
+    # Lê o banco em blocos (yield_per) e intercala os meses já arquivados
+    rows = db.session.execute(query.execution_options(yield_per=STREAM_CHUNK_SIZE))
+    if not months:
+        return rows
+    archived = archive_reader.counts(months, before=before, descending=descending, **filters)
+    return merge_counts(rows, archived, descending=descending)
+
+@api.route('/api/counts', methods=['GET'])
 @token_required
 def get_counts(current_user):
-    counts = Count.query.order_by(Count.timestamp.desc()).all()
-    return jsonify({
-        'counts': [count.to_dict() for count in counts],
-        'total': len(counts)
-    }), 200
+    try:
+        filters = counts_filters()
+        query = filtered_counts_query(**filters)
+        cursor = request.args.get('cursor')
+        before = decode_cursor(cursor) if cursor else None
+        count_format = count_format_arg()
+        if before:
+            # Keyset: continua exatamente após a última linha da página anterior
+            query = query.where(db.tuple_(Count.timestamp, Count.id) < before)
+    except (TypeError, ValueError):
+        return jsonify({'message': 'Parâmetros from/to/cursor/format inválidos'}), 400
+    
+    # Meses já arquivados são lidos dos arquivos e intercalados com o banco
+    months = archived_months()
+    
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        # Sem limit o stream vai até o fim do período
+        limit = request.args.get('limit', type=int)
+        if limit is not None and limit < 1:
+            return jsonify({'message': 'limit deve ser um inteiro positivo'}), 400
+        if limit:
+            query = query.limit(limit)
+        
+        rows = counts_source(query, months, filters, before)
+        if limit:
+            rows = itertools.islice(rows, limit)
+        return Response(stream_with_context(ndjson_lines(rows)), mimetype='application/x-ndjson')
+    
+    limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    
+    # Busca uma linha a mais para saber se existe próxima página
+    counts = list(itertools.islice(counts_source(query.limit(limit + 1), months, filters, before), limit + 1))
+    has_more = len(counts) > limit
+    counts = counts[:limit]
+    
+    return json_response({
+        'counts': serialize_counts(counts, count_format),
+        'total': len(counts),
+        'next_cursor': encode_cursor(counts[-1]) if has_more else None
+    })
+
+EXPORT_HEADER = ['id', 'device_id', 'animal_type', 'count', 'timestamp']
+
+def export_rows(filters):
+    # Ordem cronológica, lendo banco e arquivos em blocos
+    query = filtered_counts_query(descending=False, **filters)
+    for count_id, device_id, count, animal_type, timestamp in counts_source(
+        query, archived_months(), filters, descending=False
+    ):
+        yield (count_id, device_id, animal_type, count, timestamp)
 
-@app.route('/api/counts/today', methods=['GET'])
+@api.route('/api/counts/export', methods=['GET'])
 @token_required
-def get_today_counts(current_user):
+def export_counts(current_user):
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORTERS:
+        return jsonify({'message': 'format deve ser csv ou xlsx'}), 400
+    
+    try:
+        filters = counts_filters()
+    except (TypeError, ValueError):
+        return jsonify({'message': 'Parâmetros from/to inválidos'}), 400
+    
+    period = '_'.join(f"{filters[key]:%Y%m%d}" for key in ('start', 'end') if filters[key])
+    filename = f"contagens{'_' + period if period else ''}.{export_format}"
+    
+    response = Response(
+        stream_with_context(EXPORTERS[export_format](EXPORT_HEADER, export_rows(filters))),
+        mimetype=CONTENT_TYPES[export_format]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def today_range():
     today = datetime.datetime.now().date()
-    today_start = datetime.datetime.combine(today, datetime.time.min)
-    today_end = datetime.datetime.combine(today, datetime.time.max)
+    return datetime.datetime.combine(today, datetime.time.min), datetime.datetime.combine(today, datetime.time.max)
+
+@api.route('/api/counts/today', methods=['GET'])
+@token_required
+@cached_response(count_version)
+def get_today_counts(current_user):
+    try:
+        count_format = count_format_arg()
+    except ValueError:
+        return jsonify({'message': 'format deve ser objects ou columns'}), 400
     
-    today_counts = Count.query.filter(
-        Count.timestamp >= today_start,
-        Count.timestamp <= today_end
-    ).order_by(Count.timestamp.desc()).all()
+    today_start, today_end = today_range()
+    
+    today_counts = db.session.execute(
+        db.select(*COUNT_COLUMNS).where(
+            Count.timestamp >= today_start,
+            Count.timestamp <= today_end
+        ).order_by(Count.timestamp.desc())
+    ).all()
     
     total_animals = sum(count.count for count in today_counts)
     
-    return jsonify({
-        'counts': [count.to_dict() for count in today_counts],
+    return json_response({
+        'counts': serialize_counts(today_counts, count_format),
         'total_today': total_animals,
         'records': len(today_counts)
-    }), 200
+    })
 
-@app.route('/api/counts/stats', methods=['GET'])
+def encode_changes_cursor(day, last_id, overlap):
+    raw = json.dumps([day.isoformat(), last_id, overlap])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_changes_cursor(cursor):
+    day, last_id, overlap = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(day, str) or not isinstance(last_id, (str, type(None))):
+        raise ValueError('cursor inválido')
+    return datetime.date.fromisoformat(day), str(uuid.UUID(last_id)) if last_id else None, bool(overlap)
+
+@api.route('/api/counts/changes', methods=['GET'])
 @token_required
-def get_stats(current_user):
+@cached_response(count_version)
+def get_count_changes(current_user):
+    # Contagens do dia criadas depois do cursor, para o dashboard atualizar a lista sem
+    # baixar o dia inteiro. O cursor guarda o dia e o último ID visto; como os IDs são
+    # UUIDv7, "depois" é uma faixa da chave primária
+    try:
+        count_format = count_format_arg()
+        since = request.args.get('since')
+        day, last_id, overlap = decode_changes_cursor(since) if since else (None, None, False)
+    except (TypeError, ValueError):
+        return jsonify({'message': 'Parâmetros since/format inválidos'}), 400
+    
+    today_start, today_end = today_range()
+    # Sem cursor ou com cursor de outro dia, a lista do dia vem inteira e substitui a do cliente
+    reset = day != today_start.date()
+    if reset:
+        last_id = None
+    
+    query = db.select(*COUNT_COLUMNS).where(
+        Count.timestamp >= today_start,
+        Count.timestamp <= today_end
+    )
+    if last_id and overlap:
+        # Uma linha pode ser confirmada um pouco depois de ganhar o ID; revisita os últimos
+        # SYNC_OVERLAP_MS e o cliente descarta pelo id o que já tinha
+        query = query.where(Count.id > str(uuid7_floor(uuid7_millis(last_id) - SYNC_OVERLAP_MS)))
+    elif last_id:
+        query = query.where(Count.id > last_id)
+    
+    rows = db.session.execute(query.order_by(Count.id).limit(MAX_PAGE_SIZE + 1)).all()
+    has_more = len(rows) > MAX_PAGE_SIZE
+    rows = rows[:MAX_PAGE_SIZE]
+    if rows:
+        last_id = max(last_id or '', rows[-1].id)
+    
+    # Totais do dia pelos agregados por hora: custo fixo, independente do tamanho do dia
+    totals = db.session.execute(
+        db.select(
+            db.func.coalesce(db.func.sum(HourlyCount.total), 0),
+            db.func.coalesce(db.func.sum(HourlyCount.records), 0)
+        ).where(HourlyCount.bucket >= today_start, HourlyCount.bucket <= today_end)
+    ).one()
+    
+    return json_response({
+        'counts': serialize_counts(rows, count_format),
+        'total_today': totals[0],
+        'records': totals[1],
+        'reset': reset,
+        'has_more': has_more,
+        # Enquanto houver mais páginas o próximo pedido continua exatamente após esta
+        'cursor': encode_changes_cursor(today_start.date(), last_id, not has_more)
+    })
+
+STATS_BREAKDOWNS = {
+    'device': ('by_device', 'device_id'),
+    'type': ('by_type', 'animal_type'),
+}
+
+STATS_FIELDS = ('total_animals', 'total_records', 'today', 'this_week', 'this_month')
+
+def stats_windows():
     now = datetime.datetime.now()
     today = now.date()
     today_start = datetime.datetime.combine(today, datetime.time.min)
     week_ago = now - datetime.timedelta(days=7)
     month_ago = now - datetime.timedelta(days=30)
+    return today_start, week_ago, month_ago
+
+def next_bucket(value, rollup, step):
+    bucket = ROLLUPS[rollup][1](value)
+    return bucket if bucket == value else bucket + step
+
+def window_sums(time_column, value_column, ranges):
+    conditions = {
+        key: time_column >= start if end is None else db.and_(time_column >= start, time_column < end)
+        for key, (start, end) in ranges.items() if end is None or start < end
+    }
+    columns = [
+        db.func.coalesce(db.func.sum(db.case((condition, value_column), else_=0)), 0).label(key)
+        for key, condition in conditions.items()
+    ]
+    return columns, list(conditions.values())
+
+def stats_queries(group_column_name=None):
+    # Cada janela [início, agora) é somada em três partes: o resto da primeira hora direto de
+    # count (poucas linhas, pelo índice de timestamp), as horas inteiras até o fim do primeiro
+    # dia em count_hourly e os dias inteiros em count_daily. Os agregados também guardam os
+    # meses arquivados, então os totais gerais saem só de count_daily
+    ranges = {'count': {}, 'hour': {}, 'day': {}}
+    for key, start in zip(STATS_FIELDS[2:], stats_windows()):
+        hour = next_bucket(start, 'hour', datetime.timedelta(hours=1))
+        day = next_bucket(start, 'day', datetime.timedelta(days=1))
+        ranges['count'][key] = (start, hour)
+        ranges['hour'][key] = (hour, day)
+        ranges['day'][key] = (day, None)
     
-    all_counts = Count.query.all()
-    total_animals = sum(count.count for count in all_counts)
+    def grouped(model, columns, conditions=None):
+        group_column = getattr(model, group_column_name) if group_column_name else db.null()
+        query = db.select(group_column.label('group'), *columns)
+        if conditions is not None:
+            query = query.where(db.or_(*conditions))
+        return query.group_by(group_column) if group_column_name else query
     
-    today_counts = Count.query.filter(Count.timestamp >= today_start).all()
-    today_total = sum(count.count for count in today_counts)
+    columns, _ = window_sums(DailyCount.bucket, DailyCount.total, ranges['day'])
+    queries = [grouped(DailyCount, [
+        db.func.coalesce(db.func.sum(DailyCount.total), 0).label('total_animals'),
+        db.func.coalesce(db.func.sum(DailyCount.records), 0).label('total_records'),
+        *columns
+    ])]
+    for model, time_column, value_column, part in (
+        (HourlyCount, HourlyCount.bucket, HourlyCount.total, 'hour'),
+        (Count, Count.timestamp, Count.count, 'count'),
+    ):
+        columns, conditions = window_sums(time_column, value_column, ranges[part])
+        if conditions:
+            queries.append(grouped(model, columns, conditions))
+    return queries
+
+def compute_stats(group_column_name=None):
+    groups = {}
+    for query in stats_queries(group_column_name):
+        for row in db.session.execute(query):
+            values = row._mapping
+            group = groups.setdefault(values['group'], dict.fromkeys(STATS_FIELDS, 0))
+            for key in STATS_FIELDS:
+                group[key] += values.get(key, 0)
     
-    week_counts = Count.query.filter(Count.timestamp >= week_ago).all()
-    week_total = sum(count.count for count in week_counts)
+    if group_column_name is None:
+        return groups.get(None, dict.fromkeys(STATS_FIELDS, 0))
+    return [
+        {group_column_name: value, **groups[value]}
+        for value in sorted(groups, key=lambda v: (v is not None, v or ''))
+    ]
+
+@api.route('/api/counts/stats', methods=['GET'])
+@token_required
+@cached_response(count_version)
+def get_stats(current_user):
+    breakdowns = [b for b in request.args.get('breakdown', '').split(',') if b]
+    invalid = [b for b in breakdowns if b not in STATS_BREAKDOWNS]
+    if invalid:
+        return jsonify({'message': f'breakdown inválido: {", ".join(invalid)} (use device e/ou type)'}), 400
     
-    month_counts = Count.query.filter(Count.timestamp >= month_ago).all()
-    month_total = sum(count.count for count in month_counts)
+    result = compute_stats()
+    for breakdown in breakdowns:
+        key, column_name = STATS_BREAKDOWNS[breakdown]
+        result[key] = compute_stats(column_name)
     
+    return jsonify(result), 200
+
+EVENT_ID_MAX_LENGTH = 64
+
+def valid_event_id(event_id):
+    return event_id is None or (
+        isinstance(event_id, str) and 0 < len(event_id) <= EVENT_ID_MAX_LENGTH
+    )
+
+def duplicate_count(count_id, event_id):
     return jsonify({
-        'total_animals': total_animals,
-        'total_records': len(all_counts),
-        'today': today_total,
-        'this_week': week_total,
-        'this_month': month_total
+        'message': 'Contagem já registrada',
+        'duplicate': True,
+        'id': count_id,
+        'event_id': event_id
     }), 200
 
-@app.route('/api/count', methods=['POST'])
+@api.route('/api/count', methods=['POST'])
 def add_count():
-    data = request.get_json()
+    refused = ingest_backpressure()
+    if refused:
+        return refused
     
-    device_id = data.get('device_id', 'unknown')
-    count_value = data.get('count', 0)
-    animal_type = data.get('animal_type', 'desconhecido')
+    data = request.get_json(silent=True)
     
-    count_entry = Count(
-        id=str(uuid.uuid4()),
-        device_id=device_id,
-        count=count_value,
-        animal_type=animal_type
-    )
+    row, error = parse_count_event(data, default_count=0)
+    if error:
+        return jsonify({'message': error}), 400
+    event_id = row['event_id']
+    
+    refused = rate_limit([row['device_id']])
+    if refused:
+        return refused
+    
+    # Reenvio recente do mesmo evento: responde sem enfileirar nem consultar o banco
+    count_id = recent_events.get(event_id) if event_id else None
+    if count_id:
+        return duplicate_count(count_id, event_id)
+    
+    row['id'] = str(uuid7())
     
     try:
-        db.session.add(count_entry)
-        db.session.commit()
+        duplicates = ingest_writer.write([row])
+        if row['id'] in duplicates:
+            return duplicate_count(duplicates[row['id']], event_id)
         
         return jsonify({
             'message': 'Contagem registrada com sucesso',
-            'data': count_entry.to_dict()
+            'data': Count(**row).to_dict()
         }), 201
+    except IngestFull:
+        return overloaded()
     except Exception as e:
-        db.session.rollback()
         return jsonify({'message': 'Erro ao registrar contagem', 'error': str(e)}), 500
 
+MAX_BATCH_SIZE = 500
+
+def parse_count_event(item, default_count=1):
+    if not isinstance(item, dict):
+        return None, 'Evento deve ser um objeto JSON'
+    
+    device_id = item.get('device_id', 'unknown')
+    count_value = item.get('count', default_count)
+    animal_type = item.get('animal_type', 'desconhecido')
+    raw_timestamp = item.get('timestamp')
+    event_id = item.get('event_id')
+    
+    if not isinstance(device_id, str) or not device_id or len(device_id) > 36:
+        return None, 'device_id inválido'
+    if isinstance(count_value, bool) or not isinstance(count_value, int) or count_value < 0:
+        return None, 'count deve ser um inteiro não negativo'
+    if not isinstance(animal_type, str) or not animal_type or len(animal_type) > 50:
+        return None, 'animal_type inválido'
+    if not valid_event_id(event_id):
+        return None, 'event_id inválido'
+    
+    if raw_timestamp is None:
+        timestamp = datetime.datetime.utcnow()
+    else:
+        try:
+            timestamp = datetime.datetime.fromisoformat(raw_timestamp)
+        except (TypeError, ValueError):
+            return None, 'timestamp inválido (use ISO 8601)'
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    
+    return {
+        'device_id': device_id,
+        'count': count_value,
+        'animal_type': animal_type,
+        'timestamp': timestamp,
+        'event_id': event_id
+    }, None
+
+@api.route('/api/counts/batch', methods=['POST'])
+def add_counts_batch():
+    refused = ingest_backpressure()
+    if refused:
+        return refused
+    
+    data = request.get_json(silent=True)
+    
+    events = data.get('events') if isinstance(data, dict) else data
+    
+    if not isinstance(events, list) or not events:
+        return jsonify({'message': 'Envie uma lista não vazia de eventos em "events"'}), 400
+    
+    if len(events) > MAX_BATCH_SIZE:
+        return jsonify({'message': f'Lote excede o limite de {MAX_BATCH_SIZE} eventos'}), 413
+    
+    parsed = [parse_count_event(item) for item in events]
+    
+    # Um lote gasta uma ficha de cada dispositivo presente nele, não uma por evento:
+    # o acúmulo enviado depois de uma queda de link não deve ser barrado. Só contam os
+    # device_id de eventos válidos
+    device_ids = {row['device_id'] for row, error in parsed if not error}
+    refused = rate_limit(sorted(device_ids))
+    if refused:
+        return refused
+    
+    rows = []
+    results = []
+    for index, (row, error) in enumerate(parsed):
+        if error:
+            results.append({'index': index, 'status': 'rejected', 'error': error})
+            continue
+        count_id = recent_events.get(row['event_id']) if row['event_id'] else None
+        if count_id:
+            results.append({'index': index, 'status': 'duplicate', 'id': count_id})
+            continue
+        row['id'] = str(uuid7())
+        rows.append(row)
+        results.append({'index': index, 'status': 'created', 'id': row['id']})
+    
+    try:
+        # O lote inteiro vai na mesma transação do escritor
+        duplicates = ingest_writer.write(rows)
+    except IngestFull:
+        return overloaded()
+    except Exception as e:
+        return jsonify({'message': 'Erro ao registrar lote de contagens', 'error': str(e)}), 500
+    
+    # Eventos já gravados antes (event_id repetido) voltam com o id da contagem original
+    for result in results:
+        if result['status'] == 'created' and result['id'] in duplicates:
+            result.update(status='duplicate', id=duplicates[result['id']])
+    
+    accepted = sum(1 for result in results if result['status'] == 'created')
+    duplicated = sum(1 for result in results if result['status'] == 'duplicate')
+    
+    return jsonify({
+        'message': f'{accepted} contagem(ns) registrada(s)',
+        'accepted': accepted,
+        'duplicates': duplicated,
+        'rejected': len(events) - accepted - duplicated,
+        'results': results
+    }), 201 if accepted or duplicated else 400
+
+SERIES_GROUPS = {
+    'device': 'device_id',
+    'type': 'animal_type',
+}
+
+SERIES_DEFAULT_RANGE = {
+    'hour': datetime.timedelta(hours=24),
+    'day': datetime.timedelta(days=30),
+}
+
+@api.route('/api/counts/series', methods=['GET'])
+@token_required
+@cached_response(count_version)
+def get_series(current_user):
+    granularity = request.args.get('granularity', 'hour')
+    group_by = request.args.get('group_by')
+    
+    if granularity not in ROLLUPS:
+        return jsonify({'message': 'granularity deve ser hour ou day'}), 400
+    if group_by is not None and group_by not in SERIES_GROUPS:
+        return jsonify({'message': 'group_by deve ser device ou type'}), 400
+    
+    model, truncate = ROLLUPS[granularity]
+    
+    try:
+        end = parse_datetime_arg('to', datetime.datetime.utcnow())
+        start = parse_datetime_arg('from', end - SERIES_DEFAULT_RANGE[granularity])
+    except ValueError:
+        return jsonify({'message': 'from/to devem estar no formato ISO 8601'}), 400
+    
+    columns = [model.bucket]
+    if group_by:
+        columns.append(getattr(model, SERIES_GROUPS[group_by]))
+    
+    # Consulta apenas as tabelas de agregados, nunca as linhas brutas de Count
+    rows = db.session.execute(
+        db.select(
+            *columns,
+            db.func.sum(model.total).label('total'),
+            db.func.sum(model.records).label('records')
+        )
+        .where(model.bucket >= truncate(start), model.bucket <= end)
+        .group_by(*columns)
+        .order_by(*columns)
+    ).all()
+    
+    series = []
+    for row in rows:
+        point = dict(row._mapping)
+        point['bucket'] = point['bucket'].isoformat()
+        series.append(point)
+    
+    return jsonify({
+        'granularity': granularity,
+        'group_by': group_by,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'series': series
+    }), 200
+
 # ========== ROTAS DE GERENCIAMENTO DE DISPOSITIVOS RASP ==========
 
-@app.route('/api/devices', methods=['GET'])
+@api.route('/api/devices', methods=['GET'])
 @token_required
+@cached_response(device_version)
 def get_devices(current_user):
-    devices = Device.query.all()
+    devices = device_registry.snapshot()
     return jsonify({
-        'devices': [device.to_dict() for device in devices],
+        'devices': devices,
         'total': len(devices)
     }), 200
 
-@app.route('/api/devices/register', methods=['POST'])
+@api.route('/api/devices/register', methods=['POST'])
 @token_required
 def register_device(current_user):
     data = request.get_json()
@@ -273,6 +2165,9 @@ def register_device(current_user):
     try:
         db.session.add(device)
         db.session.commit()
+        device_registry.add(device)
+        device_version.bump()
+        broker.publish('device', device.to_dict())
         
         return jsonify({
             'message': 'Dispositivo registrado com sucesso',
@@ -282,24 +2177,23 @@ def register_device(current_user):
         db.session.rollback()
         return jsonify({'message': 'Erro ao registrar dispositivo', 'error': str(e)}), 500
 
-@app.route('/api/devices/<device_id>/heartbeat', methods=['POST'])
+@api.route('/api/devices/<device_id>/heartbeat', methods=['POST'])
 def device_heartbeat(device_id):
-    device = Device.query.get(device_id)
+    refused = rate_limit([device_id])
+    if refused:
+        return refused
+    
+    # Só atualiza a memória; last_seen vai para o banco em lote a cada HEARTBEAT_FLUSH_INTERVAL
+    device = device_registry.heartbeat(device_id)
     
     if not device:
         return jsonify({'message': 'Dispositivo não encontrado'}), 404
     
-    device.last_seen = datetime.datetime.utcnow()
-    device.status = 'ativo'
-    
-    try:
-        db.session.commit()
-        return jsonify({'message': 'Heartbeat registrado'}), 200
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'message': 'Erro ao atualizar dispositivo', 'error': str(e)}), 500
+    device_version.bump()
+    broker.publish('device', device)
+    return jsonify({'message': 'Heartbeat registrado'}), 200
 
-@app.route('/api/devices/<device_id>', methods=['DELETE'])
+@api.route('/api/devices/<device_id>', methods=['DELETE'])
 @token_required
 def delete_device(current_user, device_id):
     device = Device.query.get(device_id)
@@ -310,14 +2204,81 @@ def delete_device(current_user, device_id):
     try:
         db.session.delete(device)
         db.session.commit()
+        device_registry.remove(device_id)
+        device_version.bump()
+        broker.publish('device_removed', {'id': device_id})
         return jsonify({'message': 'Dispositivo removido com sucesso'}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': 'Erro ao remover dispositivo', 'error': str(e)}), 500
 
+# ========== ROTAS DE MÉTRICAS ==========
+
+@api.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'message': 'Token de métricas inválido'}), 401
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@api.route('/api/metrics/slow', methods=['GET'])
+@token_required
+def get_slow_requests(current_user):
+    return jsonify({
+        'threshold': current_app.config['SLOW_REQUEST_THRESHOLD'],
+        'requests': metrics.slow()
+    }), 200
+
+# ========== STREAM DE EVENTOS ==========
+
+STREAM_TICKET_TTL = 60  # Segundos para abrir o stream com um ticket
+
+@api.route('/api/stream/ticket', methods=['POST'])
+@token_required
+def stream_ticket(current_user):
+    # EventSource não permite enviar cabeçalhos, então a credencial vai na query string,
+    # onde acaba em logs de acesso e de proxies. Em vez do JWT de 24h vai um ticket que
+    # só abre o stream e expira logo
+    ticket = jwt.encode({
+        'user_id': current_user.id,
+        'username': current_user.username,
+        'purpose': 'stream',
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=STREAM_TICKET_TTL)
+    }, current_app.config['SECRET_KEY'], algorithm='HS256')
+    
+    return jsonify({'ticket': ticket, 'expires_in': STREAM_TICKET_TTL}), 200
+
+@api.route('/api/stream', methods=['GET'])
+def stream():
+    try:
+        data = jwt.decode(request.args.get('ticket', ''), current_app.config['SECRET_KEY'], algorithms=['HS256'])
+    except jwt.InvalidTokenError:
+        return jsonify({'message': 'Ticket inválido ou expirado'}), 401
+    if data.get('purpose') != 'stream':
+        return jsonify({'message': 'Ticket inválido ou expirado'}), 401
+    
+    subscriber = broker.subscribe()
+    
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            while broker.is_subscribed(subscriber):
+                try:
+                    yield subscriber.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+            yield "event: resync\ndata: {}\n\n"
+        finally:
+            broker.unsubscribe(subscriber)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 # ========== ROTA DE TESTE ==========
 
-@app.route('/api/test', methods=['GET'])
+@api.route('/api/test', methods=['GET'])
 def test():
     return jsonify({
         'message': 'Servidor funcionando!',
@@ -325,5 +2286,6 @@ def test():
     }), 200
 
 if __name__ == '__main__':
-    init_db()  
+    app = create_app()
+    init_db(app)
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
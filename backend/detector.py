@@ -0,0 +1,152 @@
+import statistics
+from collections import deque, namedtuple
+
+# Motor de detecção de passagem de animais a partir das leituras do sensor.
+#
+# O PresenceDetector é uma máquina de estados com histerese:
+#   - VAZIO -> OCUPADO quando a mediana das últimas leituras fica abaixo de enter_threshold;
+#   - OCUPADO -> VAZIO quando fica acima de exit_threshold por pelo menos min_gap segundos.
+# Cada ocupação com duração >= min_occupancy conta um animal, no momento em que termina.
+# Assim um animal parado no feixe conta uma vez só, e animais em fila são separados
+# pelo pequeno intervalo livre entre eles, sem depender de um cooldown fixo.
+
+Detection = namedtuple("Detection", ["start", "end", "duration", "min_distance"])
+
+EMPTY = "vazio"
+OCCUPIED = "ocupado"
+
+
+class PresenceDetector:
+    def __init__(self, enter_threshold=15, exit_threshold=20, min_occupancy=0.15,
+                 min_gap=0.12, window=3):
+        if exit_threshold < enter_threshold:
+            raise ValueError("exit_threshold deve ser maior ou igual a enter_threshold")
+        self.enter_threshold = enter_threshold
+        self.exit_threshold = exit_threshold
+        self.min_occupancy = min_occupancy
+        self.min_gap = min_gap
+        self.samples = deque(maxlen=window)
+        self.state = EMPTY
+        self.occupied_since = None
+        self.clear_since = None
+        self.min_distance = None
+        self.rejected = 0
+
+    def feed(self, timestamp, distance):
+        # Sem eco significa nada ao alcance do sensor; falhas isoladas com o animal
+        # no feixe são absorvidas pela mediana do buffer
+        if distance is None:
+            distance = float("inf")
+
+        self.samples.append(distance)
+        level = statistics.median(self.samples)
+
+        if self.state == EMPTY:
+            if level < self.enter_threshold:
+                self.state = OCCUPIED
+                self.occupied_since = timestamp
+                self.clear_since = None
+                self.min_distance = level
+            return None
+
+        self.min_distance = min(self.min_distance, level)
+
+        if level <= self.exit_threshold:
+            self.clear_since = None
+            return None
+
+        if self.clear_since is None:
+            self.clear_since = timestamp
+        if timestamp - self.clear_since < self.min_gap:
+            return None
+
+        return self.close(self.clear_since)
+
+    def close(self, end):
+        start = self.occupied_since
+        self.state = EMPTY
+        self.occupied_since = None
+        self.clear_since = None
+
+        if end - start < self.min_occupancy:
+            self.rejected += 1
+            return None
+        return Detection(start, end, end - start, self.min_distance)
+
+    def finish(self, timestamp):
+        # Encerra uma ocupação em andamento (fim de um trace ou desligamento)
+        if self.state != OCCUPIED:
+            return None
+        return self.close(self.clear_since if self.clear_since is not None else timestamp)
+
+
+class CooldownDetector:
+    # Regra antiga: qualquer leitura abaixo do limite conta, desde que tenha passado o cooldown
+    def __init__(self, threshold=15, cooldown=3):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.last_detection = None
+
+    def feed(self, timestamp, distance):
+        if distance is None or distance >= self.threshold:
+            return None
+        if self.last_detection is not None and timestamp - self.last_detection <= self.cooldown:
+            return None
+        self.last_detection = timestamp
+        return Detection(timestamp, timestamp, 0.0, distance)
+
+    def finish(self, timestamp):
+        return None
+
+
+class PendingDetection:
+    def __init__(self, lanes, key, detection, due):
+        self.lanes = lanes
+        self.key = key
+        self.detection = detection
+        self.due = due
+
+
+class LaneFusion:
+    # Junta detecções de raias vizinhas que se sobrepõem no tempo: um animal largo passa
+    # pelos dois feixes ao mesmo tempo e deve contar uma vez só. Cada detecção espera
+    # `window` segundos depois de terminar, o tempo de a raia vizinha terminar também.
+    # Dois animais lado a lado, entrando quase juntos, são indistinguíveis de um animal
+    # largo; min_overlap (fração da ocupação mais curta) controla esse compromisso.
+    def __init__(self, window=0.5, min_overlap=0.5):
+        self.window = window
+        self.min_overlap = min_overlap
+        self.pending = []
+        self.fused = 0
+
+    def overlaps(self, a, b):
+        overlap = min(a.end, b.end) - max(a.start, b.start)
+        return overlap > 0 and overlap >= self.min_overlap * min(a.duration, b.duration)
+
+    def add(self, lane, detection, key=None):
+        # lane é a posição da raia na porteira; só raias vizinhas (posições consecutivas)
+        # com a mesma chave (tipo de animal) são fundidas
+        for entry in self.pending:
+            if (entry.key == key and lane not in entry.lanes
+                    and any(abs(lane - other) == 1 for other in entry.lanes)
+                    and self.overlaps(entry.detection, detection)):
+                start = min(entry.detection.start, detection.start)
+                end = max(entry.detection.end, detection.end)
+                entry.detection = Detection(start, end, end - start,
+                                            min(entry.detection.min_distance, detection.min_distance))
+                entry.lanes.add(lane)
+                entry.due = max(entry.due, detection.end + self.window)
+                self.fused += 1
+                return
+        self.pending.append(PendingDetection({lane}, key, detection, detection.end + self.window))
+
+    def poll(self, timestamp):
+        # Devolve (raias, chave, detecção) das detecções cuja espera já terminou
+        ready = [entry for entry in self.pending if entry.due <= timestamp]
+        if ready:
+            self.pending = [entry for entry in self.pending if entry.due > timestamp]
+        return [(sorted(entry.lanes), entry.key, entry.detection)
+                for entry in sorted(ready, key=lambda entry: entry.detection.start)]
+
+    def flush(self):
+        return self.poll(float("inf"))
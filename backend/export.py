@@ -0,0 +1,209 @@
+import csv
+import datetime
+import io
+import zipfile
+from xml.sax.saxutils import escape
+
+# Exportação de contagens em CSV e XLSX gerada em pedaços, linha a linha.
+# Nenhum dos formatos guarda o resultado inteiro em memória: o CSV é escrito em blocos
+# e o XLSX é um zip montado em streaming (sem seek), com a planilha escrita conforme
+# as linhas chegam.
+
+EXPORT_CHUNK_ROWS = 1000
+
+EXCEL_EPOCH = datetime.datetime(1899, 12, 30)
+COLUMN_LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+XLSX_MAX_ROWS = 1048576  # Limite de linhas por planilha do Excel; o restante continua na próxima aba
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+CONTENT_TYPE_PREFIX = "application/vnd.openxmlformats-officedocument.spreadsheetml"
+
+XLSX_ROOT_RELS = (
+    XML_DECLARATION +
+    f'<Relationships xmlns="{PACKAGE_REL_NS}">'
+    f'<Relationship Id="rId1" Type="{REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+# Estilo 1 = data e hora (dd/mm/aaaa hh:mm:ss)
+XLSX_STYLES = (
+    XML_DECLARATION +
+    f'<styleSheet xmlns="{MAIN_NS}">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="dd/mm/yyyy hh:mm:ss"/></numFmts>'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+SHEET_HEADER = XML_DECLARATION + f'<worksheet xmlns="{MAIN_NS}"><sheetData>'
+SHEET_FOOTER = '</sheetData></worksheet>'
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def chunked(rows, size=EXPORT_CHUNK_ROWS):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_csv(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+
+    for chunk in chunked(rows):
+        for row in chunk:
+            writer.writerow([value.isoformat() if isinstance(value, datetime.datetime) else value for value in row])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def xlsx_cell(ref, value):
+    if value is None:
+        return f'<c r="{ref}"/>'
+    if isinstance(value, datetime.datetime):
+        serial = (value - EXCEL_EPOCH).total_seconds() / 86400
+        return f'<c r="{ref}" s="1"><v>{serial:.10f}</v></c>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    return f'<c r="{ref}" t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def xlsx_row(number, values):
+    cells = "".join(xlsx_cell(f"{COLUMN_LETTERS[i]}{number}", value) for i, value in enumerate(values))
+    return f'<row r="{number}">{cells}</row>'
+
+
+class StreamBuffer:
+    # Destino sem seek para o ZipFile; o que foi escrito é recolhido a cada bloco
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def xlsx_content_types(sheets):
+    overrides = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{n}.xml" ContentType="{CONTENT_TYPE_PREFIX}.worksheet+xml"/>'
+        for n in range(1, sheets + 1)
+    )
+    return (
+        XML_DECLARATION +
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        f'<Override PartName="/xl/workbook.xml" ContentType="{CONTENT_TYPE_PREFIX}.sheet.main+xml"/>'
+        f'<Override PartName="/xl/styles.xml" ContentType="{CONTENT_TYPE_PREFIX}.styles+xml"/>'
+        f'{overrides}</Types>'
+    )
+
+
+def xlsx_workbook(sheets):
+    entries = "".join(
+        f'<sheet name="Contagens{"" if n == 1 else f" {n}"}" sheetId="{n}" r:id="rId{n}"/>'
+        for n in range(1, sheets + 1)
+    )
+    return XML_DECLARATION + f'<workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}"><sheets>{entries}</sheets></workbook>'
+
+
+def xlsx_workbook_rels(sheets):
+    relationships = "".join(
+        f'<Relationship Id="rId{n}" Type="{REL_NS}/worksheet" Target="worksheets/sheet{n}.xml"/>'
+        for n in range(1, sheets + 1)
+    )
+    return (
+        XML_DECLARATION +
+        f'<Relationships xmlns="{PACKAGE_REL_NS}">{relationships}'
+        f'<Relationship Id="rId{sheets + 1}" Type="{REL_NS}/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    )
+
+
+def iter_xlsx(header, rows):
+    # As abas são gravadas primeiro; o workbook, que precisa saber quantas abas existem,
+    # entra no fim do zip (a ordem das partes dentro do arquivo não importa)
+    buffer = StreamBuffer()
+    sheets = 0
+    sheet = None
+    number = XLSX_MAX_ROWS
+
+    def open_sheet():
+        nonlocal sheets
+        sheets += 1
+        part = archive.open(f"xl/worksheets/sheet{sheets}.xml", "w", force_zip64=True)
+        part.write((SHEET_HEADER + xlsx_row(1, header)).encode("utf-8"))
+        return part
+
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for chunk in chunked(rows):
+            lines = []
+            for row in chunk:
+                if number >= XLSX_MAX_ROWS:
+                    if sheet is not None:
+                        sheet.write(("".join(lines) + SHEET_FOOTER).encode("utf-8"))
+                        sheet.close()
+                        lines = []
+                    sheet = open_sheet()
+                    number = 1
+                number += 1
+                lines.append(xlsx_row(number, row))
+            sheet.write("".join(lines).encode("utf-8"))
+
+            data = buffer.drain()
+            if data:
+                yield data
+
+        if sheet is None:
+            sheet = open_sheet()
+        sheet.write(SHEET_FOOTER.encode("utf-8"))
+        sheet.close()
+
+        for name, content in (
+            ("[Content_Types].xml", xlsx_content_types(sheets)),
+            ("_rels/.rels", XLSX_ROOT_RELS),
+            ("xl/workbook.xml", xlsx_workbook(sheets)),
+            ("xl/_rels/workbook.xml.rels", xlsx_workbook_rels(sheets)),
+            ("xl/styles.xml", XLSX_STYLES),
+        ):
+            archive.writestr(name, content)
+
+    yield buffer.drain()
+
+
+EXPORTERS = {
+    'csv': iter_csv,
+    'xlsx': iter_xlsx,
+}
@@ -0,0 +1,148 @@
+import random
+import threading
+import time
+
+# Backend de GPIO simulado com a mesma interface usada do RPi.GPIO.
+# Permite rodar, testar e medir o raspberry_counter.py em qualquer Linux:
+#
+#   GPIO_BACKEND=fake python3 raspberry_counter.py bench
+#
+# Cada sensor HC-SR04 simulado responde a um pulso no TRIG gerando um pulso
+# no ECHO com duração proporcional à distância, exatamente como o real.
+
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+RISING = 31
+FALLING = 32
+BOTH = 33
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+
+SPEED_OF_SOUND_CM_S = 34300
+ECHO_START_DELAY = 0.0002  # O HC-SR04 emite a rajada ~200µs após o trigger
+
+_lock = threading.Lock()
+_levels = {}
+_callbacks = {}
+_sensors = {}
+
+
+class FakeSensor:
+    def __init__(self, trig_pin, echo_pin, distance=100.0, noise_cm=0.0, dropout=0.0):
+        self.trig_pin = trig_pin
+        self.echo_pin = echo_pin
+        self.distance = distance
+        self.noise_cm = noise_cm
+        self.dropout = dropout
+        self.rise_at = None
+        self.fall_at = None
+        self.triggers = 0
+
+    def current_distance(self):
+        distance = self.distance() if callable(self.distance) else self.distance
+        if distance is None or random.random() < self.dropout:
+            return None
+        return max(2.0, distance + random.gauss(0, self.noise_cm))
+
+    def level(self):
+        if self.rise_at is None:
+            return LOW
+        now = time.perf_counter()
+        return HIGH if self.rise_at <= now < self.fall_at else LOW
+
+    def fire(self):
+        self.triggers += 1
+        distance = self.current_distance()
+        if distance is None:
+            self.rise_at = self.fall_at = None
+            return
+
+        start = time.perf_counter() + ECHO_START_DELAY
+        self.rise_at = start
+        self.fall_at = start + 2 * distance / SPEED_OF_SOUND_CM_S
+        threading.Thread(target=self.emit_edges, args=(self.rise_at, self.fall_at), daemon=True).start()
+
+    def emit_edges(self, rise_at, fall_at):
+        # Os callbacks rodam em outra thread, como no RPi.GPIO
+        for edge_at, edge in ((rise_at, RISING), (fall_at, FALLING)):
+            delay = edge_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            _dispatch(self.echo_pin, edge)
+
+
+def attach_sensor(trig_pin, echo_pin, distance=100.0, noise_cm=0.0, dropout=0.0):
+    # distance pode ser um número ou uma função sem argumentos que devolve cm (ou None para sem eco)
+    sensor = FakeSensor(trig_pin, echo_pin, distance, noise_cm, dropout)
+    with _lock:
+        _sensors[trig_pin] = sensor
+    return sensor
+
+
+def get_sensor(trig_pin):
+    return _sensors.get(trig_pin)
+
+
+def _dispatch(channel, edge):
+    with _lock:
+        callbacks = list(_callbacks.get(channel, ()))
+    for wanted, callback in callbacks:
+        if wanted == BOTH or wanted == edge:
+            callback(channel)
+
+
+def setmode(mode):
+    pass
+
+
+def setwarnings(flag):
+    pass
+
+
+def setup(channel, direction, pull_up_down=PUD_OFF, initial=LOW):
+    with _lock:
+        _levels[channel] = initial if direction == OUT else LOW
+
+
+def output(channel, value):
+    value = HIGH if value else LOW
+    with _lock:
+        previous = _levels.get(channel, LOW)
+        _levels[channel] = value
+        sensor = _sensors.get(channel)
+
+    # Borda de descida no TRIG dispara a medição
+    if sensor and previous == HIGH and value == LOW:
+        sensor.fire()
+
+
+def input(channel):
+    for sensor in list(_sensors.values()):
+        if sensor.echo_pin == channel:
+            return sensor.level()
+    return _levels.get(channel, LOW)
+
+
+def add_event_detect(channel, edge, callback=None, bouncetime=None):
+    with _lock:
+        _callbacks.setdefault(channel, []).append((edge, callback))
+
+
+def remove_event_detect(channel):
+    with _lock:
+        _callbacks.pop(channel, None)
+
+
+def cleanup(channel=None):
+    with _lock:
+        if channel is None:
+            _levels.clear()
+            _callbacks.clear()
+        else:
+            _levels.pop(channel, None)
+            _callbacks.pop(channel, None)
@@ -0,0 +1,40 @@
+import multiprocessing
+import os
+import sys
+
+# Configuração do gunicorn para produção (um worker por núcleo):
+#
+#   cd backend
+#   SECRET_KEY=... gunicorn -c gunicorn.conf.py wsgi:app
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+
+# gthread: cada conexão SSE (/api/stream) ocupa uma thread enquanto estiver aberta,
+# então threads limita quantos navegadores cada worker atende ao mesmo tempo
+worker_class = "gthread"
+threads = int(os.environ.get("WORKER_THREADS", 16))
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+# Formato padrão do gunicorn, mas com o caminho sem a query string (%(U)s no lugar da
+# linha de requisição): o ticket do /api/stream vai na URL e não deve parar no log
+access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(m)s %(U)s %(H)s" %(s)s %(b)s "%(f)s" "%(a)s"'
+
+# O app é importado uma vez no master e compartilhado com os workers por fork
+preload_app = True
+
+# Cada worker aplica no seu cache, registro de dispositivos e clientes SSE o que os
+# outros workers gravaram no banco
+os.environ.setdefault("WORKER_SYNC_INTERVAL", "1")
+
+
+def post_fork(server, worker):
+    # Conexões abertas no master não podem ser usadas por mais de um processo;
+    # cada worker começa com um pool vazio (close=False não fecha as do master)
+    module = sys.modules.get("wsgi")
+    if module is not None:
+        from app import db
+        with module.app.app_context():
+            db.engine.dispose(close=False)
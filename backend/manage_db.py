@@ -1,9 +1,29 @@
-from app import app, db, User, Count, Device
+from app import (
+    create_app, db, User, Count, Device, HourlyCount, DailyCount, ArchiveMonth, ArchivedTotal,
+    ARCHIVE_COLUMNS, EXPORT_HEADER, archive_path, export_rows, month_bounds, read_archive_file,
+    stats_queries, update_rollups, upsert_insert, uuid7
+)
+from export import EXPORTERS
+import argparse
+import csv
+import datetime
+import gzip
+import os
 import sys
 
+app = create_app()
+
+# Mesmo formato de texto que o SQLAlchemy usa para gravar DateTime no SQLite
+ROLLUP_BUCKET_FORMATS = {
+    HourlyCount: '%Y-%m-%d %H:00:00.000000',
+    DailyCount: '%Y-%m-%d 00:00:00.000000',
+}
+
 def create_database():
     with app.app_context():
         db.create_all()
+        set_schema_version(LATEST_SCHEMA_VERSION)
+        db.session.commit()
         print("✅ Banco de dados criado com sucesso!")
 
 def drop_database():
@@ -15,6 +35,8 @@ def reset_database():
     with app.app_context():
         db.drop_all()
         db.create_all()
+        set_schema_version(LATEST_SCHEMA_VERSION)
+        db.session.commit()
         print("✅ Banco de dados resetado com sucesso!")
 
 def show_users():
@@ -50,10 +72,359 @@ def show_devices():
             print(f"ID: {device.id}")
             print(f"Nome: {device.name}")
             print(f"Localização: {device.location}")
-            print(f"Status: {device.status}")
+            print(f"Status: {device.current_status()}")
             print(f"Último sinal: {device.last_seen}")
             print("-" * 50)
 
+def rebuild_rollup_rows():
+    animal_type = db.func.coalesce(Count.animal_type, 'desconhecido')
+    
+    for model, bucket_format in ROLLUP_BUCKET_FORMATS.items():
+        bucket = db.func.strftime(bucket_format, Count.timestamp)
+        
+        db.session.execute(db.delete(model))
+        db.session.execute(
+            db.insert(model).from_select(
+                ['bucket', 'device_id', 'animal_type', 'total', 'records'],
+                db.select(
+                    bucket,
+                    Count.device_id,
+                    animal_type,
+                    db.func.sum(Count.count),
+                    db.func.count()
+                )
+                .where(Count.timestamp.isnot(None))
+                .group_by(bucket, Count.device_id, animal_type)
+            )
+        )
+    
+    # Contagens arquivadas continuam fazendo parte dos agregados
+    for month in db.session.execute(db.select(ArchiveMonth.month)).scalars():
+        path = archive_path(month)
+        if os.path.exists(path):
+            update_rollups(read_archive_file(path))
+
+def rebuild_rollups():
+    with app.app_context():
+        rebuild_rollup_rows()
+        db.session.commit()
+        
+        print("✅ Agregados reconstruídos com sucesso!")
+        print(f"Buckets por hora: {HourlyCount.query.count()}")
+        print(f"Buckets por dia: {DailyCount.query.count()}")
+
+# ========== MIGRAÇÕES ==========
+
+def get_schema_version():
+    return db.session.execute(db.text('PRAGMA user_version')).scalar()
+
+def set_schema_version(version):
+    db.session.execute(db.text(f'PRAGMA user_version = {int(version)}'))
+
+def create_indexes(table, names):
+    connection = db.session.connection()
+    for index in table.indexes:
+        if index.name in names:
+            index.create(connection, checkfirst=True)
+
+def migration_rollup_tables():
+    db.create_all()
+    rebuild_rollup_rows()
+
+def migration_count_indexes():
+    create_indexes(Count.__table__, [
+        'ix_count_timestamp',
+        'ix_count_device_timestamp',
+        'ix_count_type_timestamp',
+    ])
+    db.session.execute(db.text('ANALYZE'))
+
+COUNT_REKEY_CHUNK = 5000
+
+def migration_compact_count_ids():
+    # Recria a tabela count com IDs UUIDv7 de 16 bytes, inserindo as linhas em ordem
+    # de timestamp para que a chave primária fique ordenada pelo tempo
+    table = Count.__table__.name
+    connection = db.session.connection()
+    
+    for index in Count.__table__.indexes:
+        connection.exec_driver_sql(f'DROP INDEX IF EXISTS {index.name}')
+    connection.exec_driver_sql(f'ALTER TABLE "{table}" RENAME TO "{table}_old"')
+    Count.__table__.create(connection)
+    
+    rows = connection.execute(
+        db.text(
+            f'SELECT device_id, count, animal_type, timestamp FROM "{table}_old" '
+            'ORDER BY timestamp, id'
+        ).columns(timestamp=db.DateTime)
+    )
+    
+    total = 0
+    while True:
+        chunk = rows.fetchmany(COUNT_REKEY_CHUNK)
+        if not chunk:
+            break
+        
+        values = []
+        for device_id, count, animal_type, timestamp in chunk:
+            created_at = timestamp.replace(tzinfo=datetime.timezone.utc).timestamp() if timestamp else None
+            values.append({
+                'id': uuid7(created_at),
+                'device_id': device_id,
+                'count': count,
+                'animal_type': animal_type,
+                'timestamp': timestamp
+            })
+        db.session.execute(db.insert(Count), values)
+        total += len(values)
+    
+    connection.exec_driver_sql(f'DROP TABLE "{table}_old"')
+    db.session.execute(db.text('ANALYZE'))
+    print(f"   {total} contagem(ns) regravada(s) com IDs compactos")
+
+def migration_archive_tables():
+    db.create_all()
+
+def migration_count_event_ids():
+    # IDs de evento gerados nos dispositivos; o índice único torna o reenvio idempotente.
+    # Bancos que passaram pela migração 3 nesta versão já têm a coluna
+    table = Count.__table__.name
+    connection = db.session.connection()
+    columns = {column['name'] for column in db.inspect(connection).get_columns(table)}
+    if 'event_id' not in columns:
+        connection.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN event_id VARCHAR(64)')
+    create_indexes(Count.__table__, ['ux_count_event_id'])
+
+# Nunca altere ou remova uma migração já publicada; adicione uma nova no final
+MIGRATIONS = [
+    (1, 'Tabelas de agregados por hora/dia', migration_rollup_tables),
+    (2, 'Índices de Count por timestamp, dispositivo e tipo', migration_count_indexes),
+    (3, 'IDs de Count ordenados pelo tempo (UUIDv7 em 16 bytes)', migration_compact_count_ids),
+    (4, 'Tabelas de controle do arquivo de contagens antigas', migration_archive_tables),
+    (5, 'ID de evento do dispositivo em Count (reenvio idempotente)', migration_count_event_ids),
+]
+
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def migrate():
+    with app.app_context():
+        current = get_schema_version()
+        pending = [m for m in MIGRATIONS if m[0] > current]
+        
+        if not pending:
+            print(f"✅ Banco de dados já está na versão {current}")
+            return
+        
+        for version, description, apply in pending:
+            print(f"⏳ Aplicando migração {version}: {description}")
+            try:
+                apply()
+                set_schema_version(version)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Falha na migração {version}: {e}")
+                sys.exit(1)
+        
+        print(f"✅ Banco de dados migrado para a versão {get_schema_version()}")
+
+def show_schema_version():
+    with app.app_context():
+        current = get_schema_version()
+        print(f"\n📊 Versão do esquema: {current} (mais recente: {LATEST_SCHEMA_VERSION})\n")
+        for version, description, _ in MIGRATIONS:
+            status = "✅" if version <= current else "⏳"
+            print(f"  {status} {version} - {description}")
+        print()
+
+def explain_queries():
+    with app.app_context():
+        now = datetime.datetime.now()
+        today_start = datetime.datetime.combine(now.date(), datetime.time.min)
+        device_id = db.session.execute(db.select(Count.device_id).limit(1)).scalar() or 'unknown'
+        
+        queries = {
+            'Contagens de hoje (/api/counts/today)':
+                db.select(Count)
+                .where(Count.timestamp >= today_start)
+                .order_by(Count.timestamp.desc()),
+            'Página por dispositivo (/api/counts?device=)':
+                db.select(Count)
+                .where(Count.device_id == device_id)
+                .order_by(Count.timestamp.desc(), Count.id.desc())
+                .limit(101),
+            'Série por hora (/api/counts/series)':
+                db.select(HourlyCount.bucket, db.func.sum(HourlyCount.total))
+                .where(HourlyCount.bucket >= now - datetime.timedelta(hours=24))
+                .group_by(HourlyCount.bucket),
+        }
+        for n, query in enumerate(stats_queries(), start=1):
+            queries[f'Estatísticas, parte {n} (/api/counts/stats)'] = query
+        
+        connection = db.session.connection()
+        for title, query in queries.items():
+            compiled = query.compile(db.engine)
+            params = tuple(compiled.params[name] for name in compiled.positiontup)
+            plan = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params).all()
+            
+            print(f"\n🔎 {title}")
+            for row in plan:
+                print(f"   {row[-1]}")
+        print()
+
+# ========== ARQUIVAMENTO ==========
+
+ARCHIVE_MIN_DAYS = 31  # As janelas de hoje/semana/mês das estatísticas sempre ficam no banco
+ARCHIVE_DELETE_CHUNK = 500
+
+def write_archive_file(path, rows):
+    # Grava num arquivo temporário e troca no final, para nunca deixar um mês pela metade
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    with gzip.open(temp_path, 'wt', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=ARCHIVE_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, 'timestamp': row['timestamp'].isoformat()})
+    with open(temp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def archive_month(month, cutoff):
+    month_start, month_end = month_bounds(month)
+    until = min(cutoff, month_end)
+    
+    counts = db.session.execute(
+        db.select(Count)
+        .where(Count.timestamp >= month_start, Count.timestamp < until)
+        .order_by(Count.timestamp, Count.id)
+    ).scalars().all()
+    if not counts:
+        return 0
+    
+    moved = [{column: getattr(count, column) for column in ARCHIVE_COLUMNS} for count in counts]
+    path = archive_path(month)
+    existing = read_archive_file(path) if os.path.exists(path) else []
+    
+    # Mescla com o que já estava arquivado; uma linha repetida (execução anterior
+    # interrompida depois de gravar o arquivo) fica uma vez só
+    merged = {row['id']: row for row in existing}
+    merged.update((row['id'], row) for row in moved)
+    rows = sorted(merged.values(), key=lambda row: (row['timestamp'], row['id']))
+    write_archive_file(path, rows)
+    
+    # O arquivo já está no disco; agora as linhas saem do banco na mesma transação
+    # que atualiza os totais arquivados usados pelas estatísticas
+    ids = [row['id'] for row in moved]
+    for i in range(0, len(ids), ARCHIVE_DELETE_CHUNK):
+        db.session.execute(db.delete(Count).where(Count.id.in_(ids[i:i + ARCHIVE_DELETE_CHUNK])))
+    
+    totals = {}
+    for row in moved:
+        key = (row['device_id'], row['animal_type'])
+        total, records = totals.get(key, (0, 0))
+        totals[key] = (total + row['count'], records + 1)
+    
+    stmt = upsert_insert(ArchivedTotal)
+    db.session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=['device_id', 'animal_type'],
+            set_={
+                'total': ArchivedTotal.total + stmt.excluded.total,
+                'records': ArchivedTotal.records + stmt.excluded.records,
+            }
+        ),
+        [
+            {'device_id': device_id, 'animal_type': animal_type, 'total': total, 'records': records}
+            for (device_id, animal_type), (total, records) in totals.items()
+        ]
+    )
+    
+    entry = db.session.get(ArchiveMonth, month) or ArchiveMonth(month=month, archived_until=until)
+    entry.archived_until = max(entry.archived_until, until)
+    entry.rows = len(rows)
+    entry.total = sum(row['count'] for row in rows)
+    db.session.add(entry)
+    db.session.commit()
+    return len(moved)
+
+def archive_counts():
+    parser = argparse.ArgumentParser(prog='manage_db.py archive')
+    parser.add_argument('--older-than', type=int, required=True,
+                        help=f'Arquiva contagens com mais de N dias (mínimo {ARCHIVE_MIN_DAYS})')
+    args = parser.parse_args(sys.argv[2:])
+    
+    if args.older_than < ARCHIVE_MIN_DAYS:
+        print(f"❌ --older-than deve ser de pelo menos {ARCHIVE_MIN_DAYS} dias")
+        sys.exit(1)
+    
+    with app.app_context():
+        if get_schema_version() < 4:
+            print("❌ Rode 'python manage_db.py migrate' antes de arquivar")
+            sys.exit(1)
+        
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=args.older_than)
+        oldest = db.session.execute(db.select(db.func.min(Count.timestamp))).scalar()
+        if oldest is None or oldest >= cutoff:
+            print(f"✅ Nenhuma contagem anterior a {cutoff:%Y-%m-%d %H:%M}")
+            return
+        
+        print(f"⏳ Arquivando contagens anteriores a {cutoff:%Y-%m-%d %H:%M} em {app.config['ARCHIVE_DIR']}")
+        month = datetime.datetime(oldest.year, oldest.month, 1)
+        total = 0
+        while month < cutoff:
+            key = f'{month:%Y-%m}'
+            try:
+                moved = archive_month(key, cutoff)
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Falha ao arquivar {key}: {e}")
+                sys.exit(1)
+            if moved:
+                print(f"   {key}: {moved} contagem(ns) -> {archive_path(key)}")
+            total += moved
+            month = month_bounds(key)[1]
+        
+        # Devolve ao sistema de arquivos o espaço das linhas removidas
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.exec_driver_sql('VACUUM')
+        
+        print(f"✅ {total} contagem(ns) arquivada(s); agregados mantidos no banco")
+
+def show_archive():
+    with app.app_context():
+        months = ArchiveMonth.query.order_by(ArchiveMonth.month).all()
+        print(f"\n📦 Meses arquivados: {len(months)}\n")
+        for entry in months:
+            print(f"{entry.month}: {entry.rows} registro(s), {entry.total} animal(is), "
+                  f"até {entry.archived_until:%Y-%m-%d %H:%M} -> {archive_path(entry.month)}")
+        print()
+
+# ========== EXPORTAÇÃO ==========
+
+def export_counts():
+    parser = argparse.ArgumentParser(prog='manage_db.py export')
+    parser.add_argument('--from', dest='start', type=datetime.datetime.fromisoformat, help='Início (AAAA-MM-DD)')
+    parser.add_argument('--to', dest='end', type=datetime.datetime.fromisoformat, help='Fim (AAAA-MM-DD)')
+    parser.add_argument('--device', dest='device_id', help='Somente este dispositivo')
+    parser.add_argument('--format', choices=sorted(EXPORTERS), default='csv')
+    parser.add_argument('--output', '-o', help='Arquivo de saída (padrão: saída padrão)')
+    args = parser.parse_args(sys.argv[2:])
+    
+    filters = {'start': args.start, 'end': args.end, 'device_id': args.device_id}
+    
+    with app.app_context():
+        output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        try:
+            for chunk in EXPORTERS[args.format](EXPORT_HEADER, export_rows(filters)):
+                output.write(chunk)
+        finally:
+            if args.output:
+                output.close()
+        
+        if args.output:
+            print(f"✅ Exportação gravada em {args.output}")
+
 def create_test_user():
     with app.app_context():
         from werkzeug.security import generate_password_hash
@@ -89,6 +460,13 @@ def show_help():
     print("  counts       - Mostra todas as contagens")
     print("  devices      - Mostra todos os dispositivos")
     print("  testuser     - Cria um usuário de teste (admin/admin123)")
+    print("  rebuild-rollups - Recalcula os agregados por hora/dia a partir das contagens")
+    print("  migrate      - Aplica as migrações pendentes sem apagar dados")
+    print("  schema-version - Mostra a versão do esquema e as migrações aplicadas")
+    print("  explain      - Mostra o plano de execução das consultas do dashboard")
+    print("  archive --older-than DIAS - Move contagens antigas para arquivos mensais comprimidos")
+    print("  archive-info - Lista os meses arquivados")
+    print("  export [--from --to --device --format csv|xlsx -o ARQUIVO] - Exporta contagens")
     print("  help         - Mostra esta mensagem")
     print("\nExemplo de uso:")
     print("  python manage_db.py create")
@@ -111,6 +489,13 @@ if __name__ == "__main__":
         'counts': show_counts,
         'devices': show_devices,
         'testuser': create_test_user,
+        'rebuild-rollups': rebuild_rollups,
+        'migrate': migrate,
+        'schema-version': show_schema_version,
+        'explain': explain_queries,
+        'archive': archive_counts,
+        'archive-info': show_archive,
+        'export': export_counts,
         'help': show_help
     }
     
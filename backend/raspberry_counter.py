@@ -1,9 +1,22 @@
-import RPi.GPIO as GPIO
+import os
+
+# GPIO_BACKEND=fake usa o GPIO simulado (fake_gpio.py) para rodar fora da Raspberry Pi
+if os.environ.get("GPIO_BACKEND") == "fake":
+    import fake_gpio as GPIO
+else:
+    import RPi.GPIO as GPIO
 import requests
 import time
 import uuid
 from datetime import datetime
 import json
+import queue
+import statistics
+from detector import LaneFusion, PresenceDetector
+import random
+import sqlite3
+import threading
+from collections import deque
 
 # ========== CONFIGURAÇÕES ==========
 
@@ -13,61 +26,249 @@ DEVICE_NAME = "Raspberry Pi - Porteira Principal"
 DEVICE_LOCATION = "Entrada do Pasto"
 
 # Pinos GPIO (BCM)
-TRIG_PIN = 23        # Pino TRIG do sensor ultrassônico
+TRIG_PIN = 23        # Pino TRIG do sensor ultrassônico (porteira com um sensor)
 ECHO_PIN = 24        # Pino ECHO do sensor ultrassônico
 LED_PIN = 17         # Pino do LED
 BUZZER_PIN = 27      # Pino do Buzzer
 
 # Configurações de detecção
-DISTANCE_THRESHOLD = 15  # Distância em cm para detectar presença
-COOLDOWN_TIME = 3        # Tempo em segundos entre detecções (evita contar o mesmo animal)
+DISTANCE_THRESHOLD = 15       # Abaixo disso (cm) o feixe é considerado ocupado
+DISTANCE_EXIT_THRESHOLD = 20  # Acima disso (cm) o feixe volta a ser considerado livre (histerese)
+MIN_OCCUPANCY = 0.15          # Ocupações mais curtas que isso (s) são ruído e não contam
+MIN_GAP = 0.12                # Tempo livre (s) que separa dois animais em fila
+SMOOTHING_WINDOW = 3          # Leituras recentes usadas na mediana do detector
 ANIMAL_TYPE = "bovino"   # Tipo de animal sendo monitorado
 
+# Sensores da porteira, na ordem física das raias (lado a lado). Cada um tem seus pinos e
+# pode sobrescrever "threshold", "exit_threshold" e "animal_type"; o que faltar usa os
+# valores acima. Exemplo de porteira larga com duas raias:
+#   SENSORS = [
+#       {"lane": "esquerda", "trig": 23, "echo": 24},
+#       {"lane": "direita", "trig": 5, "echo": 6, "threshold": 18},
+#   ]
+SENSORS = [
+    {"lane": "principal", "trig": TRIG_PIN, "echo": ECHO_PIN},
+]
+SENSOR_SLOT_TIME = 0.035     # Duração de um slot de disparo: o eco (ECHO_TIMEOUT) e a reverberação se dissipam
+SENSOR_CROSSTALK_LANES = 1   # Sensores a até N raias de distância nunca disparam juntos
+FUSE_ADJACENT_LANES = True   # Um animal largo em duas raias vizinhas conta uma vez só
+LANE_FUSION_WINDOW = 0.5     # Segundos que uma detecção espera pela raia vizinha antes de ser contada
+LANE_FUSION_MIN_OVERLAP = 0.5  # Sobreposição mínima (fração da ocupação mais curta) para fundir
+
+# Medição do sensor
+MEASUREMENT_MODE = "edge"  # "edge": bordas do ECHO via interrupção | "polling": espera ativa (antigo)
+MEASURE_SAMPLES = 1        # Leituras por ciclo; o resultado é filtrado pela mediana
+MEASURE_SAMPLE_GAP = 0.015 # Pausa entre leituras do mesmo ciclo (deixa o eco anterior dissipar)
+ECHO_TIMEOUT = 0.03        # Sem eco em 30ms (~5m) a leitura é descartada
+OUTLIER_TOLERANCE_CM = 3   # Leituras mais distantes que isso da mediana são rejeitadas
+
+# Envio em lote
+BATCH_MAX_SIZE = 20      # Máximo de detecções por requisição
+BATCH_INTERVAL = 2       # Tempo máximo em segundos que uma detecção aguarda antes do envio
+
+# Fila local (as detecções sobrevivem a quedas de rede e reinícios)
+QUEUE_DB_PATH = "counter_queue.db"
+UPLOAD_BACKOFF_MIN = 1     # Espera inicial em segundos após uma falha de envio
+UPLOAD_BACKOFF_MAX = 300   # Espera máxima entre tentativas durante uma queda longa
+
+# Pipeline de execução
+SAMPLE_INTERVAL = 0.06     # Período fixo de amostragem do sensor (60ms é o ciclo mínimo do HC-SR04)
+HEARTBEAT_INTERVAL = 60    # Segundos entre heartbeats
+ALERT_QUEUE_SIZE = 4       # Alertas além disso são descartados (o LED/buzzer já está ativo)
+METRICS_INTERVAL = 300     # Segundos entre impressões das métricas do loop (0 desativa)
+
 # ========== CONFIGURAÇÃO DO GPIO ==========
 
-def setup_gpio():
+def setup_gpio(sensor_specs=None):
+    global sensors
+    
     GPIO.setmode(GPIO.BCM)
     GPIO.setwarnings(False)
     
-    GPIO.setup(TRIG_PIN, GPIO.OUT)
-    GPIO.setup(ECHO_PIN, GPIO.IN)
-    
     GPIO.setup(LED_PIN, GPIO.OUT)
     GPIO.setup(BUZZER_PIN, GPIO.OUT)
     
-    GPIO.output(TRIG_PIN, False)
     GPIO.output(LED_PIN, False)
     GPIO.output(BUZZER_PIN, False)
     
+    sensors = build_sensors(sensor_specs or SENSORS)
+    for sensor in sensors:
+        sensor.setup()
+    
     print("✅ GPIO configurado com sucesso!")
+    return sensors
+
+def cleanup_gpio():
+    for sensor in sensors:
+        sensor.close()
+    GPIO.cleanup()
 
 # ========== FUNÇÕES DO SENSOR ==========
 
-def measure_distance():
+SOUND_CM_PER_NS = 17150 / 1e9  # Metade da velocidade do som (ida e volta)
 
-    GPIO.output(TRIG_PIN, True)
+class EchoTimer:
+    # Marca as bordas do ECHO com perf_counter_ns dentro do callback de interrupção,
+    # então a thread que mede fica bloqueada em um Event em vez de girar a CPU
+    def __init__(self, echo_pin):
+        self.echo_pin = echo_pin
+        self.done = threading.Event()
+        self.rise_ns = None
+        self.fall_ns = None
+        GPIO.add_event_detect(echo_pin, GPIO.BOTH, callback=self.on_edge)
+    
+    def on_edge(self, channel):
+        now = time.perf_counter_ns()
+        # A primeira borda após o trigger é a subida, a segunda é a descida
+        if self.rise_ns is None:
+            self.rise_ns = now
+        elif self.fall_ns is None:
+            self.fall_ns = now
+            self.done.set()
+    
+    def trigger(self, trig_pin):
+        self.rise_ns = None
+        self.fall_ns = None
+        self.done.clear()
+        
+        GPIO.output(trig_pin, True)
+        time.sleep(0.00001)
+        GPIO.output(trig_pin, False)
+    
+    def wait(self, timeout=ECHO_TIMEOUT):
+        if not self.done.wait(timeout):
+            return None
+        return (self.fall_ns - self.rise_ns) * SOUND_CM_PER_NS
+    
+    def read(self, trig_pin, timeout=ECHO_TIMEOUT):
+        self.trigger(trig_pin)
+        return self.wait(timeout)
+    
+    def close(self):
+        GPIO.remove_event_detect(self.echo_pin)
+
+class Sensor:
+    def __init__(self, position, lane, trig, echo, threshold=None, exit_threshold=None, animal_type=None):
+        self.position = position  # Posição da raia na porteira; raias vizinhas podem ser fundidas
+        self.lane = lane
+        self.trig_pin = trig
+        self.echo_pin = echo
+        self.threshold = threshold if threshold is not None else DISTANCE_THRESHOLD
+        self.exit_threshold = exit_threshold if exit_threshold is not None else max(
+            DISTANCE_EXIT_THRESHOLD, self.threshold)
+        self.animal_type = animal_type or ANIMAL_TYPE
+        self.echo_timer = None
+    
+    def setup(self):
+        GPIO.setup(self.trig_pin, GPIO.OUT)
+        GPIO.setup(self.echo_pin, GPIO.IN)
+        GPIO.output(self.trig_pin, False)
+        
+        if GPIO.__name__ == "fake_gpio" and GPIO.get_sensor(self.trig_pin) is None:
+            GPIO.attach_sensor(self.trig_pin, self.echo_pin, distance=100.0, noise_cm=0.3)
+        
+        if MEASUREMENT_MODE == "edge":
+            self.echo_timer = EchoTimer(self.echo_pin)
+    
+    def make_detector(self):
+        return PresenceDetector(
+            enter_threshold=self.threshold,
+            exit_threshold=self.exit_threshold,
+            min_occupancy=MIN_OCCUPANCY,
+            min_gap=MIN_GAP,
+            window=SMOOTHING_WINDOW
+        )
+    
+    def close(self):
+        if self.echo_timer is not None:
+            self.echo_timer.close()
+            self.echo_timer = None
+
+def build_sensors(specs):
+    return [Sensor(position, **spec) for position, spec in enumerate(specs)]
+
+sensors = []
+
+def read_distance_polling(trig_pin=TRIG_PIN, echo_pin=ECHO_PIN, timeout=ECHO_TIMEOUT):
+    GPIO.output(trig_pin, True)
     time.sleep(0.00001)  
-    GPIO.output(TRIG_PIN, False)
+    GPIO.output(trig_pin, False)
     
-    pulse_start = time.time()
-    pulse_end = time.time()
-    timeout = time.time() + 0.1  
+    deadline = time.perf_counter_ns() + int(timeout * 1e9)
+    pulse_start = pulse_end = time.perf_counter_ns()
     
-    while GPIO.input(ECHO_PIN) == 0:
-        pulse_start = time.time()
-        if pulse_start > timeout:
+    while GPIO.input(echo_pin) == 0:
+        pulse_start = time.perf_counter_ns()
+        if pulse_start > deadline:
             return None
     
-    while GPIO.input(ECHO_PIN) == 1:
-        pulse_end = time.time()
-        if pulse_end > timeout:
+    while GPIO.input(echo_pin) == 1:
+        pulse_end = time.perf_counter_ns()
+        if pulse_end > deadline:
             return None
     
-    pulse_duration = pulse_end - pulse_start
-    distance = pulse_duration * 17150  
-    distance = round(distance, 2)
+    return (pulse_end - pulse_start) * SOUND_CM_PER_NS
+
+def read_distances_once(group):
+    # Os sensores do mesmo slot disparam juntos e os ecos são esperados com um prazo comum;
+    # no modo polling a espera ativa só consegue acompanhar um sensor por vez
+    if MEASUREMENT_MODE != "edge" or any(sensor.echo_timer is None for sensor in group):
+        return [read_distance_polling(sensor.trig_pin, sensor.echo_pin) for sensor in group]
+    
+    for sensor in group:
+        sensor.echo_timer.trigger(sensor.trig_pin)
+    deadline = time.monotonic() + ECHO_TIMEOUT
+    return [sensor.echo_timer.wait(max(0.0, deadline - time.monotonic())) for sensor in group]
+
+def filter_readings(readings):
+    valid = [r for r in readings if r is not None]
+    
+    # Exige maioria de leituras válidas para aceitar o ciclo
+    if len(valid) * 2 <= len(readings):
+        return None
+    
+    median = statistics.median(valid)
+    inliers = [r for r in valid if abs(r - median) <= OUTLIER_TOLERANCE_CM]
+    return round(statistics.mean(inliers) if inliers else median, 2)
+
+def measure_distances(group, samples=None):
+    samples = samples or MEASURE_SAMPLES
+    readings = [[] for _ in group]
+    for i in range(samples):
+        if i:
+            time.sleep(MEASURE_SAMPLE_GAP)
+        for sensor_readings, distance in zip(readings, read_distances_once(group)):
+            sensor_readings.append(distance)
+    return [filter_readings(sensor_readings) for sensor_readings in readings]
+
+def measure_distance(samples=None, sensor=None):
+    return measure_distances([sensor or sensors[0]], samples)[0]
+
+class SensorScheduler:
+    # Reveza os sensores em slots para que um não receba o eco do outro (crosstalk).
+    # Sensores a mais de crosstalk_lanes raias de distância compartilham o slot e disparam
+    # juntos; cada tick dispara um slot, então cada sensor é lido uma vez por ciclo e o
+    # ciclo nunca é menor que SAMPLE_INTERVAL (limite do HC-SR04).
+    def __init__(self, sensors, crosstalk_lanes=SENSOR_CROSSTALK_LANES):
+        count = max(1, min(len(sensors), crosstalk_lanes + 1))
+        self.slots = [sensors[i::count] for i in range(count)]
+        self.interval = max(SAMPLE_INTERVAL / count, SENSOR_SLOT_TIME)
+        self.next_slot = 0
+    
+    @property
+    def period(self):
+        # Intervalo entre duas leituras do mesmo sensor
+        return self.interval * len(self.slots)
     
-    return distance
+    def read_next(self):
+        group = self.slots[self.next_slot]
+        self.next_slot = (self.next_slot + 1) % len(self.slots)
+        try:
+            distances = measure_distances(group)
+        except Exception as e:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] ❌ Erro no sensor: {e}")
+            distances = [None] * len(group)
+        return list(zip(group, distances))
 
 # ========== FUNÇÕES DE FEEDBACK ==========
 
@@ -85,10 +286,10 @@ def trigger_alert():
 
 # ========== FUNÇÕES DE COMUNICAÇÃO COM API ==========
 
-def send_heartbeat():
+def send_heartbeat(session=requests, device_id=DEVICE_ID):
     try:
-        response = requests.post(
-            f"{API_URL}/devices/{DEVICE_ID}/heartbeat",
+        response = session.post(
+            f"{API_URL}/devices/{device_id}/heartbeat",
             timeout=5
         )
         if response.status_code == 200:
@@ -101,15 +302,17 @@ def send_heartbeat():
         print(f"[{datetime.now().strftime('%H:%M:%S')}] ❌ Erro ao enviar heartbeat: {e}")
         return False
 
-def send_count(count=1, animal_type=ANIMAL_TYPE):
+def send_count(count=1, animal_type=ANIMAL_TYPE, session=requests, device_id=DEVICE_ID, event_id=None):
     try:
         data = {
-            "device_id": DEVICE_ID,
+            "device_id": device_id,
             "count": count,
-            "animal_type": animal_type
+            "animal_type": animal_type,
+            # Reenviar o mesmo event_id depois de um timeout não duplica a contagem no servidor
+            "event_id": event_id or str(uuid.uuid4())
         }
         
-        response = requests.post(
+        response = session.post(
             f"{API_URL}/count",
             json=data,
             timeout=10
@@ -118,6 +321,9 @@ def send_count(count=1, animal_type=ANIMAL_TYPE):
         if response.status_code == 201:
             print(f"[{datetime.now().strftime('%H:%M:%S')}] ✅ Contagem enviada: {count} {animal_type}(s)")
             return True
+        elif response.status_code == 200 and response.json().get("duplicate"):
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] ✅ Contagem já estava registrada no servidor")
+            return True
         else:
             print(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️  Erro ao enviar: {response.status_code}")
             print(f"    Resposta: {response.text}")
@@ -126,6 +332,39 @@ def send_count(count=1, animal_type=ANIMAL_TYPE):
         print(f"[{datetime.now().strftime('%H:%M:%S')}] ❌ Erro na comunicação: {e}")
         return False
 
+def send_count_batch(events, session=requests):
+    try:
+        response = session.post(
+            f"{API_URL}/counts/batch",
+            json={"events": events},
+            timeout=10
+        )
+        
+        # 400 com "results" significa que todos os eventos foram rejeitados na validação
+        if response.status_code == 201 or (response.status_code == 400 and "results" in response.json()):
+            data = response.json()
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] ✅ Lote enviado: {data['accepted']} aceito(s), "
+                  f"{data.get('duplicates', 0)} já registrado(s), {data['rejected']} rejeitado(s)")
+            return data['results']
+        else:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] ⚠️  Erro ao enviar lote: {response.status_code}")
+            print(f"    Resposta: {response.text}")
+            return None
+    except Exception as e:
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] ❌ Erro na comunicação: {e}")
+        return None
+
+def make_count_event(count=1, animal_type=ANIMAL_TYPE, device_id=DEVICE_ID):
+    # O event_id nasce junto com a detecção e vai para a fila local com ela, então
+    # qualquer reenvio (timeout, queda de link, reinício) chega com o mesmo ID
+    return {
+        "event_id": str(uuid.uuid4()),
+        "device_id": device_id,
+        "count": count,
+        "animal_type": animal_type,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
 def register_device():
     try:
         print(f"[INFO] Device ID: {DEVICE_ID}")
@@ -133,13 +372,177 @@ def register_device():
     except Exception as e:
         print(f"[INFO] Registro manual necessário: {e}")
 
+# ========== FILA LOCAL (STORE-AND-FORWARD) ==========
+
+class CountQueue:
+    def __init__(self, path=QUEUE_DB_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")  # Queda de energia não pode perder detecções
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " event TEXT NOT NULL)"
+        )
+        self.conn.commit()
+    
+    def put(self, event):
+        with self.lock:
+            self.conn.execute("INSERT INTO pending (event) VALUES (?)", (json.dumps(event),))
+            self.conn.commit()
+    
+    def peek(self, limit):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, event FROM pending ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+        return [(row_id, json.loads(event)) for row_id, event in rows]
+    
+    def ack(self, ids):
+        with self.lock:
+            self.conn.executemany("DELETE FROM pending WHERE id = ?", [(row_id,) for row_id in ids])
+            self.conn.commit()
+    
+    def size(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+    
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class CountUploader(threading.Thread):
+    def __init__(self, count_queue):
+        super().__init__(daemon=True)
+        self.queue = count_queue
+        self.session = requests.Session()  # Reaproveita a conexão TCP (keep-alive)
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.running = True
+        self.backoff = 0
+        self.uploaded = 0
+        self.last_heartbeat = 0
+    
+    def notify(self):
+        self.wakeup.set()
+    
+    def run(self):
+        while self.running:
+            if time.monotonic() - self.last_heartbeat >= HEARTBEAT_INTERVAL:
+                send_heartbeat(session=self.session)
+                self.last_heartbeat = time.monotonic()
+            
+            if not self.drain_once():
+                # Fila vazia: dorme até a próxima detecção
+                self.wakeup.wait(BATCH_INTERVAL)
+                self.wakeup.clear()
+                continue
+            
+            if self.backoff:
+                delay = random.uniform(self.backoff / 2, self.backoff)
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] ⏳ Servidor indisponível, nova tentativa em {delay:.0f}s ({self.queue.size()} na fila)")
+                # Novas detecções não antecipam a tentativa; só o encerramento interrompe a espera
+                self.stopped.wait(delay)
+    
+    def drain_once(self):
+        batch = self.queue.peek(BATCH_MAX_SIZE)
+        if not batch:
+            return False
+        
+        events = [event for _, event in batch]
+        results = send_count_batch(events, session=self.session)
+        
+        if results is None:
+            self.backoff = min(max(self.backoff * 2, UPLOAD_BACKOFF_MIN), UPLOAD_BACKOFF_MAX)
+            return True
+        
+        # Eventos rejeitados pela validação também saem da fila: reenviar não adianta.
+        # "duplicate" é um evento que o servidor já tinha gravado (envio anterior sem resposta)
+        for result in results:
+            if result["status"] == "rejected":
+                print(f"    Evento descartado: {result.get('error')}")
+        self.queue.ack([row_id for row_id, _ in batch])
+        self.uploaded += sum(1 for result in results if result["status"] == "created")
+        self.backoff = 0
+        return True
+    
+    def stop(self, timeout=5):
+        # Última tentativa rápida de esvaziar a fila; o que sobrar fica no disco
+        self.running = False
+        self.stopped.set()
+        self.notify()
+        self.join(timeout)
+        if not self.is_alive() and self.backoff == 0:
+            deadline = time.time() + timeout
+            while time.time() < deadline and self.backoff == 0 and self.drain_once():
+                pass
+
+# ========== MÉTRICAS DO LOOP ==========
+
+class LoopMetrics:
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.samples = 0
+        self.missed_ticks = 0
+        self.failed_readings = 0
+        self.dropped_alerts = 0
+        self.max_jitter = 0.0
+        self.jitters = deque(maxlen=window)
+    
+    def record_tick(self, jitter, missed):
+        with self.lock:
+            self.samples += 1
+            self.missed_ticks += missed
+            self.max_jitter = max(self.max_jitter, jitter)
+            self.jitters.append(jitter)
+    
+    def record_failed_reading(self):
+        with self.lock:
+            self.failed_readings += 1
+    
+    def record_dropped_alert(self):
+        with self.lock:
+            self.dropped_alerts += 1
+    
+    def snapshot(self):
+        with self.lock:
+            jitters = sorted(self.jitters)
+            scheduled = self.samples + self.missed_ticks
+            return {
+                "samples": self.samples,
+                "missed_ticks": self.missed_ticks,
+                "dropped_ratio": self.missed_ticks / scheduled if scheduled else 0.0,
+                "failed_readings": self.failed_readings,
+                "dropped_alerts": self.dropped_alerts,
+                "jitter_p50_ms": jitters[len(jitters) // 2] * 1000 if jitters else 0.0,
+                "jitter_p95_ms": jitters[int(len(jitters) * 0.95)] * 1000 if jitters else 0.0,
+                "jitter_max_ms": self.max_jitter * 1000,
+            }
+    
+    def report(self):
+        m = self.snapshot()
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] 📈 Amostras: {m['samples']} | "
+              f"Perdidas: {m['missed_ticks']} ({m['dropped_ratio']:.1%}) | "
+              f"Leituras falhas: {m['failed_readings']} | "
+              f"Jitter p50/p95/máx: {m['jitter_p50_ms']:.1f}/{m['jitter_p95_ms']:.1f}/{m['jitter_max_ms']:.1f} ms")
+
 # ========== LOOP PRINCIPAL ==========
 
 class AnimalCounter:
     def __init__(self):
         self.running = False
         self.total_count = 0
-        self.last_detection_time = 0
+        self.sensors = []
+        self.detectors = []
+        self.scheduler = None
+        self.fusion = None
+        self.queue = CountQueue()
+        self.uploader = CountUploader(self.queue)
+        self.metrics = LoopMetrics()
+        self.detections = queue.Queue()
+        self.alerts = queue.Queue(maxsize=ALERT_QUEUE_SIZE)
+        self.threads = []
         
     def start(self):
         self.running = True
@@ -148,42 +551,50 @@ class AnimalCounter:
         print("="*60)
         print(f"Device ID: {DEVICE_ID}")
         print(f"Servidor: {API_URL}")
-        print(f"Distância de detecção: {DISTANCE_THRESHOLD}cm")
-        print(f"Cooldown: {COOLDOWN_TIME}s")
+        
+        self.sensors = setup_gpio()
+        self.detectors = [sensor.make_detector() for sensor in self.sensors]
+        self.scheduler = SensorScheduler(self.sensors)
+        if FUSE_ADJACENT_LANES and len(self.sensors) > 1:
+            self.fusion = LaneFusion(window=LANE_FUSION_WINDOW, min_overlap=LANE_FUSION_MIN_OVERLAP)
+        
+        for sensor in self.sensors:
+            print(f"Raia '{sensor.lane}' (TRIG {sensor.trig_pin}/ECHO {sensor.echo_pin}): {sensor.animal_type}, "
+                  f"detecta abaixo de {sensor.threshold}cm e libera acima de {sensor.exit_threshold}cm")
+        print(f"Ocupação mínima: {MIN_OCCUPANCY}s | Intervalo mínimo entre animais: {MIN_GAP}s")
+        print(f"Amostragem: cada sensor a cada {self.scheduler.period * 1000:.0f}ms "
+              f"({len(self.scheduler.slots)} slot(s) de {self.scheduler.interval * 1000:.0f}ms)")
+        if self.fusion:
+            print(f"Fusão de raias vizinhas: janela de {LANE_FUSION_WINDOW}s")
         print("="*60 + "\n")
         
-        setup_gpio()
         register_device()
         
+        pending = self.queue.size()
+        if pending:
+            print(f"📦 {pending} detecção(ões) pendente(s) de envio na fila local")
+        
+        # Amostragem, alertas, gravação e rede rodam em threads separadas ligadas por filas,
+        # então o sensor nunca espera pelo buzzer, pelo disco ou pelo servidor
+        self.threads = [
+            threading.Thread(target=self.sample_loop, name="sampler", daemon=True),
+            threading.Thread(target=self.alert_loop, name="alerts", daemon=True),
+            threading.Thread(target=self.record_loop, name="recorder", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+        self.uploader.start()
+        
         print("🚀 Sistema iniciado! Aguardando detecções...\n")
         
-        last_heartbeat = time.time()
+        last_report = time.monotonic()
         
         try:
             while self.running:
-                if time.time() - last_heartbeat > 60:
-                    send_heartbeat()
-                    last_heartbeat = time.time()
-                
-                distance = measure_distance()
-                
-                if distance is not None:
-                    if distance < DISTANCE_THRESHOLD:
-                        current_time = time.time()
-                        
-                        if current_time - self.last_detection_time > COOLDOWN_TIME:
-                            print(f"[{datetime.now().strftime('%H:%M:%S')}] 🎯 DETECÇÃO! Distância: {distance}cm")
-                            
-                            trigger_alert()
-                            
-                            if send_count(1, ANIMAL_TYPE):
-                                self.total_count += 1
-                                print(f"[{datetime.now().strftime('%H:%M:%S')}] 📊 Total contado hoje: {self.total_count}")
-                            
-                            self.last_detection_time = current_time
-                            print()  
-                
-                time.sleep(0.1)
+                time.sleep(1)
+                if METRICS_INTERVAL and time.monotonic() - last_report >= METRICS_INTERVAL:
+                    self.metrics.report()
+                    last_report = time.monotonic()
                 
         except KeyboardInterrupt:
             print("\n\n🛑 Sistema interrompido pelo usuário")
@@ -192,10 +603,111 @@ class AnimalCounter:
             print(f"\n\n❌ Erro fatal: {e}")
             self.stop()
     
+    def sample_loop(self):
+        interval = self.scheduler.interval
+        next_tick = time.monotonic()
+        
+        while self.running:
+            now = time.monotonic()
+            if now < next_tick:
+                time.sleep(next_tick - now)
+                now = time.monotonic()
+            
+            # Se o ciclo anterior atrasou mais de um período, os ticks perdidos são contados e pulados
+            missed = int((now - next_tick) // interval)
+            self.metrics.record_tick(now - next_tick - missed * interval, missed)
+            next_tick += (missed + 1) * interval
+            
+            # Cada tick lê um slot de sensores
+            for sensor, distance in self.scheduler.read_next():
+                if distance is None:
+                    self.metrics.record_failed_reading()
+                self.process_sample(sensor, now, distance)
+            
+            if self.fusion:
+                self.release_fused(self.fusion.poll(now))
+    
+    def process_sample(self, sensor, timestamp, distance):
+        detection = self.detectors[sensor.position].feed(timestamp, distance)
+        if detection is not None:
+            self.add_detection(sensor, detection)
+    
+    def add_detection(self, sensor, detection):
+        # Com várias raias, a detecção espera na fusão até ficar claro se a raia vizinha
+        # viu o mesmo animal
+        if self.fusion:
+            self.fusion.add(sensor.position, detection, sensor.animal_type)
+        else:
+            self.handle_detection(sensor, detection)
+    
+    def release_fused(self, ready):
+        for positions, _, detection in ready:
+            self.handle_detection(self.sensors[positions[0]], detection,
+                                  [self.sensors[position] for position in positions])
+    
+    def handle_detection(self, sensor, detection, lanes=None):
+        lanes = lanes or [sensor]
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] 🎯 DETECÇÃO na raia {' + '.join(s.lane for s in lanes)}! "
+              f"Distância mínima: {detection.min_distance:.1f}cm | Ocupação: {detection.duration:.2f}s")
+        
+        self.detections.put(make_count_event(1, sensor.animal_type))
+        try:
+            self.alerts.put_nowait(detection.min_distance)
+        except queue.Full:
+            self.metrics.record_dropped_alert()
+    
+    def alert_loop(self):
+        while True:
+            item = self.alerts.get()
+            if item is None:
+                return
+            trigger_alert()
+    
+    def record_loop(self):
+        while True:
+            event = self.detections.get()
+            if event is None:
+                return
+            
+            # Grava no disco antes do envio; o upload é feito pelo uploader
+            self.queue.put(event)
+            self.uploader.notify()
+            self.total_count += event["count"]
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] 📊 Total contado hoje: {self.total_count}")
+    
     def stop(self):
         self.running = False
-        GPIO.cleanup()
+        
+        # O sampler para primeiro; depois as sentinelas encerram os workers
+        # quando as filas forem esvaziadas, sem perder detecções em trânsito
+        if self.threads:
+            self.threads[0].join(timeout=5)
+        # Um animal que ainda estava no feixe ao desligar também é contado
+        now = time.monotonic()
+        for sensor, detector in zip(self.sensors, self.detectors):
+            detection = detector.finish(now)
+            if detection is not None:
+                self.add_detection(sensor, detection)
+        if self.fusion:
+            self.release_fused(self.fusion.flush())
+        self.detections.put(None)
+        try:
+            self.alerts.put(None, timeout=3)
+        except queue.Full:
+            pass
+        for thread in self.threads[1:]:
+            thread.join(timeout=5)
+        
+        self.uploader.stop()
+        cleanup_gpio()
+        self.metrics.report()
+        if self.fusion and self.fusion.fused:
+            print(f"🔗 {self.fusion.fused} detecção(ões) de raias vizinhas fundidas (animal largo)")
         print(f"\n📊 Total de animais contados nesta sessão: {self.total_count}")
+        pending = self.queue.size()
+        if pending:
+            print(f"📦 {pending} detecção(ões) continuam na fila local e serão enviadas na próxima execução")
+        self.queue.close()
         print("✅ GPIO limpo. Sistema encerrado.\n")
 
 # ========== MODO DE TESTE ==========
@@ -218,23 +730,140 @@ def test_mode():
     GPIO.output(BUZZER_PIN, False)
     print("   ✅ Buzzer OK")
     
-    print("\n3. Testando Sensor Ultrassônico...")
-    for i in range(5):
-        distance = measure_distance()
-        if distance:
-            print(f"   Medição {i+1}: {distance}cm")
-        else:
-            print(f"   Medição {i+1}: Erro")
-        time.sleep(0.5)
-    print("   ✅ Sensor OK")
+    print("\n3. Testando Sensores Ultrassônicos...")
+    for sensor in sensors:
+        print(f"   Raia '{sensor.lane}' (TRIG {sensor.trig_pin}/ECHO {sensor.echo_pin}):")
+        for i in range(5):
+            distance = measure_distance(sensor=sensor)
+            if distance:
+                print(f"   Medição {i+1}: {distance}cm")
+            else:
+                print(f"   Medição {i+1}: Erro")
+            time.sleep(0.5)
+    print("   ✅ Sensores OK")
     
     print("\n4. Testando alerta completo...")
     trigger_alert()
     print("   ✅ Alerta OK")
     
-    GPIO.cleanup()
+    cleanup_gpio()
     print("\n✅ Todos os testes concluídos!\n")
 
+# ========== BENCHMARK DO SENSOR ==========
+
+def bench_mode(rounds=200):
+    global MEASUREMENT_MODE
+    
+    print("\n⏱️  BENCHMARK DA MEDIÇÃO")
+    print("="*60)
+    print(f"Backend GPIO: {GPIO.__name__}")
+    
+    setup_gpio()
+    sensor = GPIO.get_sensor(sensors[0].trig_pin) if GPIO.__name__ == "fake_gpio" else None
+    if sensor:
+        sensor.distance = 40.0
+        sensor.noise_cm = 0.5
+        sensor.dropout = 0.05
+        print(f"Sensor simulado a {sensor.distance}cm (ruído {sensor.noise_cm}cm, {sensor.dropout:.0%} sem eco)")
+    
+    for mode, samples in (("polling", 1), ("edge", 1), ("edge", max(MEASURE_SAMPLES, 3))):
+        MEASUREMENT_MODE = mode
+        results = []
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        for _ in range(rounds):
+            results.append(measure_distance(samples))
+        cpu = time.process_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+        
+        valid = [r for r in results if r is not None]
+        print(f"\n{mode} x{samples}:")
+        print(f"   Leituras válidas: {len(valid)}/{rounds}")
+        if valid:
+            print(f"   Média: {statistics.mean(valid):.2f}cm | Desvio padrão: {statistics.pstdev(valid):.2f}cm")
+            if sensor:
+                error = statistics.mean(abs(r - sensor.distance) for r in valid)
+                print(f"   Erro médio absoluto: {error:.2f}cm")
+        print(f"   CPU: {cpu / wall:.0%} de um núcleo | {wall / rounds * 1000:.2f}ms por medição")
+    
+    cleanup_gpio()
+    MEASUREMENT_MODE = "edge"
+    bench_schedule()
+    print()
+
+BENCH_FAKE_LANES = 4  # Raias simuladas no benchmark do agendamento quando GPIO_BACKEND=fake
+
+def bench_schedule(duration=3):
+    # Compara o disparo em série (um sensor por vez) com o agendamento escalonado,
+    # na vazão total de leituras e no intervalo entre leituras de cada sensor
+    specs = SENSORS
+    if GPIO.__name__ == "fake_gpio" and len(SENSORS) < 2:
+        specs = [
+            {"lane": f"raia {i + 1}", "trig": 100 + 2 * i, "echo": 101 + 2 * i}
+            for i in range(BENCH_FAKE_LANES)
+        ]
+        for i, spec in enumerate(specs):
+            GPIO.attach_sensor(spec["trig"], spec["echo"], distance=40.0 + 10 * i, noise_cm=0.5)
+    if len(specs) < 2:
+        print("\nAgendamento: configure mais de um sensor em SENSORS para comparar")
+        return
+    
+    print(f"\n📡 AGENDAMENTO DE {len(specs)} SENSORES ({duration}s cada)")
+    for name, crosstalk_lanes in (("série", len(specs)), ("escalonado", SENSOR_CROSSTALK_LANES)):
+        group = setup_gpio(specs)
+        scheduler = SensorScheduler(group, crosstalk_lanes)
+        valid = {sensor.lane: 0 for sensor in group}
+        readings = 0
+        start = next_tick = time.monotonic()
+        while time.monotonic() - start < duration:
+            now = time.monotonic()
+            if now < next_tick:
+                time.sleep(next_tick - now)
+            next_tick += scheduler.interval
+            for sensor, distance in scheduler.read_next():
+                readings += 1
+                if distance is not None:
+                    valid[sensor.lane] += 1
+        elapsed = time.monotonic() - start
+        cleanup_gpio()
+        
+        print(f"\n{name}: {len(scheduler.slots)} slot(s) de {scheduler.interval * 1000:.0f}ms | "
+              f"cada sensor a cada {scheduler.period * 1000:.0f}ms")
+        print(f"   Leituras/s no total: {readings / elapsed:.1f} | válidas por raia: "
+              + ", ".join(f"{lane}: {count}" for lane, count in valid.items()))
+
+# ========== GRAVAÇÃO DE TRACE ==========
+
+def record_mode(path, duration=60, lane=None):
+    # Grava as leituras cruas de um sensor em CSV para reproduzir depois com o replay.py
+    print(f"\n🎙️  GRAVANDO TRACE em {path} por {duration}s (intervalo {SAMPLE_INTERVAL}s)")
+    setup_gpio()
+    sensor = next((s for s in sensors if s.lane == lane), sensors[0])
+    print(f"Raia: {sensor.lane}")
+    samples = 0
+    start = time.monotonic()
+    next_tick = start
+    
+    try:
+        with open(path, "w") as f:
+            f.write("timestamp,distance\n")
+            while time.monotonic() - start < duration:
+                now = time.monotonic()
+                if now < next_tick:
+                    time.sleep(next_tick - now)
+                    now = time.monotonic()
+                next_tick += SAMPLE_INTERVAL
+                
+                distance = measure_distance(sensor=sensor)
+                f.write(f"{now - start:.4f},{'' if distance is None else f'{distance:.1f}'}\n")
+                samples += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cleanup_gpio()
+    
+    print(f"✅ {samples} leituras gravadas. Reproduza com: python3 replay.py {path} --expected N\n")
+
 # ========== EXECUÇÃO ==========
 
 if __name__ == "__main__":
@@ -242,6 +871,13 @@ if __name__ == "__main__":
     
     if len(sys.argv) > 1 and sys.argv[1] == "test":
         test_mode()
+    elif len(sys.argv) > 1 and sys.argv[1] == "bench":
+        bench_mode()
+    elif len(sys.argv) > 1 and sys.argv[1] == "record":
+        path = sys.argv[2] if len(sys.argv) > 2 else "trace.csv"
+        duration = float(sys.argv[3]) if len(sys.argv) > 3 else 60
+        lane = sys.argv[4] if len(sys.argv) > 4 else None
+        record_mode(path, duration, lane)
     else:
         counter = AnimalCounter()
         counter.start()
\ No newline at end of file
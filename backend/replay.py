@@ -0,0 +1,251 @@
+import argparse
+import os
+import random
+import time
+
+# O replay usa as mesmas configurações do cliente da Raspberry Pi, com o GPIO simulado
+os.environ.setdefault("GPIO_BACKEND", "fake")
+
+import raspberry_counter as client
+from detector import CooldownDetector, LaneFusion, PresenceDetector
+
+# Reproduz leituras do sensor no detector, sem hardware.
+#
+#   python replay.py                          # todos os cenários sintéticos
+#   python replay.py --scenario fila          # um cenário
+#   python replay.py trace.csv --expected 12  # trace gravado com "raspberry_counter.py record"
+#
+# Compara o detector com histerese (atual) com a regra antiga de cooldown fixo,
+# mostrando contagem, acerto em relação ao esperado e leituras processadas por segundo.
+# O cenário "raias" simula uma porteira larga com vários sensores lado a lado e compara
+# a contagem com e sem a fusão de raias vizinhas.
+
+SCENARIOS = ("espaçado", "fila", "parada", "misto", "raias")
+LANES = 3
+
+BACKGROUND_CM = 60.0  # Distância até o outro lado da porteira quando não há animal
+
+
+def plan_scenario(name, rng):
+    # Devolve a lista de ocupações (início, fim) em segundos; cada uma é um animal
+    passes = []
+    at = 1.0
+
+    if name == "espaçado":
+        for _ in range(20):
+            duration = rng.uniform(0.4, 1.0)
+            passes.append((at, at + duration))
+            at += duration + rng.uniform(2.0, 6.0)
+
+    elif name == "fila":
+        # Animais colados uns nos outros, com pouco espaço livre entre eles
+        for _ in range(30):
+            duration = rng.uniform(0.4, 0.8)
+            passes.append((at, at + duration))
+            at += duration + rng.uniform(0.2, 0.5)
+
+    elif name == "parada":
+        # Animais que param embaixo do sensor por vários segundos
+        for _ in range(5):
+            duration = rng.uniform(5.0, 12.0)
+            passes.append((at, at + duration))
+            at += duration + rng.uniform(2.0, 4.0)
+
+    elif name == "misto":
+        for group in ("espaçado", "fila", "parada"):
+            for start, end in plan_scenario(group, rng)[:8]:
+                passes.append((at + start, at + end))
+            at = passes[-1][1] + 3.0
+
+    return passes
+
+
+def plan_lanes(rng, lanes=LANES):
+    # Animais estreitos passam por uma raia; os largos cobrem duas raias vizinhas ao mesmo
+    # tempo, com entrada e saída levemente defasadas entre os dois feixes
+    lane_passes = [[] for _ in range(lanes)]
+    animals = 0
+    at = 1.0
+    for _ in range(40):
+        duration = rng.uniform(0.5, 1.0)
+        lane = rng.randrange(lanes)
+        if rng.random() < 0.4 and lanes > 1:
+            lane = min(lane, lanes - 2)
+            lane_passes[lane].append((at, at + duration))
+            lane_passes[lane + 1].append((at + rng.uniform(0, 0.15), at + duration + rng.uniform(-0.15, 0.15)))
+        else:
+            lane_passes[lane].append((at, at + duration))
+        animals += 1
+        at += duration + rng.uniform(1.0, 3.0)
+    return lane_passes, animals
+
+
+def replay_lanes(lane_samples, args, fuse):
+    detectors = [build_detectors(args)[0][1] for _ in lane_samples]
+    fusion = LaneFusion(window=client.LANE_FUSION_WINDOW, min_overlap=client.LANE_FUSION_MIN_OVERLAP)
+    counted = 0
+    # As raias são amostradas no mesmo instante, como no agendamento do raspberry_counter.py
+    for readings in zip(*lane_samples):
+        timestamp = readings[0][0]
+        for lane, (detector, (_, distance)) in enumerate(zip(detectors, readings)):
+            detection = detector.feed(timestamp, distance)
+            if detection is None:
+                continue
+            if fuse:
+                fusion.add(lane, detection)
+            else:
+                counted += 1
+        counted += len(fusion.poll(timestamp))
+    end = lane_samples[0][-1][0]
+    for lane, detector in enumerate(detectors):
+        detection = detector.finish(end)
+        if detection is not None:
+            if fuse:
+                fusion.add(lane, detection)
+            else:
+                counted += 1
+    return counted + len(fusion.flush()), fusion.fused
+
+
+def synthesize_lanes(rng, interval, noise_cm, dropout, spikes):
+    lane_passes, expected = plan_lanes(rng)
+    duration = max(end for passes in lane_passes for _, end in passes)
+    # Todas as raias com o mesmo número de leituras, até o fim da última passagem
+    lane_samples = [
+        synthesize(passes + [(duration, duration)], interval, noise_cm, dropout, spikes, rng)
+        for passes in lane_passes
+    ]
+    length = min(len(samples) for samples in lane_samples)
+    return [samples[:length] for samples in lane_samples], expected
+
+
+def report_lanes(args):
+    rng = random.Random(args.seed)
+    lane_samples, expected = synthesize_lanes(rng, args.interval, args.noise, args.dropout, args.spikes)
+    length = len(lane_samples[0])
+    
+    print(f"\n📼 Cenário 'raias' | {len(lane_samples)} raias x {length} leituras | esperado: {expected}")
+    print(f"   {'Fusão':<12}{'Contados':>10}{'Acerto':>9}{'Fundidos':>12}")
+    for name, fuse in (("sem fusão", False), ("com fusão", True)):
+        counted, fused = replay_lanes(lane_samples, args, fuse)
+        print(f"   {name:<12}{counted:>10}{accuracy(counted, expected):>9}{fused:>12}")
+
+
+def synthesize(passes, interval, noise_cm, dropout, spikes, rng):
+    duration = (passes[-1][1] if passes else 0) + 2.0
+    samples = []
+    index = 0
+
+    for i in range(int(duration / interval)):
+        t = i * interval
+        while index < len(passes) and passes[index][1] <= t:
+            index += 1
+        occupied = index < len(passes) and passes[index][0] <= t
+
+        if rng.random() < dropout:
+            distance = None
+        elif occupied:
+            distance = rng.uniform(5.0, 11.0) + rng.gauss(0, noise_cm)
+        elif rng.random() < spikes:
+            # Eco espúrio isolado (inseto, poeira, reflexo)
+            distance = rng.uniform(3.0, 12.0)
+        else:
+            distance = BACKGROUND_CM + rng.gauss(0, noise_cm)
+        samples.append((t, distance))
+
+    return samples
+
+
+def load_trace(path):
+    samples = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("timestamp"):
+                continue
+            timestamp, distance = line.split(",")
+            samples.append((float(timestamp), float(distance) if distance else None))
+    return samples
+
+
+def replay(detector, samples):
+    detections = []
+    start = time.perf_counter()
+    for timestamp, distance in samples:
+        detection = detector.feed(timestamp, distance)
+        if detection is not None:
+            detections.append(detection)
+    if samples:
+        detection = detector.finish(samples[-1][0])
+        if detection is not None:
+            detections.append(detection)
+    elapsed = time.perf_counter() - start
+    return detections, elapsed
+
+
+def build_detectors(args):
+    return (
+        ("histerese", PresenceDetector(
+            enter_threshold=args.enter,
+            exit_threshold=args.exit,
+            min_occupancy=args.min_occupancy,
+            min_gap=args.min_gap,
+            window=args.window
+        )),
+        ("cooldown", CooldownDetector(threshold=args.enter, cooldown=args.cooldown)),
+    )
+
+
+def accuracy(counted, expected):
+    if expected is None:
+        return "-"
+    if expected == 0:
+        return f"{100 if counted == 0 else 0}%"
+    return f"{max(0.0, 1 - abs(counted - expected) / expected):.0%}"
+
+
+def report(title, samples, expected, args):
+    print(f"\n📼 {title} | {len(samples)} leituras | esperado: {expected if expected is not None else '?'}")
+    print(f"   {'Detector':<12}{'Contados':>10}{'Acerto':>9}{'Rejeitados':>12}{'Leituras/s':>14}")
+    for name, detector in build_detectors(args):
+        detections, elapsed = replay(detector, samples)
+        rejected = getattr(detector, "rejected", 0)
+        rate = len(samples) / elapsed if elapsed > 0 else float("inf")
+        print(f"   {name:<12}{len(detections):>10}{accuracy(len(detections), expected):>9}"
+              f"{rejected:>12}{rate:>14,.0f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Reproduz leituras do sensor no detector de passagem")
+    parser.add_argument("trace", nargs="?", help="CSV gravado com 'raspberry_counter.py record'")
+    parser.add_argument("--expected", type=int, default=None, help="Quantidade real de animais no trace")
+    parser.add_argument("--scenario", choices=SCENARIOS, default=None, help="Cenário sintético (padrão: todos)")
+    parser.add_argument("--interval", type=float, default=client.SAMPLE_INTERVAL, help="Intervalo entre leituras sintéticas")
+    parser.add_argument("--noise", type=float, default=1.0, help="Ruído das leituras sintéticas em cm")
+    parser.add_argument("--dropout", type=float, default=0.05, help="Fração de leituras sintéticas sem eco")
+    parser.add_argument("--spikes", type=float, default=0.01, help="Fração de ecos espúrios com o feixe livre")
+    parser.add_argument("--enter", type=float, default=client.DISTANCE_THRESHOLD, help="Limite de entrada em cm")
+    parser.add_argument("--exit", type=float, default=client.DISTANCE_EXIT_THRESHOLD, help="Limite de saída em cm")
+    parser.add_argument("--min-occupancy", type=float, default=client.MIN_OCCUPANCY, help="Ocupação mínima em segundos")
+    parser.add_argument("--min-gap", type=float, default=client.MIN_GAP, help="Tempo livre mínimo entre animais")
+    parser.add_argument("--window", type=int, default=client.SMOOTHING_WINDOW, help="Leituras na mediana")
+    parser.add_argument("--cooldown", type=float, default=3, help="Cooldown da regra antiga, para comparação")
+    parser.add_argument("--seed", type=int, default=42, help="Semente dos cenários sintéticos")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.trace:
+        report(args.trace, load_trace(args.trace), args.expected, args)
+    else:
+        for name in ([args.scenario] if args.scenario else SCENARIOS):
+            if name == "raias":
+                report_lanes(args)
+                continue
+            rng = random.Random(args.seed)
+            passes = plan_scenario(name, rng)
+            samples = synthesize(passes, args.interval, args.noise, args.dropout, args.spikes, rng)
+            report(f"Cenário '{name}'", samples, len(passes), args)
+    print()
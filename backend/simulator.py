@@ -0,0 +1,301 @@
+import argparse
+import heapq
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# O simulador usa o mesmo código de cliente da Raspberry Pi, com o GPIO simulado
+os.environ.setdefault("GPIO_BACKEND", "fake")
+
+import requests
+import raspberry_counter as client
+
+# Simulador de frota de dispositivos e gerador de carga para o backend.
+#
+#   python simulator.py --devices 500 --duration 120 --pattern mixed
+#
+# Cada dispositivo virtual envia contagens e heartbeats pelas mesmas funções do
+# raspberry_counter.py. Ao final é impresso um relatório com vazão, latências
+# p50/p95/p99 e taxa de erro por rota.
+
+PATTERNS = ("steady", "burst", "outage", "mixed")
+
+
+class RequestStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.status_codes = {}
+        self.schedule_lag = []
+
+    def record(self, route, elapsed, status):
+        with self.lock:
+            self.latencies.setdefault(route, []).append(elapsed)
+            self.status_codes.setdefault(route, {})
+            key = status if status is not None else "exceção"
+            self.status_codes[route][key] = self.status_codes[route].get(key, 0) + 1
+            if status is None or status >= 400:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def record_lag(self, lag):
+        with self.lock:
+            self.schedule_lag.append(lag)
+
+
+class RecordingSession(requests.Session):
+    # Mede cada requisição feita pelas funções do cliente, sem alterá-las
+    def __init__(self, stats):
+        super().__init__()
+        self.stats = stats
+
+    def request(self, method, url, *args, **kwargs):
+        route = route_name(url)
+        start = time.perf_counter()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except Exception:
+            self.stats.record(route, time.perf_counter() - start, None)
+            raise
+        self.stats.record(route, time.perf_counter() - start, response.status_code)
+        return response
+
+
+def route_name(url):
+    path = url.split("/api", 1)[-1]
+    if path.endswith("/heartbeat"):
+        return "/api/devices/<id>/heartbeat"
+    return "/api" + path
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(len(values) * fraction))
+    return values[index]
+
+
+class VirtualDevice:
+    def __init__(self, device_id, animal_type):
+        self.device_id = device_id
+        self.animal_type = animal_type
+        self.offline_until = 0.0
+        self.backlog = []
+        self.lock = threading.Lock()
+        self.sent = 0
+
+
+class FleetSimulator:
+    def __init__(self, args):
+        self.args = args
+        self.stats = RequestStats()
+        self.sessions = threading.local()
+        self.events = []
+        self.sequence = 0
+        self.random = random.Random(args.seed)
+        self.devices = []
+        self.start = None
+        self.schedule_lock = threading.Lock()
+
+    def session(self):
+        if not hasattr(self.sessions, "session"):
+            self.sessions.session = RecordingSession(self.stats)
+        return self.sessions.session
+
+    def schedule(self, at, action, device):
+        if at < self.args.duration:
+            self.sequence += 1
+            heapq.heappush(self.events, (at, self.sequence, action, device))
+
+    def login(self):
+        response = requests.post(
+            f"{client.API_URL}/login",
+            json={"username": self.args.username, "password": self.args.password},
+            timeout=10
+        )
+        if response.status_code != 200:
+            raise SystemExit(f"❌ Falha no login ({response.status_code}): {response.text}")
+        return response.json()["token"]
+
+    def register_devices(self):
+        headers = {"Authorization": f"Bearer {self.login()}"}
+        session = requests.Session()
+        for i in range(self.args.devices):
+            response = session.post(
+                f"{client.API_URL}/devices/register",
+                json={"name": f"Simulador {i + 1}", "location": "Simulação"},
+                headers=headers,
+                timeout=10
+            )
+            response.raise_for_status()
+            self.devices.append(VirtualDevice(response.json()["device"]["id"], client.ANIMAL_TYPE))
+
+    def plan(self):
+        args = self.args
+        pattern = args.pattern
+        per_second = args.rate / 60
+
+        for device in self.devices:
+            # Heartbeats com fase aleatória para não chegarem todos juntos
+            self.schedule(self.random.uniform(0, args.heartbeat_interval), "heartbeat", device)
+
+            if pattern in ("steady", "outage", "mixed") and per_second > 0:
+                at = self.random.expovariate(per_second)
+                while at < args.duration:
+                    self.schedule(at, "count", device)
+                    at += self.random.expovariate(per_second)
+
+            if pattern in ("burst", "mixed"):
+                # Manada passando pela porteira: vários animais em poucos segundos
+                burst_at = self.random.uniform(0, args.burst_interval)
+                while burst_at < args.duration:
+                    at = burst_at
+                    for _ in range(self.random.randint(args.herd_size // 2, args.herd_size)):
+                        self.schedule(at, "count", device)
+                        at += self.random.uniform(0.5, 2.0)
+                    burst_at += args.burst_interval
+
+            if pattern in ("outage", "mixed") and self.random.random() < args.outage_fraction:
+                begin = self.random.uniform(0, max(args.duration - args.outage_duration, 0))
+                self.schedule(begin, "link_down", device)
+                self.schedule(begin + args.outage_duration, "link_up", device)
+
+    def run_action(self, action, device, scheduled_at):
+        self.stats.record_lag(time.perf_counter() - self.start - scheduled_at)
+        session = self.session()
+
+        if action == "heartbeat":
+            if time.perf_counter() - self.start >= device.offline_until:
+                client.send_heartbeat(session=session, device_id=device.device_id)
+            self.schedule_later(scheduled_at + self.args.heartbeat_interval, "heartbeat", device)
+
+        elif action == "count":
+            event = client.make_count_event(1, device.animal_type, device_id=device.device_id)
+            with device.lock:
+                offline = time.perf_counter() - self.start < device.offline_until
+                if offline:
+                    device.backlog.append(event)
+            if offline:
+                return
+            if self.args.endpoint == "batch":
+                ok = client.send_count_batch([event], session=session) is not None
+            else:
+                ok = client.send_count(1, device.animal_type, session=session, device_id=device.device_id,
+                                       event_id=event["event_id"])
+            if ok:
+                device.sent += 1
+
+        elif action == "link_down":
+            device.offline_until = scheduled_at + self.args.outage_duration
+
+        elif action == "link_up":
+            # Ao voltar, o acúmulo é enviado em lotes como faz o uploader da Raspberry Pi
+            with device.lock:
+                backlog, device.backlog = device.backlog, []
+            for i in range(0, len(backlog), client.BATCH_MAX_SIZE):
+                results = client.send_count_batch(backlog[i:i + client.BATCH_MAX_SIZE], session=session)
+                if results is not None:
+                    device.sent += sum(1 for r in results if r["status"] == "created")
+
+    def schedule_later(self, at, action, device):
+        with self.schedule_lock:
+            self.schedule(at, action, device)
+
+    def run(self):
+        args = self.args
+        print(f"🚜 Registrando {args.devices} dispositivo(s) virtuais em {client.API_URL}...")
+        self.register_devices()
+        self.plan()
+
+        total_planned = sum(1 for e in self.events if e[2] == "count")
+        print(f"📅 {total_planned} contagens planejadas em {args.duration}s (padrão: {args.pattern})")
+        print(f"🚀 Gerando carga com {args.workers} workers...\n")
+
+        # As funções do cliente imprimem uma linha por envio; silencia durante a carga
+        real_stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        self.start = time.perf_counter()
+        last_progress = 0
+
+        try:
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                while True:
+                    with self.schedule_lock:
+                        if not self.events:
+                            break
+                        at, _, action, device = self.events[0]
+                        delay = self.start + at - time.perf_counter()
+                        if delay <= 0:
+                            heapq.heappop(self.events)
+                    if delay > 0:
+                        time.sleep(min(delay, 0.05))
+                        continue
+                    executor.submit(self.run_action, action, device, at)
+
+                    elapsed = time.perf_counter() - self.start
+                    if elapsed - last_progress >= 10:
+                        last_progress = elapsed
+                        real_stdout.write(f"   ⏱️  {elapsed:.0f}s / {args.duration}s\n")
+                        real_stdout.flush()
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+
+        self.report(time.perf_counter() - self.start)
+
+    def report(self, elapsed):
+        stats = self.stats
+        print("\n" + "=" * 78)
+        print("RELATÓRIO DA SIMULAÇÃO")
+        print("=" * 78)
+        print(f"Dispositivos: {len(self.devices)} | Duração real: {elapsed:.1f}s | "
+              f"Contagens aceitas: {sum(d.sent for d in self.devices)}")
+        print(f"\n{'Rota':<30}{'Req':>8}{'Req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'Erros':>9}")
+        print("-" * 78)
+        for route in sorted(stats.latencies):
+            latencies = sorted(stats.latencies[route])
+            errors = stats.errors.get(route, 0)
+            print(f"{route:<30}{len(latencies):>8}{len(latencies) / elapsed:>9.1f}"
+                  f"{percentile(latencies, 0.50) * 1000:>9.1f}"
+                  f"{percentile(latencies, 0.95) * 1000:>9.1f}"
+                  f"{percentile(latencies, 0.99) * 1000:>9.1f}"
+                  f"{errors / len(latencies):>9.1%}")
+        print("-" * 78)
+        for route in sorted(stats.status_codes):
+            codes = ", ".join(f"{code}: {n}" for code, n in sorted(stats.status_codes[route].items(), key=str))
+            print(f"{route}: {codes}")
+
+        lag = sorted(stats.schedule_lag)
+        print(f"\nAtraso do gerador p50/p99: {percentile(lag, 0.50) * 1000:.1f}/{percentile(lag, 0.99) * 1000:.1f} ms "
+              "(alto = aumente --workers; a carga real ficou abaixo da planejada)")
+        print("=" * 78 + "\n")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulador de frota de dispositivos e gerador de carga")
+    parser.add_argument("--url", default=client.API_URL, help="URL base da API (ex.: http://127.0.0.1:5000/api)")
+    parser.add_argument("--devices", type=int, default=100, help="Quantidade de dispositivos virtuais")
+    parser.add_argument("--duration", type=float, default=60, help="Duração da simulação em segundos")
+    parser.add_argument("--pattern", choices=PATTERNS, default="steady", help="Padrão de chegada dos animais")
+    parser.add_argument("--rate", type=float, default=2, help="Animais por minuto por dispositivo (fluxo contínuo)")
+    parser.add_argument("--burst-interval", type=float, default=30, help="Segundos entre manadas (padrão burst)")
+    parser.add_argument("--herd-size", type=int, default=20, help="Tamanho máximo de uma manada")
+    parser.add_argument("--outage-fraction", type=float, default=0.2, help="Fração de dispositivos que perdem o link")
+    parser.add_argument("--outage-duration", type=float, default=20, help="Duração da queda de link em segundos")
+    parser.add_argument("--heartbeat-interval", type=float, default=60, help="Segundos entre heartbeats")
+    parser.add_argument("--endpoint", choices=("single", "batch"), default="single",
+                        help="Envia cada contagem por /api/count ou /api/counts/batch")
+    parser.add_argument("--workers", type=int, default=64, help="Requisições simultâneas")
+    parser.add_argument("--username", default="admin", help="Usuário para registrar os dispositivos")
+    parser.add_argument("--password", default="admin123", help="Senha do usuário")
+    parser.add_argument("--seed", type=int, default=None, help="Semente para reproduzir a mesma carga")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    client.API_URL = args.url.rstrip("/")
+    FleetSimulator(args).run()
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+# Os módulos do backend são importados pelo nome, como nos scripts; o cliente da
+# Raspberry Pi roda com o GPIO simulado
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GPIO_BACKEND", "fake")
+
+
+@pytest.fixture
+def app(tmp_path):
+    # Um app e um banco por teste: filas, caches e threads ficam em app.extensions
+    from app import create_app, db, ingest_writer
+
+    app = create_app({
+        "SECRET_KEY": "teste",
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'teste.db'}",
+        "ARCHIVE_DIR": str(tmp_path / "archive"),
+    })
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        ingest_writer.stop()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(app):
+    # O usuário é criado direto no banco com um hash barato: o scrypt padrão do cadastro
+    # custaria centenas de ms em cada teste
+    from app import User, db
+    from werkzeug.security import generate_password_hash
+
+    with app.app_context():
+        db.session.add(User(username="teste", password=generate_password_hash("teste123", "pbkdf2:sha256:1")))
+        db.session.commit()
+    credentials = {"username": "teste", "password": "teste123"}
+    token = app.test_client().post("/api/login", json=credentials).get_json()["token"]
+    return {"Authorization": f"Bearer {token}"}
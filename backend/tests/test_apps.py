@@ -0,0 +1,32 @@
+import uuid
+
+from app import Count, create_app, db, ingest_writer
+
+# Dois apps no mesmo processo: cada um grava no seu banco e tem seus próprios caches
+
+
+def test_apps_do_not_share_writer_or_caches(app, tmp_path):
+    other = create_app({
+        "SECRET_KEY": "teste",
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'outro.db'}",
+        "ARCHIVE_DIR": str(tmp_path / "outro-archive"),
+    })
+    with other.app_context():
+        db.create_all()
+
+    try:
+        # O mesmo event_id no outro app não é reenvio: o atalho em memória é de cada app
+        event_id = str(uuid.uuid4())
+        for target, count in ((app, 3), (other, 5)):
+            response = target.test_client().post("/api/count", json={
+                "device_id": str(uuid.uuid4()), "count": count, "event_id": event_id
+            })
+            assert response.status_code == 201
+
+        for target, expected in ((app, [3]), (other, [5])):
+            with target.app_context():
+                assert db.session.execute(db.select(Count.count)).scalars().all() == expected
+    finally:
+        with other.app_context():
+            ingest_writer.stop()
+            db.engine.dispose()
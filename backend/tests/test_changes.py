@@ -0,0 +1,105 @@
+import base64
+import datetime
+import json
+import uuid
+
+import pytest
+
+import app as server
+
+# Sincronização incremental da lista do dia (/api/counts/changes)
+
+
+def post_count(client, count=1):
+    response = client.post("/api/count", json={"device_id": str(uuid.uuid4()), "count": count})
+    assert response.status_code == 201
+    return response.get_json()["data"]["id"]
+
+
+def changes(client, auth_headers, cursor=None, **headers):
+    query = f"?since={cursor}" if cursor else ""
+    return client.get(f"/api/counts/changes{query}", headers={**auth_headers, **headers})
+
+
+def test_first_sync_returns_the_whole_day(client, auth_headers):
+    count_id = post_count(client)
+    response = changes(client, auth_headers)
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body["reset"] is True
+    assert count_id in [count["id"] for count in body["counts"]]
+
+    day, last_id, _ = server.decode_changes_cursor(body["cursor"])
+    assert day == datetime.date.today()
+    assert last_id == max(count["id"] for count in body["counts"])
+
+
+def test_cursor_returns_only_newer_counts(client, auth_headers):
+    post_count(client)
+    body = changes(client, auth_headers).get_json()
+    _, last_id, _ = server.decode_changes_cursor(body["cursor"])
+
+    created = [post_count(client, count=2), post_count(client, count=3)]
+    # Sem a sobreposição, o cursor devolve exatamente o que veio depois de last_id
+    cursor = server.encode_changes_cursor(datetime.date.today(), last_id, False)
+    delta = changes(client, auth_headers, cursor).get_json()
+    assert delta["reset"] is False
+    assert [count["id"] for count in delta["counts"]] == sorted(created)
+    assert delta["total_today"] == body["total_today"] + 5
+    assert delta["records"] == body["records"] + 2
+
+
+def test_overlap_repeats_recent_counts(client, auth_headers):
+    count_id = post_count(client)
+    body = changes(client, auth_headers).get_json()
+    # O próximo pedido revisita os últimos SYNC_OVERLAP_MS antes do cursor
+    delta = changes(client, auth_headers, body["cursor"]).get_json()
+    assert count_id in [count["id"] for count in delta["counts"]]
+
+
+def test_unchanged_data_answers_304(client, auth_headers):
+    post_count(client)
+    first = changes(client, auth_headers)
+    again = changes(client, auth_headers, **{"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+
+
+def test_pages_follow_the_cursor(client, auth_headers, monkeypatch):
+    monkeypatch.setattr(server, "MAX_PAGE_SIZE", 2)
+    created = [post_count(client) for _ in range(5)]
+
+    seen = []
+    cursor = None
+    while True:
+        body = changes(client, auth_headers, cursor).get_json()
+        assert len(body["counts"]) <= 2
+        seen.extend(count["id"] for count in body["counts"])
+        cursor = body["cursor"]
+        if not body["has_more"]:
+            break
+    assert len(seen) == len(set(seen))
+    assert set(created) <= set(seen)
+
+
+def test_cursor_from_another_day_resets(client, auth_headers):
+    post_count(client)
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    cursor = server.encode_changes_cursor(yesterday, str(server.uuid7()), False)
+    assert changes(client, auth_headers, cursor).get_json()["reset"] is True
+
+
+def test_invalid_cursor_is_rejected(client, auth_headers):
+    assert changes(client, auth_headers, "lixo").status_code == 400
+    cursor = server.encode_changes_cursor(datetime.date.today(), "não é uuid", False)
+    assert changes(client, auth_headers, cursor).status_code == 400
+
+
+@pytest.mark.parametrize("cursor", [
+    [datetime.date.today().isoformat(), 123, True],
+    [datetime.date.today().isoformat(), ["x"], True],
+    [20261017, None, True],
+    [datetime.date.today().isoformat(), None],
+])
+def test_cursor_with_wrong_types_is_rejected(client, auth_headers, cursor):
+    raw = base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+    assert changes(client, auth_headers, raw).status_code == 400
@@ -0,0 +1,85 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from app import Count, HourlyCount, db, recent_events
+
+# Ingestão idempotente por event_id: pelo atalho em memória e pelo índice único
+
+
+def count_event(device_id, event_id, count=1):
+    return {"device_id": device_id, "count": count, "animal_type": "bovino", "event_id": event_id}
+
+
+def stored(app, device_id):
+    with app.app_context():
+        rows = db.session.execute(
+            db.select(Count.event_id).where(Count.device_id == device_id)
+        ).scalars().all()
+        total = db.session.execute(
+            db.select(db.func.sum(HourlyCount.total)).where(HourlyCount.device_id == device_id)
+        ).scalar()
+    return rows, total
+
+
+@pytest.mark.parametrize("forget", [False, True])
+def test_resent_count_is_not_counted_twice(app, client, forget):
+    device_id, event_id = str(uuid.uuid4()), str(uuid.uuid4())
+    first = client.post("/api/count", json=count_event(device_id, event_id, 3))
+    assert first.status_code == 201
+
+    if forget:
+        # Sem o atalho em memória (outro worker, reinício) o índice único decide
+        with app.app_context():
+            recent_events.entries.clear()
+    again = client.post("/api/count", json=count_event(device_id, event_id, 3))
+    assert again.status_code == 200
+    assert again.get_json()["duplicate"] is True
+    assert again.get_json()["id"] == first.get_json()["data"]["id"]
+
+    assert stored(app, device_id) == ([event_id], 3)
+
+
+def test_batch_marks_repeated_events_as_duplicates(app, client):
+    device_id = str(uuid.uuid4())
+    sent, repeated = str(uuid.uuid4()), str(uuid.uuid4())
+    assert client.post("/api/count", json=count_event(device_id, sent)).status_code == 201
+    with app.app_context():
+        recent_events.entries.clear()
+
+    response = client.post("/api/counts/batch", json={"events": [
+        count_event(device_id, sent),
+        count_event(device_id, repeated),
+        count_event(device_id, repeated),
+    ]})
+    body = response.get_json()
+    assert response.status_code == 201
+    assert [result["status"] for result in body["results"]] == ["duplicate", "created", "duplicate"]
+    assert (body["accepted"], body["duplicates"]) == (1, 2)
+    assert body["results"][1]["id"] == body["results"][2]["id"]
+
+    rows, total = stored(app, device_id)
+    assert sorted(rows) == sorted([sent, repeated])
+    assert total == 2
+
+
+def test_concurrent_resends_store_one_row_per_event(app):
+    device_id = str(uuid.uuid4())
+    event_ids = [str(uuid.uuid4()) for _ in range(5)]
+
+    def send(event_id):
+        return app.test_client().post("/api/count", json=count_event(device_id, event_id)).status_code
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        statuses = list(executor.map(send, event_ids * 4))
+    assert statuses.count(201) == 5
+    assert statuses.count(200) == 15
+
+    rows, total = stored(app, device_id)
+    assert sorted(rows) == sorted(event_ids)
+    assert total == 5
+
+
+def test_event_id_is_validated(client):
+    response = client.post("/api/count", json=count_event(str(uuid.uuid4()), "x" * 65))
+    assert response.status_code == 400
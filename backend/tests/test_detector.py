@@ -0,0 +1,72 @@
+import random
+
+import pytest
+import raspberry_counter as client
+import replay
+from detector import CooldownDetector, PresenceDetector
+
+# O detector com histerese sobre os traces sintéticos do replay.py
+
+
+def presence_detector():
+    return PresenceDetector(
+        enter_threshold=client.DISTANCE_THRESHOLD,
+        exit_threshold=client.DISTANCE_EXIT_THRESHOLD,
+        min_occupancy=client.MIN_OCCUPANCY,
+        min_gap=client.MIN_GAP,
+        window=client.SMOOTHING_WINDOW
+    )
+
+
+def scenario(name, seed):
+    rng = random.Random(seed)
+    passes = replay.plan_scenario(name, rng)
+    samples = replay.synthesize(passes, client.SAMPLE_INTERVAL, 1.0, 0.05, 0.01, rng)
+    return passes, samples
+
+
+@pytest.mark.parametrize("name", ["espaçado", "fila", "parada", "misto"])
+@pytest.mark.parametrize("seed", [1, 42])
+def test_counts_each_animal_once(name, seed):
+    passes, samples = scenario(name, seed)
+    detections, _ = replay.replay(presence_detector(), samples)
+    assert len(detections) == len(passes)
+
+
+def test_cooldown_detector_misses_animals_in_a_queue():
+    # Referência da regra antiga: em fila o cooldown junta vários animais em uma contagem
+    passes, samples = scenario("fila", 42)
+    detections, _ = replay.replay(CooldownDetector(threshold=client.DISTANCE_THRESHOLD, cooldown=3), samples)
+    assert len(detections) < len(passes)
+
+
+def test_animal_standing_under_the_sensor_counts_once():
+    detector = presence_detector()
+    samples = [(i * 0.06, 60.0) for i in range(10)]
+    samples += [(0.6 + i * 0.06, 8.0) for i in range(200)]
+    samples += [(12.6 + i * 0.06, 60.0) for i in range(10)]
+    detections, _ = replay.replay(detector, samples)
+    assert len(detections) == 1
+    assert detections[0].duration == pytest.approx(12.0, abs=0.2)
+
+
+def test_short_occupancy_is_rejected():
+    detector = presence_detector()
+    samples = [(0.0, 60.0), (0.06, 8.0), (0.12, 8.0), (0.18, 60.0), (0.24, 60.0), (0.30, 60.0), (0.36, 60.0)]
+    detections, _ = replay.replay(detector, samples)
+    assert detections == []
+    assert detector.rejected == 1
+
+
+def test_occupancy_in_progress_is_closed_by_finish():
+    detector = presence_detector()
+    for i in range(10):
+        assert detector.feed(i * 0.06, 8.0) is None
+    detection = detector.finish(0.6)
+    assert detection is not None
+    assert detection.min_distance == 8.0
+
+
+def test_exit_threshold_below_enter_threshold_is_invalid():
+    with pytest.raises(ValueError):
+        PresenceDetector(enter_threshold=20, exit_threshold=15)
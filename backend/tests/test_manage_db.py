@@ -0,0 +1,187 @@
+import datetime
+import random
+import uuid
+from collections import Counter
+
+import manage_db
+import pytest
+from app import (
+    ArchiveMonth, Count, DailyCount, HourlyCount, count_version, create_app, db, ingest_writer,
+    update_rollups, uuid7, uuid7_millis
+)
+from werkzeug.security import generate_password_hash
+
+# Comandos do manage_db.py sobre um banco temporário
+
+# Esquema da primeira versão publicada (PRAGMA user_version = 0)
+BASELINE_SCHEMA = [
+    """CREATE TABLE user (
+        id INTEGER NOT NULL, username VARCHAR(80) NOT NULL, password VARCHAR(255) NOT NULL,
+        created_at DATETIME, PRIMARY KEY (id), UNIQUE (username))""",
+    """CREATE TABLE count (
+        id VARCHAR(36) NOT NULL, device_id VARCHAR(36) NOT NULL, count INTEGER NOT NULL,
+        animal_type VARCHAR(50), timestamp DATETIME, PRIMARY KEY (id))""",
+    """CREATE TABLE device (
+        id VARCHAR(36) NOT NULL, name VARCHAR(100) NOT NULL, location VARCHAR(200),
+        status VARCHAR(20), registered_at DATETIME, last_seen DATETIME, PRIMARY KEY (id))""",
+]
+
+
+@pytest.fixture
+def command_app(tmp_path, monkeypatch):
+    # Os comandos usam o app do módulo manage_db; aqui ele aponta para um banco vazio
+    app = create_app({
+        "SECRET_KEY": "teste",
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'antigo.db'}",
+        "ARCHIVE_DIR": str(tmp_path / "archive"),
+    })
+    monkeypatch.setattr(manage_db, "app", app)
+    yield app
+    with app.app_context():
+        ingest_writer.stop()
+        db.engine.dispose()
+
+
+def login(app):
+    credentials = {"username": "teste", "password": "teste123"}
+    token = app.test_client().post("/api/login", json=credentials).get_json()["token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def read_all_counts(app, headers):
+    counts, cursor = [], ""
+    while True:
+        body = app.test_client().get(f"/api/counts?limit=50{cursor}", headers=headers).get_json()
+        counts.extend(body["counts"])
+        if not body["next_cursor"]:
+            return counts
+        cursor = f"&cursor={body['next_cursor']}"
+
+
+def rollup_totals(model):
+    return {
+        (row.bucket, row.device_id, row.animal_type): (row.total, row.records)
+        for row in db.session.execute(db.select(model)).scalars()
+    }
+
+
+def expected_rollups(rows, truncate):
+    totals = {}
+    for _, device_id, count, animal_type, timestamp in rows:
+        key = (truncate(timestamp), device_id, animal_type)
+        total, records = totals.get(key, (0, 0))
+        totals[key] = (total + count, records + 1)
+    return totals
+
+
+def test_migration_rekeys_counts_without_changing_them(command_app):
+    rng = random.Random(7)
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    timestamps = [now - datetime.timedelta(minutes=rng.randrange(40 * 24 * 60)) for _ in range(150)]
+    timestamps += timestamps[:10]  # Instantes repetidos: a ordem entre eles vem do id antigo
+    rows = [
+        (str(uuid.uuid4()), rng.choice(["d1", "d2", "d3"]), rng.randint(1, 5),
+         rng.choice(["bovino", "ovino", "suíno"]), timestamp)
+        for timestamp in timestamps
+    ]
+
+    with command_app.app_context():
+        connection = db.session.connection()
+        for statement in BASELINE_SCHEMA:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql(
+            "INSERT INTO count (id, device_id, count, animal_type, timestamp) VALUES (?, ?, ?, ?, ?)",
+            [(*row[:4], row[4].isoformat(" ")) for row in rows]
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO user (username, password) VALUES (?, ?)",
+            ("teste", generate_password_hash("teste123", "pbkdf2:sha256:1"))
+        )
+        db.session.commit()
+
+    manage_db.migrate()
+
+    with command_app.app_context():
+        assert manage_db.get_schema_version() == manage_db.LATEST_SCHEMA_VERSION
+        migrated = db.session.execute(
+            db.select(Count.id, Count.device_id, Count.count, Count.animal_type, Count.timestamp)
+            .order_by(Count.id)
+        ).all()
+
+        # Mesmas linhas, com IDs novos em ordem de timestamp e com o instante do timestamp
+        assert Counter(row[1:] for row in migrated) == Counter(row[1:] for row in rows)
+        assert [row.timestamp for row in migrated] == sorted(timestamps)
+        for row in migrated:
+            assert uuid7_millis(row.id) == int(row.timestamp.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+        for model, truncate in ((HourlyCount, lambda ts: ts.replace(minute=0, second=0)),
+                                (DailyCount, lambda ts: ts.replace(hour=0, minute=0, second=0))):
+            assert rollup_totals(model) == expected_rollups(rows, truncate)
+
+    headers = login(command_app)
+    counts = read_all_counts(command_app, headers)
+    assert Counter((c["device_id"], c["count"], c["animal_type"], c["timestamp"]) for c in counts) == Counter(
+        (device_id, count, animal_type, timestamp.isoformat()) for _, device_id, count, animal_type, timestamp in rows
+    )
+
+    stats = command_app.test_client().get("/api/counts/stats?breakdown=type", headers=headers).get_json()
+    assert stats["total_animals"] == sum(row[2] for row in rows)
+    assert stats["total_records"] == len(rows)
+    per_type = Counter()
+    for _, _, count, animal_type, _ in rows:
+        per_type[animal_type] += count
+    assert {group["animal_type"]: group["total_animals"] for group in stats["by_type"]} == per_type
+
+
+def api_snapshot(client, headers):
+    # Tudo o que o painel lê de contagens antigas: totais, páginas, série por dia e CSV
+    pages, cursor = [], ""
+    while True:
+        body = client.get(f"/api/counts?limit=7{cursor}", headers=headers).get_json()
+        pages.append(body["counts"])
+        if not body["next_cursor"]:
+            break
+        cursor = f"&cursor={body['next_cursor']}"
+    return {
+        "stats": client.get("/api/counts/stats?breakdown=device,type", headers=headers).get_json(),
+        "pages": pages,
+        "device": client.get("/api/counts?device=d2&limit=1000", headers=headers).get_json()["counts"],
+        "series": client.get(
+            "/api/counts/series?granularity=day&from=2000-01-01T00:00:00&to=2100-01-01T00:00:00", headers=headers
+        ).get_json(),
+        "csv": client.get("/api/counts/export?format=csv", headers=headers).data,
+    }
+
+
+def test_archived_month_reads_like_the_database(app, client, auth_headers):
+    rng = random.Random(3)
+    now = datetime.datetime.utcnow()
+    rows = []
+    for _ in range(120):
+        timestamp = now - datetime.timedelta(minutes=rng.randrange(100 * 24 * 60))
+        rows.append({"id": str(uuid7(timestamp.replace(tzinfo=datetime.timezone.utc).timestamp())),
+                     "device_id": rng.choice(["d1", "d2", "d3"]), "count": rng.randint(1, 5),
+                     "animal_type": rng.choice(["bovino", "ovino"]), "event_id": None, "timestamp": timestamp})
+    month = f"{now - datetime.timedelta(days=70):%Y-%m}"
+    in_month = [row for row in rows if f"{row['timestamp']:%Y-%m}" == month]
+
+    with app.app_context():
+        db.session.execute(db.insert(Count), rows)
+        update_rollups(rows)
+        db.session.commit()
+    before = api_snapshot(client, auth_headers)
+    assert sum(len(page) for page in before["pages"]) == len(rows)
+    assert len(before["csv"].decode().splitlines()) == len(rows) + 1
+
+    with app.app_context():
+        cutoff = now - datetime.timedelta(days=manage_db.ARCHIVE_MIN_DAYS)
+        assert manage_db.archive_month(month, cutoff) == len(in_month) > 0
+        assert db.session.get(ArchiveMonth, month).total == sum(row["count"] for row in in_month)
+        start, end = manage_db.month_bounds(month)
+        assert db.session.execute(
+            db.select(db.func.count()).where(Count.timestamp >= start, Count.timestamp < end)
+        ).scalar() == 0
+        # O arquivamento roda em outro processo; a versão sobe para não responder do cache
+        count_version.bump()
+
+    assert api_snapshot(client, auth_headers) == before
@@ -0,0 +1,99 @@
+import time
+
+import fake_gpio
+import pytest
+import raspberry_counter as client
+
+# Medição por interrupção (EchoTimer) e filtro das leituras, sobre o GPIO simulado.
+# Cada teste usa pinos próprios porque os sensores simulados são globais.
+
+
+def test_filter_readings_takes_mean_of_inliers():
+    assert client.filter_readings([40.0, 41.0, 42.0]) == 41.0
+
+
+def test_filter_readings_rejects_outliers():
+    # O eco espúrio a 10cm fica fora da tolerância em torno da mediana
+    assert client.filter_readings([40.0, 40.5, 10.0, 41.0, 40.5]) == 40.5
+
+
+def test_filter_readings_requires_majority_of_valid_readings():
+    assert client.filter_readings([40.0, None, None]) is None
+    assert client.filter_readings([40.0, 40.0, None]) == 40.0
+    assert client.filter_readings([None]) is None
+
+
+class ScriptedClock:
+    # Substitui o módulo time do cliente: perf_counter_ns devolve instantes fixos, então a
+    # largura do pulso não depende do agendamento das threads
+    def __init__(self, *timestamps_ns):
+        self.timestamps = list(timestamps_ns)
+
+    def perf_counter_ns(self):
+        return self.timestamps.pop(0)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def pulse_ns(distance):
+    return round(2 * distance / fake_gpio.SPEED_OF_SOUND_CM_S * 1e9)
+
+
+def test_echo_timer_converts_pulse_width(monkeypatch):
+    timer = client.EchoTimer(110)
+    monkeypatch.setattr(client, "time", ScriptedClock(1_000_000, 1_000_000 + pulse_ns(50.0)))
+    try:
+        timer.trigger(109)
+        timer.on_edge(110)
+        timer.on_edge(110)
+        assert timer.wait(0.1) == pytest.approx(50.0, abs=0.01)
+    finally:
+        timer.close()
+
+
+def test_echo_timer_ignores_edges_after_the_fall(monkeypatch):
+    timer = client.EchoTimer(112)
+    monkeypatch.setattr(client, "time", ScriptedClock(0, pulse_ns(30.0), pulse_ns(90.0)))
+    try:
+        timer.trigger(111)
+        for _ in range(3):
+            timer.on_edge(112)
+        assert timer.wait(0.1) == pytest.approx(30.0, abs=0.01)
+    finally:
+        timer.close()
+
+
+def echo_timer(trig, echo, **sensor):
+    fake_gpio.setup(trig, fake_gpio.OUT)
+    fake_gpio.setup(echo, fake_gpio.IN)
+    fake_gpio.attach_sensor(trig, echo, **sensor)
+    return client.EchoTimer(echo)
+
+
+def test_echo_timer_times_out_without_echo():
+    timer = echo_timer(103, 104, distance=None)
+    try:
+        assert timer.read(103, timeout=0.05) is None
+    finally:
+        timer.close()
+
+
+def test_measure_distances_reads_sensors_of_a_slot_together(monkeypatch):
+    # As bordas do GPIO simulado vêm de threads; numa máquina carregada a largura do pulso
+    # medida varia, então aqui só se verifica que cada sensor do slot é disparado e lido
+    monkeypatch.setattr(client, "ECHO_TIMEOUT", 0.5)
+    sensors = client.build_sensors([
+        {"lane": "esquerda", "trig": 105, "echo": 106},
+        {"lane": "direita", "trig": 107, "echo": 108},
+    ])
+    fakes = [fake_gpio.attach_sensor(105, 106, distance=30.0), fake_gpio.attach_sensor(107, 108, distance=150.0)]
+    for sensor in sensors:
+        sensor.setup()
+    try:
+        distances = client.measure_distances(sensors, samples=3)
+    finally:
+        for sensor in sensors:
+            sensor.close()
+    assert None not in distances
+    assert [fake.triggers for fake in fakes] == [3, 3]
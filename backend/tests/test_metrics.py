@@ -0,0 +1,32 @@
+import uuid
+
+import pytest
+from app import INGEST_METRIC_MAX_TYPES, OTHER_ANIMAL_TYPE, Metrics, db
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+# Métricas do Prometheus
+
+
+def test_ingest_metrics_are_bounded_by_animal_type(app):
+    tracker = Metrics()
+    rows = [
+        {"device_id": str(uuid.uuid4()), "animal_type": f"tipo {n}", "count": 2}
+        for n in range(INGEST_METRIC_MAX_TYPES + 20)
+    ]
+    tracker.observe_ingest(rows)
+    assert len(tracker.ingested) == INGEST_METRIC_MAX_TYPES + 1
+    assert tracker.ingested[OTHER_ANIMAL_TYPE] == (20, 40)
+    with app.app_context():
+        assert "device_id" not in tracker.render()
+
+
+
+def test_failed_query_does_not_leak_start_time(app):
+    with app.app_context():
+        with db.engine.connect() as connection:
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM tabela_inexistente"))
+            connection.rollback()
+            connection.execute(text("SELECT 1"))
+            assert connection.info["query_started"] == []
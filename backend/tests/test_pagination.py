@@ -0,0 +1,64 @@
+import base64
+import json
+import uuid
+
+import pytest
+
+# Paginação por cursor (keyset) e streaming NDJSON de /api/counts
+
+
+def post_counts(client, device_id, total):
+    response = client.post("/api/counts/batch", json={"events": [
+        {"device_id": device_id, "count": 1} for _ in range(total)
+    ]})
+    assert response.get_json()["accepted"] == total
+
+
+def test_pages_cover_every_count_once(client, auth_headers):
+    device_id = str(uuid.uuid4())
+    post_counts(client, device_id, 7)
+
+    ids = []
+    cursor = ""
+    while True:
+        body = client.get(f"/api/counts?device={device_id}&limit=3{cursor}", headers=auth_headers).get_json()
+        assert len(body["counts"]) <= 3
+        ids.extend(count["id"] for count in body["counts"])
+        if not body["next_cursor"]:
+            break
+        cursor = f"&cursor={body['next_cursor']}"
+    assert len(ids) == len(set(ids)) == 7
+
+
+def test_ndjson_streams_one_count_per_line(client, auth_headers):
+    device_id = str(uuid.uuid4())
+    post_counts(client, device_id, 4)
+    headers = {**auth_headers, "Accept": "application/x-ndjson"}
+
+    lines = client.get(f"/api/counts?device={device_id}", headers=headers).data.decode().splitlines()
+    assert [json.loads(line)["device_id"] for line in lines] == [device_id] * 4
+
+    lines = client.get(f"/api/counts?device={device_id}&limit=2", headers=headers).data.decode().splitlines()
+    assert len(lines) == 2
+
+
+def test_invalid_parameters_are_rejected(client, auth_headers):
+    headers = {**auth_headers, "Accept": "application/x-ndjson"}
+    assert client.get("/api/counts?limit=-1", headers=headers).status_code == 400
+    assert client.get("/api/counts?cursor=lixo", headers=auth_headers).status_code == 400
+
+
+def encoded(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+@pytest.mark.parametrize("cursor", [
+    ["2026-01-01T00:00:00", 123],
+    ["2026-01-01T00:00:00", ["x"]],
+    [123, "01a1496e-77cd-7d28-86a6-dc0fc8d3166e"],
+    ["2026-01-01T00:00:00"],
+    {"timestamp": "2026-01-01T00:00:00"},
+])
+def test_malformed_cursor_is_rejected(client, auth_headers, cursor):
+    response = client.get(f"/api/counts?cursor={encoded(cursor)}", headers=auth_headers)
+    assert response.status_code == 400
@@ -0,0 +1,59 @@
+import time
+import uuid
+
+from app import RateLimiter
+
+# Token bucket das rotas de ingestão
+
+
+def test_bucket_allows_burst_then_asks_to_wait():
+    limiter = RateLimiter()
+    assert [limiter.take("a", rate=1, burst=3) for _ in range(3)] == [0, 0, 0]
+    wait = limiter.take("a", rate=1, burst=3)
+    assert 0 < wait <= 1
+    assert limiter.limited == 1
+
+
+def test_bucket_refills_over_time():
+    limiter = RateLimiter()
+    assert limiter.take("a", rate=100, burst=1) == 0
+    assert limiter.take("a", rate=100, burst=1) > 0
+    time.sleep(0.03)
+    assert limiter.take("a", rate=100, burst=1) == 0
+
+
+def test_zero_rate_disables_the_limit():
+    limiter = RateLimiter()
+    assert all(limiter.take("a", rate=0, burst=0) == 0 for _ in range(100))
+
+
+def test_buckets_are_bounded():
+    limiter = RateLimiter(max_keys=3)
+    for n in range(10):
+        limiter.take(n, rate=1, burst=1)
+    assert list(limiter.buckets) == [7, 8, 9]
+
+
+def test_count_over_device_limit_gets_429(client, monkeypatch):
+    monkeypatch.setitem(client.application.config, "RATE_LIMIT_DEVICE_BURST", 2)
+    device_id = str(uuid.uuid4())
+    statuses = [client.post("/api/count", json={"device_id": device_id, "count": 1}).status_code for _ in range(3)]
+    assert statuses == [201, 201, 429]
+
+    response = client.post("/api/count", json={"device_id": device_id, "count": 1})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_invalid_device_ids_are_rejected_before_the_limiter(client):
+    response = client.post("/api/counts/batch", json={"events": [
+        {"device_id": ["x"]},
+        {"device_id": {}},
+        {"device_id": str(uuid.uuid4()), "count": 1},
+    ]})
+    assert response.status_code == 201
+    assert [result["status"] for result in response.get_json()["results"]] == ["rejected", "rejected", "created"]
+
+    for device_id in ([], {}):
+        response = client.post("/api/count", json={"device_id": device_id})
+        assert response.status_code == 400
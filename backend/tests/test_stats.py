@@ -0,0 +1,68 @@
+import datetime
+import uuid
+
+import app as server
+from app import Count, compute_stats, db, update_rollups, uuid7
+
+# Estatísticas calculadas pelos agregados por hora/dia em vez de varrer count
+
+
+def count_row(device_id, timestamp, count):
+    return {"id": str(uuid7()), "device_id": device_id, "count": count, "animal_type": "bovino",
+            "event_id": None, "timestamp": timestamp}
+
+
+def expected_stats(rows, windows):
+    today_start, week_ago, month_ago = windows
+    return {
+        "total_animals": sum(row.count for row in rows),
+        "total_records": len(rows),
+        "today": sum(row.count for row in rows if row.timestamp >= today_start),
+        "this_week": sum(row.count for row in rows if row.timestamp >= week_ago),
+        "this_month": sum(row.count for row in rows if row.timestamp >= month_ago),
+    }
+
+
+def test_windows_match_the_raw_counts(app, monkeypatch):
+    now = datetime.datetime.now().replace(minute=37, second=12)
+    windows = (now.replace(hour=0, minute=0, second=0, microsecond=0),
+               now - datetime.timedelta(days=7), now - datetime.timedelta(days=30))
+    monkeypatch.setattr(server, "stats_windows", lambda: windows)
+
+    # Linhas dos dois lados de cada limite: minutos, horas e dias em torno do início das janelas
+    device_id = str(uuid.uuid4())
+    offsets = [datetime.timedelta(minutes=1), datetime.timedelta(minutes=40),
+               datetime.timedelta(hours=2), datetime.timedelta(days=1)]
+    timestamps = [now - datetime.timedelta(days=45), now - datetime.timedelta(minutes=5)]
+    for start in windows:
+        for offset in offsets:
+            timestamps += [start - offset, start + offset]
+    rows = [count_row(device_id, timestamp, n + 1) for n, timestamp in enumerate(timestamps)]
+
+    with app.app_context():
+        db.session.execute(db.insert(Count), rows)
+        update_rollups(rows)
+        db.session.commit()
+
+        stored = db.session.execute(db.select(Count.device_id, Count.count, Count.timestamp)).all()
+        assert compute_stats() == expected_stats(stored, windows)
+        [by_device] = [group for group in compute_stats("device_id") if group["device_id"] == device_id]
+        assert by_device == {"device_id": device_id, **expected_stats(
+            [row for row in stored if row.device_id == device_id], windows)}
+
+
+def query_plan(connection, query):
+    compiled = query.compile(db.engine)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    return [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)]
+
+
+def test_stats_never_scan_the_counts(app):
+    # O broker de SSE recalcula isto a cada STATS_PUSH_INTERVAL em todos os workers:
+    # count só pode ser lido por faixa do índice de timestamp
+    with app.app_context():
+        connection = db.session.connection()
+        for column_name in (None, "device_id", "animal_type"):
+            for query in server.stats_queries(column_name):
+                for step in query_plan(connection, query):
+                    assert not step.startswith("SCAN count ") and step != "SCAN count", step
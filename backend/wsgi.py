@@ -0,0 +1,13 @@
+from app import DEFAULT_CONFIG, create_app
+
+# Ponto de entrada para servidores WSGI de produção:
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# A configuração vem das variáveis de ambiente (SECRET_KEY, DATABASE_URL, DB_POOL_SIZE...).
+# O esquema do banco não é criado aqui; use "python manage_db.py migrate" antes de subir.
+
+app = create_app()
+
+if app.config['SECRET_KEY'] == DEFAULT_CONFIG['SECRET_KEY']:
+    print("⚠️  SECRET_KEY padrão em uso; defina a variável de ambiente SECRET_KEY em produção")
@@ -1,6 +1,14 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Lock, User, LogOut, CheckCircle, XCircle, Activity, TrendingUp, Calendar, BarChart3, Wifi, WifiOff, PawPrint } from 'lucide-react';
 
+// Junta contagens novas à lista local sem repetir as que já estão nela
+const mergeCounts = (prev, incoming) => {
+  const ids = new Set(incoming.map((count) => count.id));
+  return [...incoming, ...prev.filter((count) => !ids.has(count.id))]
+    .sort((a, b) => (a.timestamp < b.timestamp ? 1 : -1))
+    .slice(0, 10);
+};
+
 function App() {
   const [view, setView] = useState('login');
   const [username, setUsername] = useState('');
@@ -20,15 +28,83 @@ function App() {
   });
   const [recentCounts, setRecentCounts] = useState([]);
   const [devices, setDevices] = useState([]);
+  const countsCursor = useRef(null);
 
   const API_URL = 'http://localhost:5000/api';
 
   useEffect(() => {
-    if (token && view === 'dashboard') {
-      loadDashboardData();
-      const interval = setInterval(loadDashboardData, 5000); // Atualiza a cada 5 segundos
-      return () => clearInterval(interval);
+    if (!token || view !== 'dashboard') {
+      return undefined;
     }
+
+    let source = null;
+    let retry = null;
+    let closed = false;
+
+    const connect = async () => {
+      // EventSource não envia cabeçalhos: a URL leva um ticket de curta duração, não o token
+      let ticket = null;
+      try {
+        const response = await fetch(`${API_URL}/stream/ticket`, {
+          method: 'POST',
+          headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (response.ok) {
+          ticket = (await response.json()).ticket;
+        }
+      } catch (error) {
+        console.error('Erro ao obter ticket do stream:', error);
+      }
+      if (closed) {
+        return;
+      }
+      if (!ticket) {
+        retry = setTimeout(connect, 3000);
+        return;
+      }
+
+      source = new EventSource(`${API_URL}/stream?ticket=${encodeURIComponent(ticket)}`);
+
+      // Ao conectar e a cada reconexão; a lista do dia só recebe o que mudou desde o cursor
+      source.onopen = () => loadDashboardData();
+
+      // O ticket expira, então a reconexão automática do EventSource falharia: reconecta
+      // com um ticket novo
+      source.onerror = () => {
+        source.close();
+        retry = setTimeout(connect, 3000);
+      };
+
+      source.addEventListener('stats', (event) => {
+        setStats(JSON.parse(event.data));
+      });
+
+      source.addEventListener('count', (event) => {
+        setRecentCounts((prev) => mergeCounts(prev, JSON.parse(event.data)));
+      });
+
+      source.addEventListener('device', (event) => {
+        const device = JSON.parse(event.data);
+        setDevices((prev) => prev.some((d) => d.id === device.id)
+          ? prev.map((d) => (d.id === device.id ? device : d))
+          : [...prev, device]);
+      });
+
+      source.addEventListener('device_removed', (event) => {
+        const { id } = JSON.parse(event.data);
+        setDevices((prev) => prev.filter((d) => d.id !== id));
+      });
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      if (source) {
+        source.close();
+      }
+    };
   }, [token, view]);
 
   const loadDashboardData = async () => {
@@ -41,13 +117,7 @@ function App() {
         setStats(statsData);
       }
 
-      const countsResponse = await fetch(`${API_URL}/counts/today`, {
-        headers: { 'Authorization': `Bearer ${token}` }
-      });
-      if (countsResponse.ok) {
-        const countsData = await countsResponse.json();
-        setRecentCounts(countsData.counts.slice(-10).reverse());
-      }
+      await syncTodayCounts();
 
       const devicesResponse = await fetch(`${API_URL}/devices`, {
         headers: { 'Authorization': `Bearer ${token}` }
@@ -61,6 +131,26 @@ function App() {
     }
   };
 
+  const syncTodayCounts = async () => {
+    let hasMore = true;
+    while (hasMore) {
+      const since = countsCursor.current ? `?since=${encodeURIComponent(countsCursor.current)}` : '';
+      const response = await fetch(`${API_URL}/counts/changes${since}`, {
+        headers: { 'Authorization': `Bearer ${token}` }
+      });
+      if (!response.ok) {
+        // Cursor rejeitado: a próxima sincronização recomeça do dia inteiro
+        countsCursor.current = null;
+        return;
+      }
+      const data = await response.json();
+      const counts = data.counts.reverse();
+      setRecentCounts((prev) => mergeCounts(data.reset ? [] : prev, counts));
+      countsCursor.current = data.cursor;
+      hasMore = data.has_more;
+    }
+  };
+
   const showMessage = (msg, type) => {
     setMessage(msg);
     setMessageType(type);
@@ -127,6 +217,7 @@ function App() {
 
   const handleLogout = () => {
     setToken('');
+    countsCursor.current = null;
     setUsername('');
     setPassword('');
     setView('login');
@@ -156,12 +247,8 @@ function App() {
     return date.toLocaleString('pt-BR');
   };
 
-  const isDeviceActive = (lastSeen) => {
-    const lastSeenDate = new Date(lastSeen);
-    const now = new Date();
-    const diffMinutes = (now - lastSeenDate) / 1000 / 60;
-    return diffMinutes < 5; 
-  };
+  // O servidor deriva o status da idade do último heartbeat e avisa as mudanças pelo stream
+  const isDeviceActive = (device) => device.status === 'ativo';
 
   return (
     <div className="min-h-screen bg-gradient-to-br from-gray-900 via-purple-900 to-violet-900 flex items-center justify-center p-4">
@@ -301,7 +388,7 @@ function App() {
                       <div key={device.id} className="bg-white/5 border border-white/20 rounded-lg p-4 hover:bg-white/10 transition">
                         <div className="flex justify-between items-start">
                           <div className="flex items-center gap-3">
-                            {isDeviceActive(device.last_seen) ? (
+                            {isDeviceActive(device) ? (
                               <Wifi className="text-green-400" size={20} />
                             ) : (
                               <WifiOff className="text-red-400" size={20} />
@@ -315,11 +402,11 @@ function App() {
                             </div>
                           </div>
                           <span className={`text-xs px-2 py-1 rounded-full ${
-                            isDeviceActive(device.last_seen) 
+                            isDeviceActive(device) 
                               ? 'bg-green-500/20 text-green-300 border border-green-400/30' 
                               : 'bg-red-500/20 text-red-300 border border-red-400/30'
                           }`}>
-                            {isDeviceActive(device.last_seen) ? 'Ativo' : 'Inativo'}
+                            {isDeviceActive(device) ? 'Ativo' : 'Inativo'}
                           </span>
                         </div>
                       </div>